@@ -0,0 +1,68 @@
+"""
+Measure how the time and peak memory of many cardinality fan-out scale with
+fan-out depth when each row already has a nested list of children.
+
+Each level of depth applies a many cardinality rule with `fanout` values to
+every row, so there are fanout ** depth rows at the end, each with the same
+`children` nested rows.
+
+    python -m benchmarks.fanout [children] [fanout] [max depth]
+"""
+
+import sys
+import time
+import tracemalloc
+
+from graphcore.call_graph import Node
+from graphcore.query_plan import QueryPlan
+from graphcore.result_set import ResultSet, Result
+
+
+def query_plan(children, fanout, depth):
+    result_set = ResultSet([Result({
+        'item.id': 0,
+        'item.children': ResultSet([
+            Result({'id': i}) for i in range(children)
+        ]),
+    })], [{'item.children': [{}]}])
+
+    plan = QueryPlan(result_set, ['item.id'])
+    previous = 'item.id'
+    for level in range(depth):
+        path = 'item.f{}'.format(level)
+        plan.append(Node(
+            None, [previous], [path], lambda **kwargs: range(fanout), 'many'
+        ))
+        previous = path
+
+    return plan
+
+
+def measure(children, fanout, depth):
+    # time and memory are measured separately since tracemalloc slows
+    # everything down
+    plan = query_plan(children, fanout, depth)
+    start = time.time()
+    plan.forward(exception_handler=None)
+    duration = time.time() - start
+
+    plan = query_plan(children, fanout, depth)
+    tracemalloc.start()
+    plan.forward(exception_handler=None)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return len(plan.result_set), duration * 1000, peak / 1e6
+
+
+def main(children=1000, fanout=10, max_depth=3):
+    print('children: {}; fanout: {}'.format(children, fanout))
+    print('{:>6} {:>8} {:>12} {:>12}'.format('depth', 'rows', 'ms', 'MB'))
+    for depth in range(1, max_depth + 1):
+        print('{:>6} {:>8} {:>12.1f} {:>12.1f}'.format(
+            depth, *measure(children, fanout, depth)
+        ))
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
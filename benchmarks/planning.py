@@ -0,0 +1,112 @@
+"""
+Measure how long it takes to search, optimize and plan a query as the number
+of clauses in the query grows.  Exits with an error if planning the filtered
+query doesn't scale linearly.
+
+    python -m benchmarks.planning
+"""
+
+import timeit
+
+from graphcore.graphcore import Graphcore, QuerySearch
+
+
+def wide_graphcore(size):
+    """ size independent properties all computed from user.id """
+    gc = Graphcore()
+    for i in range(size):
+        gc.register_rule(
+            ['user.id'], 'user.p{}'.format(i), function=lambda id: id
+        )
+    return gc
+
+
+def wide_query(size):
+    query = {'user.id': 1}
+    for i in range(size):
+        query['user.p{}?'.format(i)] = None
+    return query
+
+
+def chain_graphcore(size):
+    """ a chain of size properties, each computed from the previous one """
+    gc = Graphcore()
+    gc.register_rule(['user.id'], 'user.p0', function=lambda id: id)
+    for i in range(1, size):
+        gc.register_rule(
+            ['user.p{}'.format(i - 1)], 'user.p{}'.format(i),
+            function=lambda x: x
+        )
+    return gc
+
+
+def chain_query(size):
+    return {'user.id': 1, 'user.p{}?'.format(size - 1): None}
+
+
+def filtered_graphcore(size):
+    """ size properties computed from user.id, each of which another,
+    filtered property is computed from """
+    gc = wide_graphcore(size)
+    for i in range(size):
+        gc.register_rule(
+            ['user.p{}'.format(i)], 'user.q{}'.format(i),
+            function=lambda x: x
+        )
+    return gc
+
+
+def filtered_query(size):
+    query = wide_query(size)
+    for i in range(size):
+        query['user.q{}>'.format(i)] = 0
+    return query
+
+
+def _time(fn, number):
+    return min(timeit.repeat(fn, number=number, repeat=3)) / number * 1000
+
+
+def time_search(gc, query, number):
+    return _time(lambda: QuerySearch(gc, query).backward(), number)
+
+
+def time_compile(gc, query, number):
+    # call compile directly so that the plan cache is not involved
+    return _time(lambda: gc.compile(query), number)
+
+
+def main(sizes=(10, 50, 100, 200, 400, 800), max_slowdown=4):
+    """ max_slowdown: the most the compile time per clause of the filtered
+    query may grow from the smallest to the largest size """
+    print('all times in ms')
+    print('{:>6} {:>12} {:>12} {:>12} {:>12} {:>15}'.format(
+        'size', 'wide search', 'wide total', 'chain search', 'chain total',
+        'filtered total',
+    ))
+    filtered_per_clause = []
+    for size in sizes:
+        number = max(1, 2000 // size)
+        wide = wide_graphcore(size), wide_query(size)
+        chain = chain_graphcore(size), chain_query(size)
+        filtered = filtered_graphcore(size), filtered_query(size)
+        filtered_total = time_compile(*(filtered + (number,)))
+        filtered_per_clause.append(filtered_total / size)
+        print('{:>6} {:>12.3f} {:>12.3f} {:>12.3f} {:>12.3f} {:>15.3f}'.format(
+            size,
+            time_search(*(wide + (number,))),
+            time_compile(*(wide + (number,))),
+            time_search(*(chain + (number,))),
+            time_compile(*(chain + (number,))),
+            filtered_total,
+        ))
+
+    slowdown = filtered_per_clause[-1] / filtered_per_clause[0]
+    assert slowdown <= max_slowdown, (
+        'planning the filtered query is superlinear: the time per clause '
+        'grew {:.1f}x'.format(slowdown)
+    )
+
+
+if __name__ == '__main__':
+    main()
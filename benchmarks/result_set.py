@@ -0,0 +1,72 @@
+"""
+Compare the time and peak memory of executing a query with a ResultSet and
+with a ColumnarResultSet as the number of rows grows.
+
+    python -m benchmarks.result_set [max rows]
+"""
+
+import sys
+import time
+import tracemalloc
+
+from graphcore.graphcore import Graphcore
+
+
+def graphcore(rows, columnar):
+    gc = Graphcore(columnar=columnar)
+    gc.property_type('user', 'books', 'book')
+
+    gc.register_rule(
+        [], 'user.id', function=lambda: range(rows // 10), cardinality='many'
+    )
+    gc.register_rule(
+        ['user.id'], 'user.books.id', cardinality='many',
+        function=lambda id: range(id * 10, id * 10 + 10),
+    )
+    gc.register_rule(['book.id'], 'book.name', function=lambda id: 'book')
+    gc.register_rule(['book.id'], 'book.pages', function=lambda id: id % 300)
+
+    return gc
+
+
+QUERY = {
+    'user.id?': None,
+    'user.books': [{
+        'id?': None,
+        'name?': None,
+        'pages?': None,
+    }],
+}
+
+
+def measure(rows, columnar):
+    compiled_query = graphcore(rows, columnar).compile(QUERY)
+
+    # time and memory are measured separately since tracemalloc slows
+    # everything down
+    start = time.time()
+    compiled_query.plan({}).forward(exception_handler=None)
+    duration = time.time() - start
+
+    tracemalloc.start()
+    compiled_query.plan({}).forward(exception_handler=None)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return duration * 1000, peak / 1e6
+
+
+def main(max_rows=100000):
+    print('{:>8} {:>12} {:>12} {:>12} {:>12}'.format(
+        'rows', 'rows ms', 'rows MB', 'columnar ms', 'columnar MB'
+    ))
+    rows = 1000
+    while rows <= max_rows:
+        print('{:>8} {:>12.1f} {:>12.1f} {:>12.1f} {:>12.1f}'.format(
+            rows, *(measure(rows, False) + measure(rows, True))
+        ))
+        rows *= 10
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,53 @@
+"""
+Compare the time SQLQuery.__call__ spends building its SQL with and without
+the statement cache.  The driver does nothing, so only graphcore's own work
+is measured.
+
+    python -m benchmarks.sql_statement [calls]
+"""
+
+import sys
+import time
+
+import sql_query_dict
+
+from graphcore.sql_query import SQLQuery
+
+
+def sql_query():
+    query = SQLQuery(
+        ['users', 'books'], ['users.name', 'books.title'], {
+            'users.age>': 18,
+            'books.user_id': sql_query_dict.mysql_col('users.id'),
+        }, input_mapping={'id': 'users.id'}, param_style='?',
+    )
+    query.driver = lambda sql, vals: []
+    return query
+
+
+def uncached(query, id):
+    sql, vals = sql_query_dict.select(
+        query.tables, query.selects, query._where({'id': id}),
+        limit=query.limit, param_style=query.param_style
+    )
+    return query.driver(sql, vals)
+
+
+def measure(function, calls):
+    query = sql_query()
+
+    start = time.time()
+    for id in range(calls):
+        function(query, id)
+    return (time.time() - start) * 1e6 / calls
+
+
+def main(calls=100000):
+    print('uncached: {:.2f}us per call'.format(measure(uncached, calls)))
+    print('cached:   {:.2f}us per call'.format(measure(
+        lambda query, id: query(id=id), calls
+    )))
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
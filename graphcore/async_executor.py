@@ -0,0 +1,84 @@
+"""
+The AsyncioExecutor runs rules which are coroutine functions (or return
+awaitables) from the synchronous QueryPlan.  The calls are awaited
+concurrently on an event loop running in a background thread.
+
+This module uses python 3 syntax.
+"""
+
+import asyncio
+import inspect
+import threading
+
+from .executors import Executor
+
+
+class AsyncioExecutor(Executor):
+    """ await the calls of a chunk concurrently on an event loop.  Chunks
+    are run one after another, so chunk_size is the maximum number of calls
+    awaited at once.  None means no limit.
+
+    Regular functions are called directly on the event loop, so they should
+    not block.
+    """
+
+    def __init__(self, chunk_size=None, loop=None):
+        """
+        loop: a running event loop to use instead of starting one
+        """
+        super(AsyncioExecutor, self).__init__(chunk_size)
+        self._loop = loop
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def loop(self):
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(
+                    target=self._loop.run_forever, daemon=True
+                )
+                self._thread.start()
+            return self._loop
+
+    def map(self, function, calls, cast=None, rule_id=None):
+        calls = list(calls)
+        if self.chunk_size is None:
+            chunk_size = len(calls)
+        else:
+            chunk_size = self.chunk_size
+        return asyncio.run_coroutine_threadsafe(
+            self._map(function, calls, cast, max(chunk_size, 1)), self.loop
+        ).result()
+
+    async def _map(self, function, calls, cast, chunk_size):
+        outcomes = []
+        for i in range(0, len(calls), chunk_size):
+            outcomes.extend(await asyncio.gather(*[
+                self._call(function, kwargs, cast)
+                for kwargs in calls[i:i + chunk_size]
+            ]))
+        return outcomes
+
+    async def _call(self, function, kwargs, cast):
+        try:
+            value = function(**kwargs)
+            if inspect.isawaitable(value):
+                value = await value
+            if cast is not None:
+                value = cast(value)
+        except Exception as e:
+            return (None, e)
+        return (value, None)
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            if self._thread is None:
+                return
+
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._loop.close()
+            self._loop = None
+            self._thread = None
@@ -0,0 +1,42 @@
+import asyncio
+
+from .graphcore import Graphcore
+from .async_executor import AsyncioExecutor
+
+
+def test_asyncio_executor():
+    running = [0]
+    max_running = [0]
+
+    async def slow_square(id):
+        running[0] += 1
+        max_running[0] = max(max_running[0], running[0])
+        await asyncio.sleep(0.01)
+        running[0] -= 1
+        return id * id
+
+    with AsyncioExecutor(chunk_size=4) as executor:
+        gc = Graphcore(rule_executor=executor)
+        gc.register_rule(
+            [], 'user.id', function=lambda: range(10), cardinality='many'
+        )
+        gc.register_rule(['user.id'], 'user.square', function=slow_square)
+        gc.register_rule(['user.id'], 'user.cube', function=lambda id: id ** 3)
+
+        assert gc.query({
+            'user.id?': None, 'user.square?': None, 'user.cube?': None,
+        }) == [
+            {'user.id': i, 'user.square': i * i, 'user.cube': i ** 3}
+            for i in range(10)
+        ]
+
+    assert max_running[0] == 4
+
+
+def test_asyncio_executor_exception():
+    async def fail(x):
+        raise ValueError(x)
+
+    with AsyncioExecutor() as executor:
+        (value, exception), = executor.map(fail, [{'x': 1}])
+    assert isinstance(exception, ValueError)
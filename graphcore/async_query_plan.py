@@ -0,0 +1,154 @@
+"""
+The AsyncQueryPlan executes a QueryPlan on an asyncio event loop.  Rule
+functions may be coroutine functions (or any function which returns an
+awaitable).  The calls a node makes for each row, and the calls of nodes which
+don't depend on each other, are run at the same time with asyncio.gather.
+
+This module uses python 3 syntax and is only imported by Graphcore.aquery.
+"""
+
+import asyncio
+import inspect
+
+from .call_table import CallTable
+from .query_plan import QueryPlan, is_batch
+from .result_set import default_exception_handler
+from .rule import Cardinality
+
+
+class AsyncQueryPlan(QueryPlan):
+    """ Execute a sequential list of nodes on an asyncio event loop.
+
+    Before a node is applied, it and every later node whose inputs are
+    already available are called for each distinct set of inputs in the
+    current ResultSet.  All of those calls run concurrently and their
+    outcomes are recorded in a CallTable.  The nodes are then applied in plan
+    order by replaying the recorded outcomes, so the results are identical to
+    the synchronous QueryPlan.
+
+    Regular functions are called directly on the event loop, so they should
+    not block.
+    """
+
+    def __init__(self, result_set, output_paths, concurrency=None):
+        """
+        concurrency: the maximum number of rule calls to await at once.
+            None means no limit.
+        """
+        super(AsyncQueryPlan, self).__init__(result_set, output_paths)
+        self.concurrency = concurrency
+
+    async def _record(self, call_table, node, kwargs, semaphore):
+        if semaphore is not None:
+            async with semaphore:
+                return await self._record(call_table, node, kwargs, None)
+
+        try:
+            value = node.function(**kwargs)
+            if inspect.isawaitable(value):
+                value = await value
+
+            if node.cardinality == Cardinality.many:
+                # the recorded value may be replayed for more than one row
+                value = list(value)
+        except Exception as e:
+            call_table.set_exception(kwargs, e)
+        else:
+            call_table.set_value(kwargs, value)
+
+    async def _record_batch(self, call_table, node, calls, semaphore):
+        if not calls:
+            return
+
+        if semaphore is not None:
+            async with semaphore:
+                return await self._record_batch(
+                    call_table, node, calls, None
+                )
+
+        if node.cardinality == Cardinality.many:
+            cast = list
+        else:
+            cast = None
+
+        try:
+            values = node.function.call_batch(calls)
+            if inspect.isawaitable(values):
+                values = await values
+        except Exception as e:
+            call_table.set_batch_exception(calls, e)
+        else:
+            call_table.set_batch(calls, values, cast)
+
+    async def _acall_table(self, node, semaphore):
+        """ call node.function concurrently for each distinct set of inputs
+        in the current ResultSet.  Returns None if the inputs can't be
+        collected yet """
+        calls = self._call_kwargs(node)
+        if calls is None:
+            return None
+
+        call_table = CallTable()
+        distinct_calls = call_table.unrecorded(calls)
+
+        if is_batch(node.function):
+            await self._record_batch(call_table, node, distinct_calls,
+                                     semaphore)
+            return call_table
+
+        await asyncio.gather(*[
+            self._record(call_table, node, kwargs, semaphore)
+            for kwargs in distinct_calls
+        ])
+
+        return call_table
+
+    async def _aprefetch(self, indexes, semaphore):
+        call_tables = await asyncio.gather(*[
+            self._acall_table(self.nodes[i], semaphore) for i in indexes
+        ])
+        return dict(zip(indexes, call_tables))
+
+    async def aforward(self, exception_handler, limit=None):
+        if self.concurrency:
+            semaphore = asyncio.Semaphore(self.concurrency)
+        else:
+            semaphore = None
+
+        available_at = self._available_at()
+        limits_after = self._limits_after(limit)
+        self._apply_limits(limits_after[-1])
+
+        pending = set()
+        call_tables = {}
+
+        for i, node in enumerate(self.nodes):
+            pending.update(available_at[i])
+
+            if i not in call_tables:
+                call_tables.update(
+                    await self._aprefetch(sorted(pending), semaphore)
+                )
+                pending.clear()
+            pending.discard(i)
+
+            call_table = call_tables.pop(i)
+            if call_table is None:
+                # the inputs couldn't be collected before the nodes ahead of
+                # this one were applied, so collect and await them now
+                call_table = await self._acall_table(node, semaphore)
+
+            if call_table is not None:
+                self._apply_node(node, exception_handler, call_table.call)
+            else:
+                # the inputs still can't be collected, so let apply_rule
+                # report why
+                self._apply_node(node, exception_handler)
+
+            self._apply_limits(limits_after[i])
+
+    async def aexecute(self, exception_handler=default_exception_handler,
+                       limit=None):
+        await self.aforward(exception_handler, limit=limit)
+
+        return self.outputs()
@@ -0,0 +1,264 @@
+import asyncio
+import types
+
+import pytest
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from .graphcore import Graphcore
+from .async_query_plan import AsyncQueryPlan
+from .parameter import Parameter
+from .reflect_module import ModuleReflector
+from .result_set import NoResult
+from .rule_cache import TTLCache
+
+
+def run(coroutine):
+    return asyncio.new_event_loop().run_until_complete(coroutine)
+
+
+@pytest.fixture
+def gc():
+    gc = Graphcore()
+
+    gc.property_type('user', 'books', 'book')
+
+    @gc.rule([], 'user.id', cardinality='many')
+    async def user_ids():
+        return [1, 2, 3]
+
+    @gc.rule(['user.id'], 'user.name')
+    async def user_name(id):
+        await asyncio.sleep(0)
+        if id == 2:
+            raise NoResult()
+        return 'user{}'.format(id)
+
+    @gc.rule(['user.id'], 'user.books.id', cardinality='many')
+    async def user_books_id(id):
+        await asyncio.sleep(0)
+        return [id * 10, id * 10 + 1]
+
+    @gc.rule(['book.id'], 'book.title')
+    def book_title(id):
+        return 'book{}'.format(id)
+
+    return gc
+
+
+def test_aquery(gc):
+    ret = run(gc.aquery({
+        'user.id?': None,
+        'user.name?': None,
+    }))
+
+    assert ret == [
+        {'user.id': 1, 'user.name': 'user1'},
+        {'user.id': 3, 'user.name': 'user3'},
+    ]
+
+
+def test_aquery_nested(gc):
+    ret = run(gc.aquery({
+        'user.id': 1,
+        'user.books': [{
+            'id?': None,
+            'title?': None,
+        }],
+    }))
+
+    assert ret == [{'user.books': [
+        {'id': 10, 'title': 'book10'},
+        {'id': 11, 'title': 'book11'},
+    ]}]
+
+
+def test_aquery_rows_run_concurrently():
+    gc = Graphcore()
+    gc.register_rule(
+        [], 'user.id', function=lambda: [1, 2, 3], cardinality='many'
+    )
+
+    started = []
+    all_started = asyncio.Event()
+
+    @gc.rule(['user.id'], 'user.name')
+    async def user_name(id):
+        started.append(id)
+        if len(started) == 3:
+            all_started.set()
+
+        # if the rows were called one after another, this would time out
+        await asyncio.wait_for(all_started.wait(), 5)
+        return str(id)
+
+    ret = run(gc.aquery({
+        'user.name?': None,
+    }))
+
+    assert ret == [{'user.name': str(i)} for i in [1, 2, 3]]
+
+
+def test_aquery_concurrency_limit():
+    gc = Graphcore(concurrency=2)
+    gc.register_rule(
+        [], 'user.id', function=lambda: range(10), cardinality='many'
+    )
+
+    in_flight = [0]
+    max_in_flight = [0]
+
+    @gc.rule(['user.id'], 'user.name')
+    async def user_name(id):
+        in_flight[0] += 1
+        max_in_flight[0] = max(max_in_flight[0], in_flight[0])
+        await asyncio.sleep(0.001)
+        in_flight[0] -= 1
+        return str(id)
+
+    ret = run(gc.aquery({
+        'user.name?': None,
+    }))
+
+    assert len(ret) == 10
+    assert max_in_flight[0] == 2
+
+    max_in_flight[0] = 0
+    run(gc.aquery({
+        'user.name?': None,
+    }, concurrency=5))
+
+    assert max_in_flight[0] == 5
+
+
+def test_aquery_module_reflector():
+    async def name(user_id):
+        return 'Bob{}'.format(user_id)
+
+    module = types.ModuleType('async_test_module')
+    module.name = name
+
+    gc = Graphcore()
+    ModuleReflector(gc, module, 'user')
+
+    ret = run(gc.aquery({
+        'user.id': 1,
+        'user.name?': None,
+    }))
+
+    assert ret == [{'user.name': 'Bob1'}]
+
+
+def test_prepared_query_aexecute(gc):
+    prepared = gc.prepare({
+        'user.id': Parameter('user_id'),
+        'user.name?': None,
+    })
+
+    assert run(prepared.aexecute(user_id=5)) == [{'user.name': 'user5'}]
+
+
+def test_aquery_batch(gc):
+    calls = []
+
+    @gc.rule(['book.id'], 'book.name', batch=True)
+    async def book_name(id):
+        calls.append(id)
+        return ['book{}'.format(i) for i in id]
+
+    ret = run(gc.aquery({
+        'user.id?': None,
+        'user.books': [{
+            'name?': None,
+        }],
+    }))
+
+    assert calls == [[10, 11, 20, 21, 30, 31]]
+    assert ret == [{
+        'user.id': i,
+        'user.books': [
+            {'name': 'book{}'.format(i * 10)},
+            {'name': 'book{}'.format(i * 10 + 1)},
+        ],
+    } for i in [1, 2, 3]]
+
+
+def test_aquery_awaits_nodes_which_were_not_prefetched(gc):
+    _call_kwargs = AsyncQueryPlan._call_kwargs
+    prefetched = set()
+
+    def call_kwargs(self, node):
+        # the inputs of each node can't be collected the first time
+        if node not in prefetched:
+            prefetched.add(node)
+            return None
+        return _call_kwargs(self, node)
+
+    with mock.patch.object(AsyncQueryPlan, '_call_kwargs', call_kwargs):
+        ret = run(gc.aquery({
+            'user.id?': None,
+            'user.name?': None,
+        }))
+
+    assert ret == [
+        {'user.id': 1, 'user.name': 'user1'},
+        {'user.id': 3, 'user.name': 'user3'},
+    ]
+
+
+def test_aquery_cache():
+    gc = Graphcore()
+    cache = TTLCache()
+    calls = []
+
+    @gc.rule([], 'user.id', cardinality='many')
+    def user_ids():
+        return [1, 2, 3]
+
+    @gc.rule(['user.id'], 'user.name', cache=cache)
+    async def user_name(id):
+        calls.append(id)
+        await asyncio.sleep(0)
+        if id == 2:
+            raise NoResult()
+        return 'user{}'.format(id)
+
+    query = {'user.id?': None, 'user.name?': None}
+    expected = [
+        {'user.id': 1, 'user.name': 'user1'},
+        {'user.id': 3, 'user.name': 'user3'},
+    ]
+    assert run(gc.aquery(query)) == expected
+    assert run(gc.aquery(query)) == expected
+
+    # the awaited values, and NoResult, were cached
+    assert calls == [1, 2, 3]
+    assert cache.stats()['hits'] == 2
+    assert cache.stats()['negative_hits'] == 1
+
+
+def test_aquery_batch_cache():
+    gc = Graphcore()
+    calls = []
+
+    @gc.rule([], 'user.id', cardinality='many')
+    def user_ids():
+        return [1, 2, 3]
+
+    @gc.rule(['user.id'], 'user.name', batch=True, cache=TTLCache())
+    async def user_name(id):
+        calls.append(id)
+        return ['user{}'.format(i) for i in id]
+
+    assert run(gc.aquery({'user.id': 1, 'user.name?': None})) == [
+        {'user.name': 'user1'}
+    ]
+    assert run(gc.aquery({'user.id?': None, 'user.name?': None})) == [
+        {'user.id': i, 'user.name': 'user{}'.format(i)} for i in [1, 2, 3]
+    ]
+
+    # only the calls which missed the cache were passed on
+    assert calls == [[1], [2, 3]]
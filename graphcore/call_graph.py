@@ -65,7 +65,16 @@ from .relation import Relation
 class Node(object):
 
     def __init__(self, call_graph, incoming_paths, outgoing_paths, function,
-                 cardinality, relations=None):
+                 cardinality, relations=None, stats_key=None, rule_id=None,
+                 executor=None, pure=False):
+        """
+        stats_key: the key of the node's rule in RuleStats.  See
+            rule_stats.stats_key
+        rule_id: the id of the node's rule in Rules, if function is the
+            registered rule function
+        executor: the Executor the node's rule was registered with
+        pure: True if the node's rule was registered as pure
+        """
         self.call_graph = call_graph
         self.incoming_paths = tuple(sorted(map(Path, incoming_paths)))
         self.outgoing_paths = tuple(map(Path, outgoing_paths))
@@ -77,9 +86,23 @@ class Node(object):
             assert len(relations) == len(outgoing_paths)
             self.relations = tuple(relations)
 
+        self.stats_key = stats_key
+        self.rule_id = rule_id
+        self.executor = executor
+        self.pure = pure
+
         # this is useful for QueryPlanner to iterate over CallGraph
         self._visited = False
 
+    def rule_attributes(self):
+        """ return the kwargs of Node which describe the node's rule """
+        return {
+            'stats_key': self.stats_key,
+            'rule_id': self.rule_id,
+            'executor': self.executor,
+            'pure': self.pure,
+        }
+
     def incoming_edges(self):
         return [self.call_graph.edge(path) for path in self.incoming_paths]
 
@@ -187,11 +210,12 @@ class CallGraph(object):
         self.edges = {}
 
     def add_node(self, incoming_paths, outgoing_paths, function, cardinality,
-                 relations=None):
+                 relations=None, **rule_attributes):
+        """ rule_attributes: see Node """
         # build a node
         node = Node(
             self, incoming_paths, outgoing_paths, function, cardinality,
-            relations
+            relations, **rule_attributes
         )
         self.nodes.append(node)
 
@@ -213,6 +237,29 @@ class CallGraph(object):
         for path in node.outgoing_paths:
             self.edge(path).setter = None
 
+    def replace_node(self, node, incoming_paths, outgoing_paths, function,
+                     cardinality, relations=None, **rule_attributes):
+        """ replace node with a new node built from the arguments, keeping
+        node's position in self.nodes.  The new node keeps the
+        rule_attributes of node (see Node) which aren't given, except for
+        rule_id if function is a different function """
+        attributes = node.rule_attributes()
+        if function is not node.function:
+            attributes['rule_id'] = None
+        attributes.update(rule_attributes)
+
+        index = self.nodes.index(node)
+        self.remove_node(node)
+
+        new_node = self.add_node(
+            incoming_paths, outgoing_paths, function, cardinality, relations,
+            **attributes
+        )
+        self.nodes.pop()
+        self.nodes.insert(index, new_node)
+
+        return new_node
+
     def edge(self, path):
         path = Path(path)
 
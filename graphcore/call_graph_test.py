@@ -1,4 +1,4 @@
-from .call_graph import Edge, Node
+from .call_graph import CallGraph, Edge, Node
 from .relation import Relation
 
 
@@ -29,3 +29,33 @@ def test_explain():
         '>', 1
     ),))
     assert '>' in node.explain()
+
+
+def test_replace_node_keeps_rule_attributes():
+    def f():
+        pass
+
+    def g():
+        pass
+
+    call_graph = CallGraph()
+    node = call_graph.add_node(
+        [], ['a.x'], f, 'one', stats_key='a.x = f()', rule_id='a.x = f()',
+        executor='executor', pure=True,
+    )
+
+    new_node = call_graph.replace_node(node, [], ['a.x'], f, 'one')
+    assert new_node.rule_attributes() == node.rule_attributes()
+
+    # rule_id names the registered function, so it isn't kept for another
+    new_node = call_graph.replace_node(new_node, [], ['a.x'], g, 'one')
+    assert new_node.rule_attributes() == {
+        'stats_key': 'a.x = f()', 'rule_id': None, 'executor': 'executor',
+        'pure': True,
+    }
+
+    new_node = call_graph.replace_node(
+        new_node, [], ['a.x'], g, 'one', pure=False
+    )
+    assert not new_node.pure
+    assert call_graph.nodes == [new_node]
@@ -0,0 +1,254 @@
+"""
+A CallTable holds the outcomes of calling a rule function with a number of
+different kwargs so that the calls can be made ahead of time (in parallel,
+in a batch, ...) and then replayed as QueryPlan applies the node to each row
+of the ResultSet.
+"""
+
+import threading
+from collections import deque
+
+from .equality_mixin import freeze
+
+
+def call_key(kwargs):
+    """ return a hashable key for kwargs or None if one of the values can't
+    be hashed """
+    key = freeze(kwargs)
+    try:
+        hash(key)
+    except TypeError:
+        return None
+    return key
+
+
+class CallTable(object):
+
+    def __init__(self):
+        # {call_key(kwargs): (value, exception)}
+        self._outcomes = {}
+        # [(kwargs, (value, exception))] for kwargs which can't be hashed
+        self._unhashable = []
+
+        # the number of calls call_memoized replayed instead of making
+        self.replays = 0
+
+    def _outcome(self, kwargs):
+        """ return the recorded (value, exception) or None """
+        key = call_key(kwargs)
+        if key is not None:
+            return self._outcomes.get(key)
+
+        for other_kwargs, outcome in self._unhashable:
+            if other_kwargs == kwargs:
+                return outcome
+        return None
+
+    def _set_outcome(self, kwargs, outcome):
+        key = call_key(kwargs)
+        if key is not None:
+            self._outcomes[key] = outcome
+        else:
+            self._unhashable.append((kwargs, outcome))
+
+    def __contains__(self, kwargs):
+        return self._outcome(kwargs) is not None
+
+    def __len__(self):
+        return len(self._outcomes) + len(self._unhashable)
+
+    def set_value(self, kwargs, value):
+        self._set_outcome(kwargs, (value, None))
+
+    def set_exception(self, kwargs, exception):
+        self._set_outcome(kwargs, (None, exception))
+
+    def unrecorded(self, calls):
+        """ return the distinct kwargs in calls which have no outcome """
+        seen = CallTable()
+        ret = []
+        for kwargs in calls:
+            if kwargs not in self and kwargs not in seen:
+                seen.set_value(kwargs, None)
+                ret.append(kwargs)
+        return ret
+
+    def set_batch(self, calls, values, cast=None):
+        """ record values[i] as the outcome of calls[i].  Exception instances
+        in values are recorded as raised.  cast is applied to the other
+        values """
+        values = list(values)
+        if len(values) != len(calls):
+            self.set_batch_exception(calls, ValueError(
+                'batch function returned {} values for {} rows'.format(
+                    len(values), len(calls)
+                )
+            ))
+            return
+
+        for kwargs, value in zip(calls, values):
+            if isinstance(value, Exception):
+                self.set_exception(kwargs, value)
+                continue
+
+            try:
+                if cast is not None:
+                    value = cast(value)
+            except Exception as e:
+                self.set_exception(kwargs, e)
+            else:
+                self.set_value(kwargs, value)
+
+    def set_batch_exception(self, calls, exception):
+        for kwargs in calls:
+            self.set_exception(kwargs, exception)
+
+    def record_batch(self, fn, calls, cast=None):
+        """ make one call to fn.call_batch with every kwargs in calls which
+        hasn't been recorded yet """
+        calls = self.unrecorded(calls)
+        if not calls:
+            return
+
+        try:
+            values = fn.call_batch(calls)
+        except Exception as e:
+            self.set_batch_exception(calls, e)
+        else:
+            self.set_batch(calls, values, cast)
+
+    def record_mapped(self, fn, calls, executor, cast=None, rule_id=None):
+        """ call fn with every kwargs in calls which hasn't been recorded
+        yet using executor.  See executors """
+        calls = self.unrecorded(calls)
+        if not calls:
+            return
+
+        for kwargs, outcome in zip(
+            calls, executor.map(fn, calls, cast, rule_id=rule_id)
+        ):
+            self._set_outcome(kwargs, outcome)
+
+    def record(self, fn, kwargs):
+        """ call fn with kwargs and record the value it returned or the
+        exception it raised """
+        if kwargs in self:
+            return
+
+        try:
+            self.set_value(kwargs, fn(**kwargs))
+        except Exception as e:
+            self.set_exception(kwargs, e)
+
+    def _replay(self, kwargs):
+        """ return the (value, exception) call replays or None """
+        return self._outcome(kwargs)
+
+    def call(self, fn, kwargs):
+        """ replay the recorded outcome of calling fn with kwargs.  If there
+        is no recorded outcome, fn is called. """
+        outcome = self._replay(kwargs)
+        if outcome is None:
+            return fn(**kwargs)
+
+        value, exception = outcome
+        if exception is not None:
+            raise exception
+        return value
+
+    def call_memoized(self, fn, kwargs):
+        """ like call, but if there is no recorded outcome, the outcome of
+        calling fn is recorded so that later calls with the same kwargs are
+        replayed """
+        if kwargs in self:
+            self.replays += 1
+        else:
+            self.record(fn, kwargs)
+
+        return self.call(fn, kwargs)
+
+
+class CallSequence(CallTable):
+    """ a CallTable which records the outcome of every call, even of equal
+    kwargs, and replays each outcome once, in the order they were recorded.
+    Calls to rules which aren't pure can't be deduplicated. """
+
+    def _queue(self, kwargs, create=False):
+        """ return the deque of outcomes recorded for kwargs """
+        key = call_key(kwargs)
+        if key is not None:
+            queue = self._outcomes.get(key)
+            if queue is None and create:
+                queue = self._outcomes[key] = deque()
+            return queue
+
+        for other_kwargs, queue in self._unhashable:
+            if other_kwargs == kwargs:
+                return queue
+        if create:
+            queue = deque()
+            self._unhashable.append((kwargs, queue))
+            return queue
+        return None
+
+    def _outcome(self, kwargs):
+        queue = self._queue(kwargs)
+        if queue:
+            return queue[0]
+        return None
+
+    def _set_outcome(self, kwargs, outcome):
+        self._queue(kwargs, create=True).append(outcome)
+
+    def _replay(self, kwargs):
+        queue = self._queue(kwargs)
+        if queue:
+            return queue.popleft()
+        return None
+
+    def __len__(self):
+        """ the number of outcomes which haven't been replayed yet """
+        return sum(
+            len(queue) for queue in self._outcomes.values()
+        ) + sum(len(queue) for _, queue in self._unhashable)
+
+    def unrecorded(self, calls):
+        """ every kwargs in calls gets a call of its own """
+        return list(calls)
+
+    def record(self, fn, kwargs):
+        try:
+            self.set_value(kwargs, fn(**kwargs))
+        except Exception as e:
+            self.set_exception(kwargs, e)
+
+
+class MemoStats(object):
+    """ thread safe running totals of memoized rule calls """
+
+    def __init__(self):
+        self.calls = 0
+        self.calls_saved = 0
+
+        self._lock = threading.Lock()
+
+    def add(self, calls, calls_saved):
+        with self._lock:
+            self.calls += calls
+            self.calls_saved += calls_saved
+
+    def reset(self):
+        with self._lock:
+            self.calls = 0
+            self.calls_saved = 0
+
+    def stats(self):
+        return {
+            'calls': self.calls,
+            'calls_saved': self.calls_saved,
+        }
+
+    def __repr__(self):
+        return '<MemoStats calls:{calls}; calls_saved:{calls_saved}>'.format(
+            **self.stats()
+        )
@@ -0,0 +1,111 @@
+import pytest
+
+from .call_table import CallTable, CallSequence
+
+
+def test_call_table_replays_values():
+    calls = []
+
+    def fn(x):
+        calls.append(x)
+        return x * 2
+
+    call_table = CallTable()
+    call_table.record(fn, {'x': 1})
+    call_table.record(fn, {'x': 1})
+
+    assert len(call_table) == 1
+    assert call_table.call(fn, {'x': 1}) == 2
+    assert calls == [1]
+
+
+def test_call_table_replays_exceptions():
+    def fn(x):
+        raise ValueError(x)
+
+    call_table = CallTable()
+    call_table.record(fn, {'x': 1})
+
+    with pytest.raises(ValueError):
+        call_table.call(fn, {'x': 1})
+
+
+def test_call_table_falls_back_to_calling():
+    call_table = CallTable()
+
+    assert {'x': 1} not in call_table
+    assert call_table.call(lambda x: x + 1, {'x': 1}) == 2
+
+
+class Unhashable(object):
+    __hash__ = None
+
+    def __init__(self, value):
+        self.value = value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+
+def test_call_table_unhashable_kwargs():
+    call_table = CallTable()
+    call_table.record(lambda x: x.value, {'x': Unhashable(1)})
+
+    assert len(call_table) == 1
+    assert {'x': Unhashable(1)} in call_table
+    assert {'x': Unhashable(2)} not in call_table
+    assert call_table.call(lambda x: 1 / 0, {'x': Unhashable(1)}) == 1
+
+
+def test_call_sequence_replays_each_call():
+    calls = []
+
+    def fn(x):
+        calls.append(x)
+        return len(calls)
+
+    call_sequence = CallSequence()
+    call_sequence.record(fn, {'x': 1})
+    call_sequence.record(fn, {'x': 1})
+    call_sequence.record(fn, {'x': Unhashable(2)})
+
+    assert len(call_sequence) == 3
+    assert call_sequence.call(fn, {'x': 1}) == 1
+    assert call_sequence.call(fn, {'x': 1}) == 2
+    assert call_sequence.call(fn, {'x': Unhashable(2)}) == 3
+    assert len(call_sequence) == 0
+
+    # once each outcome is replayed, fn is called
+    assert call_sequence.call(fn, {'x': 1}) == 4
+
+
+def test_call_table_record_batch():
+    calls = []
+
+    class Function(object):
+        def call_batch(self, calls_):
+            calls.append(calls_)
+            return [
+                ValueError() if kwargs['x'] == 2 else kwargs['x'] * 2
+                for kwargs in calls_
+            ]
+
+    call_table = CallTable()
+    call_table.record_batch(Function(), [{'x': 1}, {'x': 2}, {'x': 1}])
+
+    assert calls == [[{'x': 1}, {'x': 2}]]
+    assert call_table.call(None, {'x': 1}) == 2
+    with pytest.raises(ValueError):
+        call_table.call(None, {'x': 2})
+
+
+def test_call_table_record_batch_wrong_length():
+    class Function(object):
+        def call_batch(self, calls):
+            return [1]
+
+    call_table = CallTable()
+    call_table.record_batch(Function(), [{'x': 1}, {'x': 2}])
+
+    with pytest.raises(ValueError):
+        call_table.call(None, {'x': 1})
@@ -0,0 +1,408 @@
+"""
+The ColumnarResultSet is an alternative to ResultSet which stores the state
+of a query by column instead of by row.
+
+Each level of the query shape (the root and each nested list) is a _Level:
+one list of values per path plus, for nested levels, an array with the index
+of each row's parent row.  Rules are still called once per row, but reading
+inputs, filtering, limiting and fanning out rows work on whole columns and
+no Result or dict is allocated per row.
+"""
+
+from array import array
+from collections import defaultdict
+
+from .result_set import ResultSet, Result, NoResult, NoneResult
+from .result_set import shape_path, input_mapping, call_rule
+from .result_set import default_exception_handler
+from .rule import Cardinality
+
+
+class _Missing(object):
+    """ the value of a column for a row which never had a value set """
+
+    def __repr__(self):
+        return '<missing>'
+
+
+_MISSING = _Missing()
+
+
+def _json_value(value):
+    if value is _MISSING or isinstance(value, NoneResult):
+        return None
+    return value
+
+
+class _Level(object):
+    __slots__ = ('columns', 'parent', 'size')
+
+    def __init__(self, size=0, parent=None):
+        # {str(path): [value of each row]}
+        self.columns = {}
+        # the index of the parent row of each row.  None for the root level
+        self.parent = parent
+        self.size = size
+
+    def column(self, name):
+        try:
+            return self.columns[name]
+        except KeyError:
+            raise KeyError(name)
+
+
+class ColumnarResultSet(object):
+    """ columnar storage for the state of a query as it is executed.
+
+    The interface used by QueryPlan is the same as ResultSet's.
+    """
+
+    def __init__(self, query_shape=None):
+        # {prefix: _Level} where prefix is a tuple of the str sub paths from
+        # the root to the level.  The root level's prefix is ()
+        self.levels = {(): _Level()}
+
+        if query_shape is None:
+            self.query_shape = [{}]
+        else:
+            self.query_shape = query_shape
+
+    @classmethod
+    def from_result_set(cls, result_set):
+        """ convert a (nested) ResultSet into a ColumnarResultSet """
+        self = cls(result_set.query_shape)
+        self._add_rows((), list(result_set), None)
+        return self
+
+    def _add_rows(self, prefix, results, parents):
+        level = self.levels.get(prefix)
+        if level is None:
+            level = self.levels[prefix] = _Level(
+                parent=None if parents is None else array('l')
+            )
+
+        for i, result in enumerate(results):
+            if not isinstance(result, Result):
+                result = Result(result)
+
+            row = level.size
+            level.size += 1
+            if parents is not None:
+                level.parent.append(parents[i])
+
+            for key, value in result.result.items():
+                if isinstance(value, ResultSet):
+                    self._add_rows(
+                        prefix + (key,), list(value), [row] * len(value)
+                    )
+                else:
+                    column = level.columns.get(key)
+                    if column is None:
+                        column = level.columns[key] = (
+                            [_MISSING] * (level.size - 1)
+                        )
+                    column.append(value)
+
+            for column in level.columns.values():
+                if len(column) < level.size:
+                    column.append(_MISSING)
+
+    def shape_paths(self, paths):
+        return [self.shape_path(path) for path in paths]
+
+    def shape_path(self, path):
+        return shape_path(path, self.query_shape)
+
+    def _children(self, prefix):
+        return [
+            child for child in self.levels
+            if len(child) == len(prefix) + 1 and child[:-1] == prefix
+        ]
+
+    def _level(self, prefix):
+        """ return the level at prefix, creating it with one empty row for
+        each parent row if it doesn't exist yet """
+        level = self.levels.get(prefix)
+        if level is None:
+            parent = self._level(prefix[:-1])
+            level = self.levels[prefix] = _Level(
+                parent.size, array('l', range(parent.size))
+            )
+        return level
+
+    def _ancestor_index(self, prefix, ancestor):
+        """ return the index of the row in the ancestor level of each row in
+        the level at prefix, or None if ancestor is prefix """
+        index = None
+        while prefix != ancestor:
+            parent = self.levels[prefix].parent
+            if index is None:
+                index = list(parent)
+            else:
+                index = [parent[i] for i in index]
+            prefix = prefix[:-1]
+
+        return index
+
+    def _reindex(self, prefix, source):
+        """ rebuild the level at prefix so that row j is a copy of the old row
+        source[j].  Rows not in source are removed and rows which appear
+        more than once are copied, along with their descendants. """
+        level = self.levels[prefix]
+
+        for name, column in level.columns.items():
+            level.columns[name] = [column[i] for i in source]
+        if level.parent is not None:
+            parent = level.parent
+            level.parent = array('l', [parent[i] for i in source])
+        level.size = len(source)
+
+        for child in self._children(prefix):
+            rows_by_parent = defaultdict(list)
+            for row, parent in enumerate(self.levels[child].parent):
+                rows_by_parent[parent].append(row)
+
+            child_source = []
+            child_parent = array('l')
+            for j, i in enumerate(source):
+                rows = rows_by_parent.get(i, ())
+                child_source.extend(rows)
+                child_parent.extend([j] * len(rows))
+
+            self._reindex(child, child_source)
+            self.levels[child].parent = child_parent
+
+    def _input_columns(self, prefix, inputs):
+        """ return a list of (scope key, [value for each row at prefix]) """
+        columns = []
+        for input in inputs:
+            input_prefix = tuple(str(part) for part in input[:-1])
+            if prefix[:len(input_prefix)] != input_prefix:
+                raise ValueError(
+                    'input {} is not above output level {}'.format(
+                        input, prefix
+                    )
+                )
+
+            column = self._level(input_prefix).column(str(input[-1]))
+            index = self._ancestor_index(prefix, input_prefix)
+            if index is not None:
+                column = [column[i] for i in index]
+
+            columns.append((str(input[-1]), column))
+
+        return columns
+
+    @staticmethod
+    def _output_prefix(outputs):
+        return tuple(str(part) for part in outputs[0][:-1])
+
+    def _scope_rows(self, prefix, inputs):
+        """ yield (row, scope) for each row at prefix """
+        columns = self._input_columns(prefix, inputs)
+        keys = [key for key, _ in columns]
+        for row, values in enumerate(
+            zip(*[column for _, column in columns])
+            if columns else [()] * self.levels[prefix].size
+        ):
+            for value in values:
+                if value is _MISSING:
+                    raise KeyError(keys[values.index(value)])
+            yield row, dict(zip(keys, values))
+
+    def scopes(self, inputs, outputs, scope=None):
+        """ yield the scope each row would be called with by apply_rule """
+        prefix = self._output_prefix(outputs)
+        self._level(prefix)
+
+        for _, row_scope in self._scope_rows(prefix, inputs):
+            yield row_scope
+
+    def _result(self, prefix, row):
+        """ a Result with the values of a row, passed to exception_handler """
+        level = self.levels[prefix]
+        return Result({
+            name: column[row] for name, column in level.columns.items()
+            if column[row] is not _MISSING
+        })
+
+    def apply_rule(self, fn, inputs, outputs, cardinality, scope=None,
+                   exception_handler=default_exception_handler,
+                   call=call_rule):
+        cardinality = Cardinality.cast(cardinality)
+        prefix = self._output_prefix(outputs)
+        level = self._level(prefix)
+        names = [str(output[-1]) for output in outputs]
+
+        # compute the kwargs names once rather than once per row
+        columns = self._input_columns(prefix, inputs)
+        mapping = input_mapping([key for key, _ in columns])
+        kwargs_names = [mapping[key] for key, _ in columns]
+        keys = [key for key, _ in columns]
+        if columns:
+            rows = zip(*[column for _, column in columns])
+        else:
+            rows = [()] * level.size
+
+        source = []
+        output_columns = [[] for _ in names]
+        for row, values in enumerate(rows):
+            for value in values:
+                if value is _MISSING:
+                    raise KeyError(keys[values.index(value)])
+
+            if any(isinstance(value, NoneResult) for value in values):
+                ret = NoneResult()
+            else:
+                try:
+                    ret = call(fn, dict(zip(kwargs_names, values)))
+                except Exception as e:
+                    try:
+                        ret = exception_handler(
+                            self._result(prefix, row), e, fn, outputs,
+                            cardinality, dict(zip(keys, values))
+                        )
+                    except NoResult:
+                        continue
+
+            if cardinality == Cardinality.one:
+                if len(names) == 1:
+                    ret = [ret]
+
+                source.append(row)
+                for output_column, value in zip(output_columns, ret):
+                    output_column.append(value)
+            elif cardinality == Cardinality.many:
+                if len(names) == 1:
+                    values_set = [(value,) for value in ret]
+                else:
+                    values_set = ret
+
+                for values in values_set:
+                    source.append(row)
+                    for output_column, value in zip(output_columns, values):
+                        output_column.append(value)
+            else:
+                raise ValueError('cardinality must be one or many')
+
+        if len(source) != level.size or cardinality == Cardinality.many:
+            self._reindex(prefix, source)
+
+        for name, output_column in zip(names, output_columns):
+            level.columns[name] = output_column
+
+        return self
+
+    def filter(self, path, relation):
+        path = self.shape_path(path)
+        prefix = tuple(str(part) for part in path[:-1])
+
+        level = self.levels.get(prefix)
+        if level is None:
+            return
+
+        column = level.column(str(path[-1]))
+        source = []
+        for row, value in enumerate(column):
+            if value is _MISSING:
+                raise KeyError(str(path[-1]))
+            if relation(value):
+                source.append(row)
+
+        if len(source) != level.size:
+            self._reindex(prefix, source)
+
+    def limit(self, limit, path=()):
+        """ keep only the first limit rows of the level at path for each of
+        their parent rows """
+        prefix = tuple(str(part) for part in path)
+        level = self.levels.get(prefix)
+        if level is None:
+            return
+
+        if level.parent is None:
+            source = list(range(min(level.size, limit)))
+        else:
+            counts = defaultdict(int)
+            source = []
+            for row, parent in enumerate(level.parent):
+                if counts[parent] < limit:
+                    counts[parent] += 1
+                    source.append(row)
+
+        if len(source) != level.size:
+            self._reindex(prefix, source)
+
+    def count(self, path=()):
+        """ the number of rows in the level at path """
+        level = self.levels.get(tuple(str(part) for part in path))
+        if level is None:
+            return 0
+        return level.size
+
+    def _rows_by_parent(self, prefix):
+        rows_by_parent = defaultdict(list)
+        for row, parent in enumerate(self.levels[prefix].parent):
+            rows_by_parent[parent].append(row)
+        return rows_by_parent
+
+    def _extract_json(self, prefix, rows, paths):
+        level = self.levels[prefix]
+
+        sub_paths = defaultdict(list)
+        for path in paths:
+            sub_paths[str(path[0])].append(path[1:])
+
+        # {key: [value for each row]}
+        ret_columns = {}
+        for key, key_paths in sub_paths.items():
+            child = prefix + (key,)
+            if child in self.levels:
+                rows_by_parent = self._rows_by_parent(child)
+                ret_columns[key] = [
+                    self._extract_json(
+                        child, rows_by_parent.get(row, []), key_paths
+                    ) for row in rows
+                ]
+            else:
+                column = level.columns.get(key)
+                if column is None:
+                    ret_columns[key] = [None] * len(rows)
+                else:
+                    ret_columns[key] = [_json_value(column[row])
+                                        for row in rows]
+
+        return [
+            {key: values[i] for key, values in ret_columns.items()}
+            for i in range(len(rows))
+        ]
+
+    def extract_json(self, paths):
+        paths = self.shape_paths(paths)
+        return self._extract_json((), range(self.levels[()].size), paths)
+
+    def _to_json(self, prefix, rows):
+        level = self.levels[prefix]
+        ret = [{} for _ in rows]
+        for name, column in level.columns.items():
+            for json, row in zip(ret, rows):
+                if column[row] is not _MISSING:
+                    json[name] = _json_value(column[row])
+
+        for child in self._children(prefix):
+            rows_by_parent = self._rows_by_parent(child)
+            for json, row in zip(ret, rows):
+                json[child[-1]] = self._to_json(
+                    child, rows_by_parent.get(row, [])
+                )
+
+        return ret
+
+    def to_json(self):
+        return self._to_json((), range(self.levels[()].size))
+
+    def __len__(self):
+        return self.levels[()].size
+
+    def __repr__(self):
+        return '<ColumnarResultSet {}>'.format(self.to_json())
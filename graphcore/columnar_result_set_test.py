@@ -0,0 +1,177 @@
+import pytest
+
+from .relation import Relation
+from .result_set import ResultSet, Result, NoResult, NoneResult
+from .columnar_result_set import ColumnarResultSet
+from .graphcore import Graphcore
+from .test_harness import testgraphcore
+
+
+def nested_result_set():
+    return ColumnarResultSet.from_result_set(ResultSet([
+        Result({'a.x': x, 'a.b': ResultSet([
+            Result({'y': y}) for y in range(x)
+        ])}) for x in [1, 2, 3]
+    ], [{'a.b': [{}]}]))
+
+
+def test_from_result_set_to_json():
+    assert nested_result_set().to_json() == [
+        {'a.x': 1, 'a.b': [{'y': 0}]},
+        {'a.x': 2, 'a.b': [{'y': 0}, {'y': 1}]},
+        {'a.x': 3, 'a.b': [{'y': 0}, {'y': 1}, {'y': 2}]},
+    ]
+
+
+def test_apply_rule_one():
+    result_set = nested_result_set()
+
+    def z(x, y):
+        if y == 2:
+            raise NoResult()
+        return x * 10 + y
+
+    result_set.apply_rule(
+        z, result_set.shape_paths(['a.x', 'a.b.y']),
+        result_set.shape_paths(['a.b.z']), 'one'
+    )
+
+    assert result_set.extract_json(['a.x', 'a.b.z']) == [
+        {'a.x': 1, 'a.b': [{'z': 10}]},
+        {'a.x': 2, 'a.b': [{'z': 20}, {'z': 21}]},
+        {'a.x': 3, 'a.b': [{'z': 30}, {'z': 31}]},
+    ]
+
+
+def test_apply_rule_many_copies_children():
+    result_set = nested_result_set()
+
+    result_set.apply_rule(
+        lambda x: ['l', 'r'] if x < 3 else [],
+        result_set.shape_paths(['a.x']), result_set.shape_paths(['a.side']),
+        'many'
+    )
+
+    assert result_set.to_json() == [
+        {'a.x': 1, 'a.side': 'l', 'a.b': [{'y': 0}]},
+        {'a.x': 1, 'a.side': 'r', 'a.b': [{'y': 0}]},
+        {'a.x': 2, 'a.side': 'l', 'a.b': [{'y': 0}, {'y': 1}]},
+        {'a.x': 2, 'a.side': 'r', 'a.b': [{'y': 0}, {'y': 1}]},
+    ]
+
+
+def test_apply_rule_none_result():
+    result_set = ColumnarResultSet.from_result_set(
+        ResultSet([{'a': 1}, {'a': NoneResult()}])
+    )
+
+    result_set.apply_rule(
+        lambda a: a + 1, result_set.shape_paths(['a']),
+        result_set.shape_paths(['b']), 'one'
+    )
+
+    assert result_set.extract_json(['b']) == [{'b': 2}, {'b': None}]
+
+
+def test_apply_rule_new_level():
+    result_set = ColumnarResultSet.from_result_set(
+        ResultSet([{'a': 1}, {'a': 2}], [{'c': [{}]}])
+    )
+
+    result_set.apply_rule(
+        lambda a: [a, a], result_set.shape_paths(['a']),
+        result_set.shape_paths(['c.d']), 'many'
+    )
+
+    assert result_set.extract_json(['c.d']) == [
+        {'c': [{'d': 1}, {'d': 1}]},
+        {'c': [{'d': 2}, {'d': 2}]},
+    ]
+
+
+def test_apply_rule_missing_input():
+    result_set = ColumnarResultSet.from_result_set(ResultSet([{'a': 1}]))
+
+    with pytest.raises(KeyError):
+        result_set.apply_rule(
+            lambda b: b, result_set.shape_paths(['b']),
+            result_set.shape_paths(['c']), 'one'
+        )
+
+
+def test_nested_filter_and_limit():
+    result_set = nested_result_set()
+
+    result_set.filter('a.b.y', Relation('>', 0))
+    result_set.limit(2)
+
+    assert result_set.to_json() == [
+        {'a.x': 1, 'a.b': []},
+        {'a.x': 2, 'a.b': [{'y': 1}]},
+    ]
+
+
+def test_limit_nested():
+    result_set = nested_result_set()
+
+    result_set.limit(2, ('a.b',))
+
+    assert result_set.to_json() == [
+        {'a.x': 1, 'a.b': [{'y': 0}]},
+        {'a.x': 2, 'a.b': [{'y': 0}, {'y': 1}]},
+        {'a.x': 3, 'a.b': [{'y': 0}, {'y': 1}]},
+    ]
+
+
+def test_scopes():
+    result_set = nested_result_set()
+
+    assert list(result_set.scopes(
+        result_set.shape_paths(['a.x', 'a.b.y']),
+        result_set.shape_paths(['a.b.z']),
+    )) == [
+        {'a.x': 1, 'y': 0},
+        {'a.x': 2, 'y': 0},
+        {'a.x': 2, 'y': 1},
+        {'a.x': 3, 'y': 0},
+        {'a.x': 3, 'y': 1},
+        {'a.x': 3, 'y': 2},
+    ]
+
+
+def test_limit_stops_early():
+    import itertools
+
+    gc = Graphcore(columnar=True)
+    gc.register_rule(
+        [], 'user.id', function=itertools.count, cardinality='many'
+    )
+    gc.register_rule(['user.id'], 'user.name', function=lambda id: str(id))
+
+    # the rows are pipelined, so an infinite rule is only consumed as far as
+    # the limit
+    assert gc.query({'user.id?': None, 'user.name?': None}, limit=2) == [
+        {'user.id': 0, 'user.name': '0'}, {'user.id': 1, 'user.name': '1'},
+    ]
+
+
+@pytest.mark.parametrize('query', [
+    {'user.id': 1, 'user.name?': None},
+    {'user.id': 1, 'user.books.id?': None, 'user.books.name?': None},
+    {
+        'user.id': 1,
+        'user.name?': None,
+        'user.books': [{
+            'id?': None,
+            'name?': None,
+            'author.id?': None,
+        }],
+    },
+    {'user.id': 1, 'user.books.id?': None, 'user.books.id>': 1},
+])
+def test_same_results_as_result_set(query):
+    gc = Graphcore(columnar=True)
+    gc.rules = testgraphcore.rules
+    gc.schema = testgraphcore.schema
+
+    assert gc.query(query) == testgraphcore.query(query)
@@ -0,0 +1,284 @@
+"""
+An Executor decides how the calls a node makes for each row are run:
+inline, on a thread pool or on a process pool (or, see async_executor, on an
+asyncio event loop).  Pass one to Graphcore to use it for every rule, or to
+Graphcore.rule or Graphcore.register_rule to use it for one rule:
+
+    gc = Graphcore(rule_executor=ThreadExecutor(max_workers=16))
+
+    @gc.rule(['user.id'], 'user.score', executor=ProcessExecutor())
+    def score(id):
+        ...
+
+QueryPlan collects the inputs of the rows of a node, maps the rule over them
+with the executor chunk_size calls at a time and then replays the outcomes
+in row order, so the results are the same as calling the rule inline.  Only
+pure rules are called once for each distinct set of inputs.
+
+Rule functions are rarely picklable (closures, SQLQuery instances holding an
+engine, ...), so ProcessExecutor only suits top level functions.  A
+RegistryProcessExecutor instead builds the same Graphcore in each worker
+process and sends only the id of the rule and its input values:
+
+    # myapp/graph.py
+    def build_graphcore():
+        gc = Graphcore()
+        ...
+        return gc
+
+    gc = build_graphcore()
+    gc.rule_executor = RegistryProcessExecutor('myapp.graph:build_graphcore')
+"""
+
+import six
+import importlib
+import threading
+
+
+def call_chunk(function, calls, cast=None):
+    """ call function with each kwargs in calls and return a list of
+    (value, exception) outcomes.  cast is applied to each value """
+    outcomes = []
+    for kwargs in calls:
+        try:
+            value = function(**kwargs)
+            if cast is not None:
+                value = cast(value)
+        except Exception as e:
+            outcomes.append((None, e))
+        else:
+            outcomes.append((value, None))
+    return outcomes
+
+
+def chunks(calls, chunk_size):
+    """ split calls into lists of at most chunk_size calls """
+    chunk_size = max(int(chunk_size or 1), 1)
+    return [
+        calls[i:i + chunk_size] for i in range(0, len(calls), chunk_size)
+    ]
+
+
+class Executor(object):
+    """ the interface of an executor.  Subclasses implement _map_chunks """
+
+    # inline executors are skipped by QueryPlan, which calls the rule
+    # directly while applying the node
+    inline = False
+
+    def __init__(self, chunk_size=1):
+        """
+        chunk_size: the number of calls sent to a worker at once
+        """
+        self.chunk_size = chunk_size
+
+    def map(self, function, calls, cast=None, rule_id=None):
+        """ return [(value, exception)] of calling function with each kwargs
+        in calls, in the order of calls.
+
+        rule_id: the id of the rule function belongs to, if it is a
+            registered rule.  See Rules.rule_id
+        """
+        outcomes = []
+        for chunk_outcomes in self._map_chunks(
+            function, chunks(list(calls), self.chunk_size), cast
+        ):
+            outcomes.extend(chunk_outcomes)
+        return outcomes
+
+    def _map_chunks(self, function, chunks, cast):
+        """ return a list with the outcomes of each chunk, in order """
+        raise NotImplementedError()
+
+    def shutdown(self, wait=True):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+
+    def __repr__(self):
+        return '<{name} chunk_size:{chunk_size}>'.format(
+            name=self.__class__.__name__, chunk_size=self.chunk_size
+        )
+
+
+class InlineExecutor(Executor):
+    """ call the rule in the calling thread, one row at a time.  Use it to
+    opt a rule out of the Graphcore's rule_executor """
+
+    inline = True
+
+    def _map_chunks(self, function, chunks, cast):
+        return [call_chunk(function, chunk, cast) for chunk in chunks]
+
+
+class _PoolExecutor(Executor):
+    """ submit each chunk to a concurrent.futures pool, created when it is
+    first needed """
+
+    def __init__(self, max_workers=None, chunk_size=1, pool=None):
+        """
+        max_workers: the size of the pool
+        pool: a concurrent.futures.Executor to use instead of creating one
+        """
+        super(_PoolExecutor, self).__init__(chunk_size)
+        self.max_workers = max_workers
+        self._pool = pool
+        self._owns_pool = pool is None
+        self._lock = threading.Lock()
+
+    def _make_pool(self):
+        raise NotImplementedError()
+
+    @property
+    def pool(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = self._make_pool()
+            return self._pool
+
+    def _map_chunks(self, function, chunks, cast):
+        pool = self.pool
+        futures = [
+            pool.submit(call_chunk, function, chunk, cast) for chunk in chunks
+        ]
+        return [future.result() for future in futures]
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            if self._pool is not None and self._owns_pool:
+                self._pool.shutdown(wait)
+                self._pool = None
+
+
+class ThreadExecutor(_PoolExecutor):
+    """ run the calls on a thread pool.  Suits rules which wait on I/O """
+
+    def _make_pool(self):
+        from concurrent.futures import ThreadPoolExecutor
+        return ThreadPoolExecutor(self.max_workers)
+
+
+class ProcessExecutor(_PoolExecutor):
+    """ run the calls on a process pool.  Suits CPU bound rules.
+
+    The rule function, its inputs and its outputs are pickled, so the
+    function must be importable by name (defined at the top level of a
+    module) and its inputs and outputs must be picklable.
+    """
+
+    def __init__(self, max_workers=None, chunk_size=16, pool=None):
+        super(ProcessExecutor, self).__init__(max_workers, chunk_size, pool)
+
+    def _make_pool(self):
+        from concurrent.futures import ProcessPoolExecutor
+        return ProcessPoolExecutor(self.max_workers)
+
+
+# {factory: {rule id: function}} of the Graphcores built in a
+# RegistryProcessExecutor worker process
+_worker_functions = {}
+
+
+def load_factory(factory):
+    """ return factory, importing it first if it is a 'module:name'
+    string """
+    if isinstance(factory, six.string_types):
+        module_name, _, name = factory.partition(':')
+        factory = getattr(importlib.import_module(module_name), name)
+    return factory
+
+
+def _registered_functions(factory):
+    """ return {rule id: function} of the Graphcore factory builds.  It is
+    built by the first task a worker runs, rather than by a pool
+    initializer, which the futures backport doesn't support """
+    functions = _worker_functions.get(factory)
+    if functions is None:
+        graphcore = load_factory(factory)()
+        functions = _worker_functions[factory] = {
+            rule_id: rule.function
+            for rule_id, rule in graphcore.rules.rules_by_id.items()
+        }
+    return functions
+
+
+def call_registered(factory, rule_id, names, rows, cast=None):
+    """ the task run by a RegistryProcessExecutor worker: call the rule
+    rule_id of the Graphcore factory builds with dict(zip(names, row)) for
+    each row in rows.  Returns (values, {index of row: exception}) """
+    try:
+        function = _registered_functions(factory)[rule_id]
+    except KeyError:
+        raise KeyError(
+            'rule {} is not registered in the worker Graphcore'.format(
+                rule_id
+            )
+        )
+
+    values = []
+    exceptions = {}
+    for i, row in enumerate(rows):
+        try:
+            value = function(**dict(zip(names, row)))
+            if cast is not None:
+                value = cast(value)
+        except Exception as e:
+            exceptions[i] = e
+            value = None
+        values.append(value)
+
+    return values, exceptions
+
+
+class RegistryProcessExecutor(ProcessExecutor):
+    """ run the calls on a process pool whose workers each build their own
+    copy of the Graphcore.
+
+    Each task is the id of a rule, the names of its inputs and chunk_size
+    rows of input values, and it returns the values and exceptions of the
+    chunk, so neither the rule functions nor the kwargs dicts are pickled.
+    The inputs and outputs of the rules must be picklable.
+
+    Calls of nodes which aren't registered rules (such as the SQLQuery
+    nodes merged by the optimizer) are made inline.
+    """
+
+    def __init__(self, factory, max_workers=None, chunk_size=64):
+        """
+        factory: a function which returns the Graphcore, or a
+            'module:name' string naming one.  The rules it registers must
+            be the same, in the same order, as in the Graphcore which
+            executes the query.
+        """
+        super(RegistryProcessExecutor, self).__init__(max_workers, chunk_size)
+        self.factory = factory
+
+    def map(self, function, calls, cast=None, rule_id=None):
+        calls = list(calls)
+        if rule_id is None:
+            return call_chunk(function, calls, cast)
+        if not calls:
+            return []
+
+        names = tuple(sorted(calls[0]))
+        pool = self.pool
+        futures = [
+            pool.submit(call_registered, self.factory, rule_id, names, [
+                tuple(kwargs[name] for name in names) for kwargs in chunk
+            ], cast)
+            for chunk in chunks(calls, self.chunk_size)
+        ]
+
+        outcomes = []
+        for future in futures:
+            values, exceptions = future.result()
+            for i, value in enumerate(values):
+                if i in exceptions:
+                    outcomes.append((None, exceptions[i]))
+                else:
+                    outcomes.append((value, None))
+        return outcomes
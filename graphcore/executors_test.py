@@ -0,0 +1,217 @@
+import os
+import pytest
+import threading
+
+from .graphcore import Graphcore
+from .executors import (
+    call_chunk, chunks, call_registered, InlineExecutor, ThreadExecutor,
+    ProcessExecutor, RegistryProcessExecutor, _worker_functions,
+)
+from .result_set import NoResult
+
+
+def square(id):
+    if id < 0:
+        raise NoResult()
+    return id * id
+
+
+def pid(id):
+    return os.getpid()
+
+
+def test_call_chunk():
+    value, exception = call_chunk(square, [{'id': 2}, {'id': -1}])
+    assert value == (4, None)
+    assert isinstance(exception[1], NoResult)
+
+    assert call_chunk(
+        lambda id: iter([id]), [{'id': 2}], cast=list
+    ) == [([2], None)]
+
+
+def test_chunks():
+    assert chunks([1, 2, 3], 2) == [[1, 2], [3]]
+    assert chunks([1, 2, 3], None) == [[1], [2], [3]]
+
+
+@pytest.mark.parametrize('executor', [
+    InlineExecutor(), ThreadExecutor(2), ThreadExecutor(2, chunk_size=3),
+    ProcessExecutor(2, chunk_size=3),
+])
+def test_map_ordered(executor):
+    with executor:
+        outcomes = executor.map(square, [{'id': x} for x in range(10)])
+    assert outcomes == [(x * x, None) for x in range(10)]
+
+
+def graphcore(**kwargs):
+    gc = Graphcore(**kwargs)
+    gc.register_rule(
+        [], 'user.id', function=lambda: range(-2, 10), cardinality='many'
+    )
+    return gc
+
+
+QUERY = {'user.id?': None, 'user.square?': None}
+EXPECTED = [{'user.id': i, 'user.square': i * i} for i in range(10)]
+
+
+def test_rule_executor():
+    threads = set()
+
+    def thread_square(id):
+        threads.add(threading.current_thread())
+        return square(id)
+
+    with ThreadExecutor(4) as executor:
+        gc = graphcore(rule_executor=executor)
+        gc.register_rule(['user.id'], 'user.square', function=thread_square)
+
+        assert gc.query(QUERY) == EXPECTED
+    assert threading.current_thread() not in threads
+
+
+def test_rule_executor_nested():
+    with ThreadExecutor(4) as executor:
+        gc = graphcore(rule_executor=executor)
+        gc.register_rule(
+            ['user.id'], 'user.books.id', function=lambda id: range(id % 3),
+            cardinality='many'
+        )
+        gc.register_rule(
+            ['book.id'], 'book.title', function=lambda id: str(id)
+        )
+        gc.property_type('user', 'books', 'book')
+
+        query = {'user.id': 5, 'user.books': [{'id?': None, 'title?': None}]}
+        assert gc.query(query) == [{'user.books': [
+            {'id': 0, 'title': '0'}, {'id': 1, 'title': '1'},
+        ]}]
+
+
+def test_rule_executor_impure_rule():
+    calls = []
+
+    def count(parity):
+        calls.append(parity)
+        return len(calls)
+
+    with ThreadExecutor(1) as executor:
+        gc = graphcore(rule_executor=executor)
+        gc.register_rule(['user.id'], 'user.parity', function=lambda id: 0)
+        gc.register_rule(['user.parity'], 'user.count', function=count)
+
+        rows = gc.query({'user.id?': None, 'user.count?': None})
+
+    # rules which aren't pure are called for every row, even with equal
+    # inputs
+    assert calls == [0] * 12
+    assert [row['user.count'] for row in rows] == list(range(1, 13))
+
+
+def test_rule_with_executor():
+    with ProcessExecutor(2) as executor:
+        gc = graphcore()
+        gc.register_rule(['user.id'], 'user.square', function=square)
+        gc.register_rule(['user.id'], 'user.pid', function=pid,
+                         executor=executor)
+
+        rows = gc.query({
+            'user.id?': None, 'user.square?': None, 'user.pid?': None,
+        })
+    assert [row['user.square'] for row in rows] == list(
+        i * i for i in range(10)
+    )
+    # only user.pid was run on the process pool
+    assert os.getpid() not in set(row['user.pid'] for row in rows)
+
+
+def test_inline_executor_opts_out():
+    threads = set()
+
+    def thread_square(id):
+        threads.add(threading.current_thread())
+        return square(id)
+
+    with ThreadExecutor(4) as executor:
+        gc = graphcore(rule_executor=executor)
+        gc.register_rule(['user.id'], 'user.square', function=thread_square,
+                         executor=InlineExecutor())
+
+        assert gc.query(QUERY) == EXPECTED
+    assert threads == {threading.current_thread()}
+
+
+def test_rule_executor_limit():
+    with ThreadExecutor(4) as executor:
+        gc = graphcore(rule_executor=executor)
+        gc.register_rule(['user.id'], 'user.square', function=square)
+
+        assert gc.query(QUERY, limit=3) == EXPECTED[:3]
+
+
+def build_graphcore():
+    gc = graphcore()
+
+    # neither of these closures could be pickled
+    offset = 1
+
+    @gc.rule(['user.id'], 'user.square')
+    def closure_square(id):
+        return square(id) + offset - 1
+
+    gc.register_rule(['user.id'], 'user.pid', function=lambda id: pid(id))
+
+    return gc
+
+
+def test_registry_process_executor():
+    gc = build_graphcore()
+    executor = RegistryProcessExecutor(
+        __name__ + ':build_graphcore', max_workers=2, chunk_size=4
+    )
+    with executor:
+        gc.rule_executor = executor
+        rows = gc.query({
+            'user.id?': None, 'user.square?': None, 'user.pid?': None,
+        })
+
+    assert [row['user.square'] for row in rows] == list(
+        i * i for i in range(10)
+    )
+    assert os.getpid() not in set(row['user.pid'] for row in rows)
+
+
+def test_call_registered_unknown_rule():
+    with pytest.raises(KeyError):
+        call_registered(
+            __name__ + ':build_graphcore', 'user.x = f(user.id)', ('id',),
+            [(1,)]
+        )
+
+
+def test_call_registered():
+    factory = __name__ + ':build_graphcore'
+    assert call_registered(
+        factory, 'user.square = closure_square(user.id)', ('id',),
+        [(2,), (-1,)]
+    )[0] == [4, None]
+
+    # the Graphcore is built by the first call and reused after that
+    functions = _worker_functions[factory]
+    call_registered(
+        factory, 'user.square = closure_square(user.id)', ('id',), [(3,)]
+    )
+    assert _worker_functions[factory] is functions
+
+
+def test_rule_ids():
+    gc = Graphcore()
+    gc.register_rule(['user.id'], 'user.x', function=lambda id: 1)
+    gc.register_rule(['user.id'], 'user.x', function=lambda id: 2)
+
+    first, second = gc.rules
+    assert gc.rules.rule_id(first) == 'user.x = <lambda>(user.id)'
+    assert gc.rules.rule_id(second) == 'user.x = <lambda>(user.id) #2'
+    assert gc.rules.rules_by_id['user.x = <lambda>(user.id) #2'] is second
@@ -1,6 +1,7 @@
 import six
+from collections import deque
 
-from .rule import Rule, Cardinality
+from .rule import Rule, Cardinality, BatchFunction
 from .path import Path
 from .query import Query
 from .clause import Clause, Var, OutVar, TempVar
@@ -8,6 +9,13 @@ from . import call_graph
 from .query_planner import QueryPlanner
 from .equality_mixin import HashMixin, EqualityMixin
 from .result_set import default_exception_handler
+from .parameter import parameterize_query, template_key
+from .plan_cache import PlanCache, CompiledQuery
+from .call_table import MemoStats
+from .rule_cache import CachedFunction
+from .query_profile import QueryProfile
+from .tracer import span
+from .prepared_query import PreparedQuery
 
 
 class QuerySearchIterator(object):
@@ -60,32 +68,44 @@ class QuerySearch(object):
     def _visit(self, clause):
         self._visited_paths.add(clause.lhs)
 
+    def _unbound_outvar_clauses(self):
+        """ yield the clauses with a variable rhs which havent been
+        grounded, in query order """
+        for clause in self.query:
+            if isinstance(clause.rhs, Var):
+                if not self._grounded(clause):
+                    yield clause
+
     def clauses_with_unbound_outvar(self):
         return QuerySearchIterator(self)
 
     def clause_with_unbound_outvar(self):
         """ return a clause with a variable rhs which hasnt been grounded """
-        for clause in self.query:
-            if isinstance(clause.rhs, Var):
-                if not self._grounded(clause):
-                    return clause
+        return next(self._unbound_outvar_clauses(), None)
 
     def apply_rule_backwards(self, output_clause, prefix, rule):
-        """bind the output of rule to output_clause from the query"""
+        """bind the output of rule to output_clause from the query.
+
+        returns the list of clauses which were added to the query as inputs
+        to rule.  Clauses which were already in the query are not returned.
+        """
 
         # add input/unify clauses of function to query
         input_clauses = []
+        new_clauses = []
         for input in rule.inputs:
             # TODO: this is almost certainly an edge case handling rather than
             # handling the general case
 
             absolute_path = prefix + input[1:]
+            is_new = absolute_path not in self.query.clause_map
 
             # self.query.append is conditional on there not already
             # being a clause with this absolute_path
-            input_clauses.append(
-                self.query.append(Clause(absolute_path, TempVar()))
-            )
+            input_clause = self.query.append(Clause(absolute_path, TempVar()))
+            input_clauses.append(input_clause)
+            if is_new:
+                new_clauses.append(input_clause)
 
         self.call_graph.add_node(
             [clause.lhs for clause in input_clauses],
@@ -93,6 +113,10 @@ class QuerySearch(object):
             rule.function,
             rule.cardinality,
             relations=[output_clause.relation],
+            stats_key=rule.key,
+            rule_id=self.graphcore.rules.rule_id(rule),
+            executor=rule.executor,
+            pure=rule.pure,
         )
 
         if isinstance(output_clause.rhs, OutVar):
@@ -104,6 +128,17 @@ class QuerySearch(object):
         for input_clause in input_clauses:
             self._visit(input_clause)
 
+        return new_clauses
+
+    def _unused_clauses(self):
+        used_paths = self._grounded_paths | self._visited_paths
+        if len(used_paths) == len(self.query):
+            return []
+
+        return [
+            clause for clause in self.query if clause.lhs not in used_paths
+        ]
+
     def backward(self):
         """apply rules in reverse looking for the call chain that will be
         necessary to complete the query.
@@ -111,29 +146,35 @@ class QuerySearch(object):
         we can pick any old clause off the stack since the order that rules are
         resolved, at this point in the search is unimportant.  We can always
         optimize the call graph later, one we have one.
+
+        clauses are processed from a worklist in the order they were added to
+        the query, so each clause is only looked at once no matter how large
+        the query grows.
         """
+        worklist = deque(self._unbound_outvar_clauses())
+
         try:
-            for clause in self.clauses_with_unbound_outvar():
-                self.apply_rule_backwards(
-                    clause, *self.graphcore.lookup_rule(clause.lhs)
-                )
+            while worklist:
+                while worklist:
+                    clause = worklist.popleft()
+                    if self._grounded(clause):
+                        continue
+
+                    worklist.extend(self.apply_rule_backwards(
+                        clause, *self.graphcore.lookup_rule(clause.lhs)
+                    ))
+
+                # all nodes should be either ground, or visited.  find clauses
+                # which aren't and convert them to a relation, instead of a
+                # ground value
+                for clause in self._unused_clauses():
+                    clause.convert_to_constraint()
+                    worklist.append(clause)
         except PathNotFound as e:
             e.dependent_nodes = self.call_graph.nodes_depending_on_path(e.path)
             e.call_graph = self.call_graph
             raise
 
-        # all nodes should be either ground, or visited
-        used_paths = self._grounded_paths | self._visited_paths
-        if len(used_paths) != len(self.query):
-            # find clauses which aren't in these sets and convert them to a
-            # relation, instead of a ground value
-            for clause in self.query:
-                if clause.lhs not in used_paths:
-                    clause.convert_to_constraint()
-
-            # rerun with new constraints
-            self.backward()
-
 
 class PropertyType(HashMixin, EqualityMixin):
 
@@ -154,9 +195,22 @@ class Schema(object):
     def __init__(self):
         self.property_types = []
 
+        # {(base_type, property): other_type}
+        self._other_types = {}
+
+        # {path parts: tuple of the type of each prefix of path}
+        self._prefix_types = {}
+
     def append(self, property_type):
         self.property_types.append(property_type)
 
+        # the first matching property_type wins
+        self._other_types.setdefault(
+            (str(property_type.base_type), str(property_type.property)),
+            str(property_type.other_type),
+        )
+        self._prefix_types.clear()
+
     def __str__(self):
         return repr(self.property_types)
 
@@ -164,23 +218,30 @@ class Schema(object):
         return '<Schema {str}>'.format(str=str(self))
 
     def _lookup(self, base_type, property):
-        # TODO: use dict
-        for property_type in self.property_types:
-            if base_type == property_type.base_type:
-                if property == property_type.property:
-                    return property_type.other_type
+        return self._other_types.get((base_type, property))
+
+    def prefix_types(self, parts):
+        """ given a tuple of path parts, return a tuple with the type of the
+        value at each position in the path.  Results are memoized. """
+        try:
+            return self._prefix_types[parts]
+        except KeyError:
+            pass
+
+        if len(parts) <= 1:
+            # this is the root so no way for it to have a different type
+            types = tuple(parts)
+        else:
+            types = self.prefix_types(parts[:-1])
+            types += (self._lookup(types[-1], parts[-1]) or parts[-1],)
+
+        self._prefix_types[parts] = types
+        return types
 
     def resolve_type(self, path, pos=-1):
         """ given a full path and an index into that path, return the type of
         the value of the property at that index """
-
-        # this is the root so no way for it to have a different type
-        if abs(pos) == len(path):
-            return path[pos]
-
-        return self._lookup(
-            self.resolve_type(path, pos - 1), path[pos]
-        ) or path[pos]
+        return self.prefix_types(Path(path).parts)[pos]
 
 
 class PathNotFound(Exception):
@@ -284,29 +345,82 @@ class DefineTypeContext(object):
             self.gc.direct_map(input, output)
 
 
+class _RuleTrieNode(object):
+    """ a node in a trie of rule output paths, keyed by path part from right
+    to left """
+
+    def __init__(self):
+        self.children = {}
+        # every rule registered for this output, latest last
+        self.rules = []
+        self.require_input_rules = []
+
+    def child(self, part):
+        return self.children.get(part)
+
+    def rules_for(self, require_input):
+        if require_input:
+            return self.require_input_rules
+        else:
+            return self.rules
+
+
 class Rules(object):
     def __init__(self):
         self.rules = []
         self.require_input_rules = []
 
-        self.rules_by_output_path = {}
-        self.require_input_rules_by_output_path = {}
+        # suffix trie over the parts of rule outputs
+        self.trie = _RuleTrieNode()
+
+        # {id(rule): rule id} and {rule id: rule}.  See rule_id
+        self._ids = {}
+        self.rules_by_id = {}
+
+    def _trie_node(self, output):
+        node = self.trie
+        for part in reversed(Path(output).parts):
+            node = node.children.setdefault(part, _RuleTrieNode())
+        return node
+
+    def rule_id(self, rule):
+        """ a string which identifies rule among these rules.  It is the
+        same for every Rules built by registering the same rules in the same
+        order, so it can refer to a rule in another process.  See
+        executors.RegistryProcessExecutor """
+        return self._ids[id(rule)]
 
     def append(self, rule):
+        rule_id = rule.key
+        if rule_id in self.rules_by_id:
+            n = 2
+            while '{} #{}'.format(rule_id, n) in self.rules_by_id:
+                n += 1
+            rule_id = '{} #{}'.format(rule_id, n)
+        self._ids[id(rule)] = rule_id
+        self.rules_by_id[rule_id] = rule
+
         self.rules.append(rule)
         for output in rule.outputs:
-            self.rules_by_output_path[str(output)] = rule
+            self._trie_node(output).rules.append(rule)
 
         if len(rule.inputs) > 0:
             self.require_input_rules.append(rule)
             for output in rule.outputs:
-                self.require_input_rules_by_output_path[str(output)] = rule
+                self._trie_node(output).require_input_rules.append(rule)
 
     def lookup(self, path, require_input):
-        if require_input:
-            return self.require_input_rules_by_output_path.get(str(path))
-        else:
-            return self.rules_by_output_path.get(str(path))
+        """ return the latest rule registered for the output path, or
+        None """
+        node = self.trie
+        for part in reversed(Path(path).parts):
+            node = node.child(part)
+            if node is None:
+                return None
+
+        rules = node.rules_for(require_input)
+        if rules:
+            return rules[-1]
 
     def __iter__(self):
         return iter(self.rules)
@@ -317,23 +431,82 @@ class Rules(object):
 
 class Graphcore(object):
 
-    def __init__(self, mapper=map):
+    def __init__(self, mapper=map, plan_cache_size=128, executor=None,
+                 concurrency=None, columnar=False, rule_stats=None,
+                 tracer=None, rule_executor=None):
+        """
+        plan_cache_size: the maximum number of compiled queries to keep.
+            0 disables the plan cache.
+        executor: a concurrent.futures.Executor.  If provided, the rule calls
+            of nodes which don't depend on each other are run concurrently
+            on it.  See QueryPlan.
+        rule_executor: an Executor which runs the calls each node makes for
+            its rows, for example ThreadExecutor or ProcessExecutor.  Rules
+            registered with an executor of their own use that instead.
+            None calls the rules inline.  See executors.
+        concurrency: the maximum number of rule calls aquery awaits at once.
+            None means no limit.
+        columnar: if True, queries are executed with a ColumnarResultSet
+            instead of a ResultSet.  mapper is not used.  Queries with a
+            top level limit still use a ResultSet, so that their rows can be
+            pipelined and the rules stop being called once there are enough
+            of them.
+        rule_stats: a RuleStats.  If provided, the runtime cost of each rule
+            is recorded in it and used to order the nodes of new plans and
+            to choose between rules registered for the same output.  Plans
+            in plan_cache are rebuilt when the stats change significantly,
+            see RuleStats.generation.
+        tracer: a Tracer.  If provided, it is sent a span for each query,
+            search, optimization pass, plan, execution and node, and for a
+            sample of the rule calls.  aquery only traces compilation.  See
+            tracer.
+        """
         # rules are indexed by the Path of thier output
         self.rules = Rules()
         self.schema = Schema()
         self.mapper = mapper
+        self.executor = executor
+        self.concurrency = concurrency
+        self.columnar = columnar
+        self.rule_stats = rule_stats
+        self.tracer = tracer
+        self.rule_executor = rule_executor
+        self.plan_cache = PlanCache(plan_cache_size)
+        # the number of calls to pure rules made and saved by memoization
+        self.memo_stats = MemoStats()
 
     def property_type(self, base_type, property, other_type):
         self.schema.append(
             PropertyType(base_type, property, other_type)
         )
+        self.plan_cache.clear()
 
     def register_rule(self, inputs, output,
                       cardinality=Cardinality.one,
-                      function=None):
+                      function=None, batch=False, pure=False, cache=None,
+                      executor=None):
+        """
+        batch: if True, function is called once per node with a list of
+            values for each input and returns a list of outputs.  See
+            BatchFunction.
+        pure: if True, function is only called once per query for each
+            distinct set of inputs.  See Rule.
+        cache: a TTLCache which stores the outcomes of function across
+            queries.  See rule_cache.
+        executor: an Executor which runs the calls of this rule instead of
+            the Graphcore's rule_executor.  Ignored for batch rules.  See
+            executors.
+        """
+        if batch:
+            function = BatchFunction(function)
+        if cache is not None:
+            function = CachedFunction(function, cache)
+
         self.rules.append(Rule(
-            function, inputs, output, cardinality
+            function, inputs, output, cardinality, executor=executor,
+            pure=pure,
         ))
+        self.plan_cache.clear()
 
     def direct_map(self, input, output):
         def mapper(**kwargs):
@@ -341,11 +514,13 @@ class Graphcore(object):
         mapper.__name__ = ''
         self.register_rule([input], output, function=mapper)
 
-    def rule(self, inputs, output, cardinality=Cardinality.one):
+    def rule(self, inputs, output, cardinality=Cardinality.one, batch=False,
+             pure=False, cache=None, executor=None):
         def decorator(fn):
-            self.rules.append(Rule(
-                fn, inputs, output, cardinality
-            ))
+            self.register_rule(
+                inputs, output, cardinality=cardinality, function=fn,
+                batch=batch, pure=pure, cache=cache, executor=executor,
+            )
             return fn
         return decorator
 
@@ -368,54 +543,216 @@ class Graphcore(object):
         # specific.  for example:
         #     person.id might match on a [] -> person.id rule
         #     github_account.person.id might match on a more specific rule
-        for prefix, subpath in reversed(list(path.subpaths())):
-            # if there is a non empty prefix, only apply rules with more than 0
-            # inputs.  0 input rules can only be applied to the root.  see
+        #
+        # the subpath starting at position i is matched against rule outputs
+        # with the left most part replaced by the type of path[:i+1].  Walk
+        # the rule trie from the right end of the path, recording each
+        # match; the last match recorded is the longest.
+        parts = Path(path).parts
+        types = self.schema.prefix_types(parts)
+
+        match = None
+        node = self.rules.trie
+        for i in range(len(parts) - 1, 0, -1):
+            node = node.child(parts[i])
+            if node is None:
+                break
+
+            base_type_node = node.child(types[i - 1])
+            if base_type_node is None:
+                continue
+
+            # if there is a non empty prefix, only apply rules with more than
+            # 0 inputs.  0 input rules can only be applied to the root.  see
             # https://github.com/dwiel/graphcore/issues/17
-            require_input = len(prefix) != 1
+            rules = base_type_node.rules_for(require_input=i - 1 != 0)
+            if rules:
+                match = i - 1, rules
 
-            # fix type of left most part of subpath
-            base_type = self.schema.resolve_type(prefix)
-            subpath = base_type + subpath[1:]
-
-            # first try finding a match direct on the root
-            rule = self.rules.lookup(subpath, require_input)
-            if rule is not None:
-                return prefix, rule
+        if match is not None:
+            i, rules = match
+            return Path(parts[:i + 1]), self._choose_rule(rules)
 
+        base_types = self.base_types()
         for subpath in path[:-1]:
-            if str(subpath) not in self.base_types():
+            if str(subpath) not in base_types:
                 raise BaseTypeNotFound(subpath, path)
 
         raise PathNotFound(path, self)
 
+    def _choose_rule(self, rules):
+        """ choose between rules registered for the same output.  Without
+        rule_stats, the latest rule registered is used.  With rule_stats,
+        the rule with the lowest mean latency is.  Rules which have never
+        been called are tried first so that they get measured. """
+        if self.rule_stats is None or len(rules) == 1:
+            return rules[-1]
+
+        def cost(rule):
+            latency = self.rule_stats.latency(rule.key)
+            if latency is None:
+                return 0
+            return latency
+
+        # min keeps the first of equal costs, so prefer the latest rule
+        return min(reversed(rules), key=cost)
+
     def optimize(self, query_search):
         # optimize query.call_graph here
         from .optimize_reduce_like_parent_child import reduce_like_parent_child
+        from .optimize_reduce_like_siblings import reduce_like_siblings
         from .sql_query import SQLQuery
-        query_search.call_graph = reduce_like_parent_child(
-            query_search.call_graph, SQLQuery, SQLQuery.merge_parent_child
-        )
+
+        # merging siblings can leave a parent with a single SQLQuery child
+        # and merging a parent and child can give nodes new siblings, so
+        # repeat both until neither merges any more nodes
+        while True:
+            nodes = len(query_search.call_graph.nodes)
+
+            with span(self.tracer, 'optimize.reduce_like_siblings'):
+                query_search.call_graph = reduce_like_siblings(
+                    query_search.call_graph, SQLQuery,
+                    SQLQuery.merge_like_siblings, SQLQuery.sibling_key
+                )
+
+            with span(self.tracer, 'optimize.reduce_like_parent_child'):
+                query_search.call_graph = reduce_like_parent_child(
+                    query_search.call_graph, SQLQuery,
+                    SQLQuery.merge_parent_child
+                )
+
+            if len(query_search.call_graph.nodes) == nodes:
+                break
 
         from .optimize_constrain_sql_queries import constrain_sql_queries
-        constrain_sql_queries(query_search.call_graph)
+        with span(self.tracer, 'optimize.constrain_sql_queries'):
+            constrain_sql_queries(query_search.call_graph)
+
+    def compile(self, template, profile=None):
+        """ search, optimize and plan template, a query whose constant values
+        may be Parameters.  Returns a CompiledQuery
+
+        profile: a QueryProfile to record the time of each phase in
+        """
+        if profile is None:
+            profile = QueryProfile()
+
+        # read before planning so that stats recorded while planning cause
+        # the plan to be rebuilt
+        if self.rule_stats is None:
+            stats_generation = None
+        else:
+            stats_generation = self.rule_stats.generation
+
+        with profile.timer('search'), span(self.tracer, 'search'):
+            query_search = QuerySearch(self, template)
+
+            query_search.backward()
+
+        with profile.timer('optimize'), span(self.tracer, 'optimize'):
+            self.optimize(query_search)
+
+        with profile.timer('plan'), span(self.tracer, 'plan'):
+            query_planner = QueryPlanner(
+                query_search.call_graph, query_search.query, template,
+                mapper=self.mapper, rule_stats=self.rule_stats,
+            )
+            query_plan = query_planner.plan_query()
+
+            return CompiledQuery(
+                template, query_search.query, query_plan.nodes,
+                query_plan.output_paths, mapper=self.mapper,
+                executor=self.executor, memo_stats=self.memo_stats,
+                columnar=self.columnar, rule_stats=self.rule_stats,
+                tracer=self.tracer, rule_executor=self.rule_executor,
+                stats_generation=stats_generation,
+            )
+
+    def _cached_compile(self, template):
+        key = template_key(template)
+
+        compiled_query = self.plan_cache.get(key)
+        if compiled_query is None or (
+            self.rule_stats is not None and
+            compiled_query.stats_generation != self.rule_stats.generation
+        ):
+            compiled_query = self.compile(template)
+            self.plan_cache.put(key, compiled_query)
+
+        return compiled_query
 
     def query(self, query, limit=None,
-              exception_handler=default_exception_handler):
-        query_search = QuerySearch(self, query)
+              exception_handler=default_exception_handler, profile=False):
+        """ execute query and return the list of output rows.
+
+        limit: the maximum number of top level rows, or a dict with the
+            maximum length of each list: {None: 10, 'user.books': 3} limits
+            the top level to 10 rows and each user's books to 3.  The
+            results are the same as truncating the lists at the end, but
+            rules stop being called as soon as there are enough rows.
+        profile: if True, return (rows, QueryProfile).  See explain_analyze
+        """
+        if profile:
+            profile = self.explain_analyze(query, limit, exception_handler)
+            return profile.result, profile
 
-        query_search.backward()
+        template, params = parameterize_query(query)
 
-        self.optimize(query_search)
+        with span(self.tracer, 'query', query=template):
+            return self._cached_compile(template).execute(
+                params, limit=limit, exception_handler=exception_handler
+            )
+
+    def iter_query(self, query, limit=None,
+                   exception_handler=default_exception_handler):
+        """ return a generator which yields the output rows of query one at
+        a time, as soon as each one is complete:
+
+            for row in gc.iter_query(query):
+                ...
+
+        See QueryPlan.iter_execute.
+        """
+        template, params = parameterize_query(query)
+
+        return self._cached_compile(template).iter_execute(
+            params, limit=limit, exception_handler=exception_handler
+        )
+
+    def aquery(self, query, limit=None,
+               exception_handler=default_exception_handler,
+               concurrency=None):
+        """ return a coroutine which executes query on the running asyncio
+        event loop:
 
-        query_planner = QueryPlanner(
-            query_search.call_graph, query_search.query, query,
-            mapper=self.mapper
+            ret = await gc.aquery(query)
+
+        rule functions may be coroutine functions.  See AsyncQueryPlan.
+        """
+        template, params = parameterize_query(query)
+
+        if concurrency is None:
+            concurrency = self.concurrency
+
+        return self._cached_compile(template).aexecute(
+            params, limit=limit, exception_handler=exception_handler,
+            concurrency=concurrency,
         )
-        query_plan = query_planner.plan_query()
 
-        return query_plan.execute(
-            limit=limit, exception_handler=exception_handler
+    def prepare(self, query_template, limit=None,
+                exception_handler=default_exception_handler):
+        """ search, optimize and plan query_template once and return a
+        PreparedQuery which can be executed with parameter bindings:
+
+            prepared = gc.prepare({
+                'user.id': Parameter('user_id'),
+                'user.name?': None,
+            })
+            prepared.execute(user_id=5)
+        """
+        return PreparedQuery(
+            self, query_template, limit=limit,
+            exception_handler=exception_handler,
         )
 
     def explain(self, query):
@@ -427,6 +764,28 @@ class Graphcore(object):
 
         return query_search.call_graph.explain()
 
+    def explain_analyze(self, query, limit=None,
+                        exception_handler=default_exception_handler):
+        """ execute query and return a QueryProfile with the time spent in
+        search, optimize, plan and execute, and the wall time, rule calls,
+        rows, exceptions handled and cache hits of each node of the plan:
+
+            print(gc.explain_analyze(query))
+
+        The plan cache is bypassed so that every phase is measured.  The
+        output rows are in profile.result.
+        """
+        profile = QueryProfile()
+        template, params = parameterize_query(query)
+
+        compiled_query = self.compile(template, profile=profile)
+        profile.result = compiled_query.execute(
+            params, limit=limit, exception_handler=exception_handler,
+            profile=profile,
+        )
+
+        return profile
+
     def base_types(self):
         ret = set()
         for rule in self.rules:
@@ -11,6 +11,7 @@ from sqlalchemy.ext.declarative import declarative_base
 
 from .graphcore import Graphcore
 from .sql_query import SQLQuery
+from .sql_pool import ConnectionPool
 from .sql_reflect import SQLReflector
 
 
@@ -56,6 +57,22 @@ def gc(engine, SQLAlchemyQueryClass):
     return gc
 
 
+@pytest.fixture
+def batch_gc(engine):
+    class SQLAlchemyQuery(SQLQuery):
+        queries = []
+
+        def driver(self, SQL, values):
+            self.queries.append(SQL)
+            return engine.execute(SQL, values)
+
+    gc = Graphcore()
+    SQLReflector(gc, engine, SQLAlchemyQuery, '?', batch_size=2)
+    gc.queries = SQLAlchemyQuery.queries
+
+    return gc
+
+
 @pytest.fixture
 def session(engine):
     return sessionmaker(bind=engine)()
@@ -99,3 +116,160 @@ def test_query_and_filter(gc, session):
     print(gc.explain(query))
 
     assert len(ret) == 1
+
+
+def test_batch(batch_gc, session):
+    session.add_all([
+        User(id=i, name='user{}'.format(i)) for i in range(1, 6)
+    ])
+    session.add_all([
+        Book(id=10, user_id=1), Book(id=11, user_id=1), Book(id=30, user_id=3)
+    ])
+    session.commit()
+
+    ids = [1, 2, 3, 4, 5]
+    batch_gc.register_rule(
+        [], 'python_user.id', function=lambda: ids, cardinality='many'
+    )
+    batch_gc.direct_map('python_user.id', 'python_user.user.id')
+    batch_gc.property_type('python_user', 'user', 'user')
+
+    ret = batch_gc.query({
+        'python_user.id?': None,
+        'python_user.user.name?': None,
+        'python_user.user.books.id?': None,
+    })
+
+    assert sorted(
+        (r['python_user.id'], r['python_user.user.name'],
+         r['python_user.user.books.id']) for r in ret
+    ) == [(1, 'user1', 10), (1, 'user1', 11), (3, 'user3', 30)]
+
+    # 5 user ids in chunks of 2 for the books, then the names of the 2 users
+    # with books in one more query
+    assert len(batch_gc.queries) == 4
+
+
+@pytest.mark.parametrize('columnar', [False, True])
+def test_limit(engine, session, columnar):
+    session.add_all([
+        User(id=i, name='user{}'.format(i), age=i) for i in range(1, 11)
+    ])
+    session.commit()
+
+    queries = []
+
+    class SQLAlchemyQuery(SQLQuery):
+        def driver(self, SQL, values):
+            queries.append(SQL)
+            return engine.execute(SQL, values).fetchall()
+
+    gc = Graphcore(columnar=columnar)
+    SQLReflector(gc, engine, SQLAlchemyQuery, '?')
+
+    ret = gc.query({
+        'user.id?': None,
+        'user.age>': 3,
+    }, limit=2)
+
+    assert ret == [{'user.id': 4}, {'user.id': 5}]
+
+    # the filter is merged into the query for the ids, so no more than 2
+    # rows are needed from it
+    assert len(queries) == 1
+    assert 'LIMIT 2' in queries[0]
+
+
+def test_connection_pool(engine, session):
+    session.add_all([
+        User(id=i, name='user{}'.format(i), age=i) for i in range(1, 4)
+    ])
+    session.commit()
+
+    pool = ConnectionPool(engine)
+    gc = Graphcore()
+    SQLReflector(gc, engine, SQLQuery, '?', pool=pool)
+
+    # the connections checked back in to the engine's own pool
+    checkins = []
+    sqlalchemy.event.listen(
+        engine, 'checkin', lambda *args: checkins.append(1)
+    )
+
+    ret = gc.query({
+        'user.id?': None,
+        'user.name?': None,
+        'user.age?': None,
+    })
+
+    assert ret == [
+        {'user.id': i, 'user.name': 'user{}'.format(i), 'user.age': i}
+        for i in range(1, 4)
+    ]
+
+    # every query of the plan used the same connection, which was handed
+    # back to the engine afterwards
+    assert pool.stats()['checkouts'] == 1
+    assert pool.stats()['size'] == 0
+    assert checkins == [1]
+
+
+def test_stream(engine, session):
+    session.add_all([
+        User(id=i, name='user{}'.format(i), age=i) for i in range(1, 11)
+    ])
+    session.commit()
+
+    pool = ConnectionPool(engine)
+    gc = Graphcore()
+    SQLReflector(gc, engine, SQLQuery, '?', pool=pool, stream=True,
+                 fetch_size=3)
+
+    query = {'user.id?': None, 'user.name?': None}
+    assert gc.query(query) == [
+        {'user.id': i, 'user.name': 'user{}'.format(i)} for i in range(1, 11)
+    ]
+
+    rows = gc.iter_query(query)
+    assert next(rows) == {'user.id': 1, 'user.name': 'user1'}
+    rows.close()
+
+    # every connection was handed back to the engine
+    assert pool.stats()['size'] == 0
+
+
+def test_merge_siblings(engine, session):
+    session.add_all([
+        User(id=i, name='user{}'.format(i), age=i) for i in range(1, 4)
+    ])
+    session.commit()
+
+    queries = []
+
+    class SQLAlchemyQuery(SQLQuery):
+        def driver(self, SQL, values):
+            queries.append(SQL)
+            return engine.execute(SQL, values).fetchall()
+
+    gc = Graphcore()
+    SQLReflector(gc, engine, SQLAlchemyQuery, '?')
+    gc.register_rule(
+        [], 'python_user.id', function=lambda: [1, 2, 3], cardinality='many'
+    )
+    gc.direct_map('python_user.id', 'python_user.user.id')
+    gc.property_type('python_user', 'user', 'user')
+
+    ret = gc.query({
+        'python_user.id?': None,
+        'python_user.user.name?': None,
+        'python_user.user.age?': None,
+    })
+
+    assert ret == [{
+        'python_user.id': i,
+        'python_user.user.name': 'user{}'.format(i),
+        'python_user.user.age': i,
+    } for i in range(1, 4)]
+
+    # the name and age of each user are selected together
+    assert len(queries) == 3
@@ -6,7 +6,7 @@ from . import graphcore
 from .path import Path
 from .relation import Relation
 from .test_harness import testgraphcore
-from .result_set import NoneResult
+from .result_set import NoneResult, NoResult
 
 
 class hashabledict(dict):
@@ -118,6 +118,35 @@ def test_schema_resolve_type_unregistered(schema):
     assert schema.resolve_type(Path('a.x')) == 'x'
 
 
+def test_schema_resolve_type_first_property_type_wins(schema):
+    schema.append(graphcore.PropertyType('a', 'bs', 'c'))
+    assert schema.resolve_type(Path('a.bs')) == 'b'
+
+
+def test_schema_resolve_type_append_clears_memo(schema):
+    assert schema.resolve_type(Path('a.bs.cs')) == 'cs'
+    schema.append(graphcore.PropertyType('b', 'cs', 'c'))
+    assert schema.resolve_type(Path('a.bs.cs')) == 'c'
+
+
+def test_schema_resolve_type_pos(schema):
+    assert schema.resolve_type(Path('a.bs.x'), -2) == 'b'
+
+
+def test_rules_lookup():
+    rules = graphcore.Rules()
+    ground = graphcore.Rule(lambda: 1, [], 'a.x', 'one')
+    first = graphcore.Rule(lambda y: y, ['a.y'], 'a.x', 'one')
+    latest = graphcore.Rule(lambda y: y, ['a.y'], 'a.x', 'one')
+    for rule in [ground, first, latest]:
+        rules.append(rule)
+
+    assert rules.lookup(Path('a.x'), require_input=False) is latest
+    assert rules.lookup(Path('a.x'), require_input=True) is latest
+    assert rules.lookup(Path('x'), require_input=False) is None
+    assert rules.lookup(Path('b.a.x'), require_input=False) is None
+
+
 class TestGraphcore(unittest.TestCase):
 
     def test_available_rules_string(self):
@@ -140,6 +169,32 @@ class TestGraphcore(unittest.TestCase):
 
         assert prefix == ('a', 'b')
 
+    def test_lookup_rule_longest_subpath(self):
+        gc = graphcore.Graphcore()
+        gc.property_type('a', 'bs', 'b')
+        gc.register_rule(['b.in1'], 'b.out1', function=lambda in1: in1)
+        gc.register_rule(['a.id'], 'a.bs.out1', function=lambda id: id)
+
+        prefix, rule = gc.lookup_rule(Path('x.a.bs.out1'))
+
+        assert prefix == ('x', 'a')
+        assert rule.inputs == [Path('a.id')]
+
+        prefix, rule = gc.lookup_rule(Path('x.b.out1'))
+
+        assert prefix == ('x', 'b')
+        assert rule.inputs == [Path('b.in1')]
+
+    def test_lookup_rule_no_input_rule_only_at_root(self):
+        gc = graphcore.Graphcore()
+        gc.register_rule([], 'b.id', function=lambda: [1])
+
+        prefix, rule = gc.lookup_rule(Path('b.id'))
+        assert prefix == ('b',)
+
+        with pytest.raises(graphcore.PathNotFound):
+            gc.lookup_rule(Path('a.b.id'))
+
     def test_basic(self):
         ret = testgraphcore.query({
             'user.id': 1,
@@ -663,6 +718,375 @@ class TestGraphcore(unittest.TestCase):
         })
         assert ret == []
 
+    def test_plan_cache(self):
+        gc = graphcore.Graphcore()
+
+        gc.register_rule(['user.id'], 'user.name', function=lambda id: str(id))
+
+        assert gc.query({'user.id': 1, 'user.name?': None}) == [
+            {'user.name': '1'}
+        ]
+        assert gc.query({'user.id': 2, 'user.name?': None}) == [
+            {'user.name': '2'}
+        ]
+
+        assert gc.plan_cache.misses == 1
+        assert gc.plan_cache.hits == 1
+        assert len(gc.plan_cache) == 1
+
+    def test_plan_cache_parameterized_relation(self):
+        gc = graphcore.Graphcore()
+
+        gc.register_rule(
+            [], 'x.id', function=lambda: [1, 2, 3], cardinality='many'
+        )
+
+        assert gc.query({'x.id?': None, 'x.id>': 1}) == [
+            {'x.id': 2}, {'x.id': 3},
+        ]
+        assert gc.query({'x.id?': None, 'x.id>': 2}) == [
+            {'x.id': 3},
+        ]
+        assert gc.plan_cache.hits == 1
+
+    def test_plan_cache_invalidation(self):
+        gc = graphcore.Graphcore()
+
+        gc.register_rule(['user.id'], 'user.name', function=lambda id: str(id))
+        gc.query({'user.id': 1, 'user.name?': None})
+
+        @gc.rule(['user.name'], 'user.abbreviation')
+        def user_abbreviation(name):
+            return name[0]
+
+        assert len(gc.plan_cache) == 0
+        assert gc.plan_cache.invalidations == 1
+
+        gc.query({'user.id': 1, 'user.name?': None})
+        gc.property_type('user', 'books', 'book')
+
+        assert len(gc.plan_cache) == 0
+
+    def test_plan_cache_disabled(self):
+        gc = graphcore.Graphcore(plan_cache_size=0)
+
+        gc.register_rule(['user.id'], 'user.name', function=lambda id: str(id))
+        gc.query({'user.id': 1, 'user.name?': None})
+        gc.query({'user.id': 1, 'user.name?': None})
+
+        assert gc.plan_cache.hits == 0
+        assert len(gc.plan_cache) == 0
+
+    def test_executor(self):
+        from concurrent.futures import ThreadPoolExecutor
+
+        gc = graphcore.Graphcore(executor=ThreadPoolExecutor(4))
+        gc.rules = testgraphcore.rules
+        gc.schema = testgraphcore.schema
+
+        query = {
+            'user.id': 1,
+            'user.name?': None,
+            'user.books': [{
+                'id?': None,
+                'name?': None,
+                'author.id?': None,
+            }],
+        }
+
+        self.assertRetEqual(gc.query(query), testgraphcore.query(query))
+
+    def test_batch_rule(self):
+        gc = graphcore.Graphcore()
+        gc.property_type('user', 'books', 'book')
+
+        gc.register_rule(
+            [], 'user.id', function=lambda: [1, 2], cardinality='many'
+        )
+        gc.register_rule(
+            ['user.id'], 'user.books.id', cardinality='many',
+            function=lambda id: [id * 10, id * 10 + 1, id * 10 + 2],
+        )
+
+        calls = []
+
+        @gc.rule(['book.id'], 'book.name', batch=True)
+        def book_name(id):
+            calls.append(id)
+            return [
+                NoResult() if i % 10 == 1 else 'book{}'.format(i) for i in id
+            ]
+
+        ret = gc.query({
+            'user.id?': None,
+            'user.books': [{
+                'id?': None,
+                'name?': None,
+            }],
+        })
+
+        # one call for the books of every user
+        assert calls == [[10, 11, 12, 20, 21, 22]]
+        assert ret == [{
+            'user.id': user_id,
+            'user.books': [
+                {'id': user_id * 10, 'name': 'book{}'.format(user_id * 10)},
+                {'id': user_id * 10 + 2,
+                 'name': 'book{}'.format(user_id * 10 + 2)},
+            ]
+        } for user_id in [1, 2]]
+
+    def test_batch_rule_none_result(self):
+        gc = graphcore.Graphcore()
+
+        gc.register_rule(
+            [], 'x.in1', function=lambda: [1, 2, 3], cardinality='many'
+        )
+
+        def out1(in1):
+            if in1 == 2:
+                1/0
+            return in1
+
+        gc.register_rule(['x.in1'], 'x.out1', function=out1)
+
+        calls = []
+
+        def out2(out1):
+            calls.append(out1)
+            return [v * 2 for v in out1]
+
+        gc.register_rule(['x.out1'], 'x.out2', function=out2, batch=True)
+
+        ret = gc.query({
+            'x.out2?': None,
+        }, exception_handler=lambda *args: NoneResult())
+
+        # rows with a NoneResult input aren't passed to the batch function
+        assert calls == [[1, 3]]
+        assert ret == [{'x.out2': 2}, {'x.out2': None}, {'x.out2': 6}]
+
+    def test_batch_rule_wrong_length(self):
+        gc = graphcore.Graphcore()
+
+        gc.register_rule(
+            [], 'x.in1', function=lambda: [1, 2], cardinality='many'
+        )
+        gc.register_rule(
+            ['x.in1'], 'x.out1', function=lambda in1: [1], batch=True
+        )
+
+        with pytest.raises(ValueError) as e:
+            gc.query({'x.out1?': None})
+
+        assert '1 values for 2 rows' in str(e.value)
+
+    def test_pure_rule(self):
+        self._test_pure_rule()
+
+    def _test_pure_rule(self, **kwargs):
+        gc = graphcore.Graphcore(**kwargs)
+        gc.property_type('user', 'books', 'book')
+        gc.property_type('book', 'author', 'author')
+
+        gc.register_rule(
+            ['user.id'], 'user.books.id', cardinality='many',
+            function=lambda id: [1, 2, 3, 4],
+        )
+        gc.register_rule(
+            ['book.id'], 'book.author.id', function=lambda id: id % 2
+        )
+
+        calls = []
+
+        @gc.rule(['author.id'], 'author.name', pure=True)
+        def author_name(id):
+            calls.append(id)
+            if id == 0:
+                raise NoResult()
+            return 'author{}'.format(id)
+
+        ret = gc.query({
+            'user.id': 1,
+            'user.books.id?': None,
+            'user.books.author.name?': None,
+        })
+
+        assert ret == [
+            {'user.books.id': 1, 'user.books.author.name': 'author1'},
+            {'user.books.id': 3, 'user.books.author.name': 'author1'},
+        ]
+        assert calls == [1, 0]
+        assert gc.memo_stats.stats() == {'calls': 2, 'calls_saved': 2}
+
+        # the memo only lasts for one query
+        gc.query({
+            'user.id': 1,
+            'user.books.author.name?': None,
+        })
+        assert calls == [1, 0, 1, 0]
+        assert gc.memo_stats.stats() == {'calls': 4, 'calls_saved': 4}
+
+    def test_pure_rule_leaves_function_unchanged(self):
+        self._test_pure_rule_leaves_function_unchanged()
+
+    def _test_pure_rule_leaves_function_unchanged(self, **kwargs):
+        calls = []
+
+        def name(id):
+            calls.append(id)
+            return str(id)
+
+        gc = graphcore.Graphcore(**kwargs)
+        gc.register_rule([], 'user.id', cardinality='many',
+                         function=lambda: [1, 1])
+        gc.register_rule(['user.id'], 'user.name', function=name, pure=True)
+        gc.register_rule(['post.id'], 'post.name', function=name)
+        gc.register_rule([], 'post.id', cardinality='many',
+                         function=lambda: [1, 1])
+
+        assert not hasattr(name, 'pure')
+
+        gc.query({'user.id?': None, 'user.name?': None})
+        assert calls == [1]
+
+        # the same function registered without pure=True isn't memoized
+        del calls[:]
+        gc.query({'post.id?': None, 'post.name?': None})
+        assert calls == [1, 1]
+
+    def test_pure_rule_with_executors(self):
+        from concurrent.futures import ThreadPoolExecutor
+        from .executors import ThreadExecutor
+
+        # rule_executor has one worker so that the calls are made in order
+        with ThreadPoolExecutor(2) as executor, \
+                ThreadExecutor(1) as rule_executor:
+            for kwargs in [
+                {'executor': executor}, {'rule_executor': rule_executor}
+            ]:
+                self._test_pure_rule(**kwargs)
+                self._test_pure_rule_leaves_function_unchanged(**kwargs)
+
+    def test_iter_query(self):
+        for query in [{
+            'user.id': 1,
+            'user.books.id?': None,
+            'user.books.name?': None,
+        }, {
+            'user.id': 1,
+            'user.books.id?': None,
+            'user.books.id>': 1,
+        }, {
+            'user.id': 1,
+            'user.name?': None,
+            'user.books': [{
+                'id?': None,
+                'author.id?': None,
+            }],
+        }]:
+            self.assertEqual(
+                list(testgraphcore.iter_query(query)),
+                testgraphcore.query(query),
+            )
+
+    def test_iter_query_lazy(self):
+        import itertools
+
+        gc = graphcore.Graphcore()
+        gc.register_rule(
+            [], 'x.id', function=lambda: itertools.count(), cardinality='many'
+        )
+
+        calls = []
+
+        @gc.rule(['x.id'], 'x.name')
+        def name(id):
+            calls.append(id)
+            if id % 2:
+                raise NoResult()
+            return str(id)
+
+        rows = gc.iter_query({'x.id?': None, 'x.name?': None})
+
+        self.assertEqual(next(rows), {'x.id': 0, 'x.name': '0'})
+        self.assertEqual(calls, [0])
+        self.assertEqual(next(rows), {'x.id': 2, 'x.name': '2'})
+        self.assertEqual(calls, [0, 1, 2])
+
+        self.assertEqual(
+            list(gc.iter_query({'x.name?': None}, limit=3)),
+            [{'x.name': '0'}, {'x.name': '2'}, {'x.name': '4'}],
+        )
+
+    @staticmethod
+    def _users_graphcore(**kwargs):
+        gc = graphcore.Graphcore(**kwargs)
+        gc.register_rule(
+            [], 'user.id', function=lambda: range(10), cardinality='many'
+        )
+        gc.register_rule(['user.id'], 'user.age', function=lambda id: id * 5)
+        gc.register_rule(
+            ['user.id'], 'user.books.id', function=lambda id: range(id),
+            cardinality='many'
+        )
+        return gc
+
+    def test_limit_later_filter(self):
+        """ a limit gives the same results as truncating at the end, even
+        when a node after the many rule filters rows out """
+        from concurrent.futures import ThreadPoolExecutor
+
+        query = {
+            'user.id?': None,
+            'user.age>': 20,
+        }
+        expected = self._users_graphcore().query(query)[:2]
+        self.assertEqual(expected, [{'user.id': 5}, {'user.id': 6}])
+
+        for kwargs in [{}, {'executor': ThreadPoolExecutor(2)},
+                       {'columnar': True}]:
+            self.assertEqual(
+                self._users_graphcore(**kwargs).query(query, limit=2),
+                expected
+            )
+
+    def test_limit_stops_early(self):
+        import itertools
+
+        gc = graphcore.Graphcore()
+        gc.register_rule(
+            [], 'x.id', function=lambda: itertools.count(), cardinality='many'
+        )
+        gc.register_rule(['x.id'], 'x.odd', function=lambda id: id % 2)
+
+        self.assertEqual(
+            gc.query({'x.id?': None, 'x.odd': 1}, limit=2),
+            [{'x.id': 1}, {'x.id': 3}],
+        )
+
+    def test_limit_nested(self):
+        query = {
+            'user.id?': None,
+            'user.age>': 20,
+            'user.books': [{
+                'id?': None,
+            }],
+        }
+        limit = {None: 2, 'user.books': 3}
+        expected = [
+            {'user.id': 5, 'user.books': [{'id': 0}, {'id': 1}, {'id': 2}]},
+            {'user.id': 6, 'user.books': [{'id': 0}, {'id': 1}, {'id': 2}]},
+        ]
+
+        for kwargs in [{}, {'columnar': True}]:
+            gc = self._users_graphcore(**kwargs)
+            self.assertEqual(gc.query(query, limit=limit), expected)
+        self.assertEqual(list(gc.iter_query(query, limit=limit)), expected)
+
+        with pytest.raises(ValueError):
+            gc.query(query, limit={'user.id': 1})
+
 
 class TestQuerySearch(unittest.TestCase):
 
@@ -695,6 +1119,39 @@ class TestQuerySearch(unittest.TestCase):
             query.query[0],
         )
 
+    def test_backward_grounds_unbound_output(self):
+        query = graphcore.QuerySearch(testgraphcore, {
+            'user.id': 1,
+            'user.name': graphcore.OutVar(),
+        })
+        query.backward()
+
+        name = query.query.clause_map[graphcore.Path('user.name')]
+        self.assertTrue(query._grounded(name))
+
+        # user.id is given, so no rule is needed to ground it
+        user_id = query.query.clause_map[graphcore.Path('user.id')]
+        self.assertFalse(query._grounded(user_id))
+
+        self.assertEqual(
+            [node.outgoing_paths for node in query.call_graph.nodes],
+            [(graphcore.Path('user.name'),)],
+        )
+
+    def test_backward_grounds_input_clauses(self):
+        query = graphcore.QuerySearch(testgraphcore, {
+            'user.id': 1,
+            'user.abbreviation?': None,
+        })
+        query.backward()
+
+        # user.name, the input of user.abbreviation, is grounded too
+        name = query.query.clause_map[graphcore.Path('user.name')]
+        self.assertTrue(query._grounded(name))
+        for clause in query.query:
+            if isinstance(clause.rhs, graphcore.Var):
+                self.assertTrue(query._grounded(clause))
+
     def test_query_search_nested(self):
         query = graphcore.QuerySearch(testgraphcore, {
             'user.id': 1,
@@ -797,6 +1254,40 @@ class TestQuerySearch(unittest.TestCase):
         with pytest.raises(graphcore.PathNotFound):
             query.backward()
 
+    def test_backward_converts_unused_clause_to_constraint(self):
+        gc = graphcore.Graphcore()
+
+        gc.register_rule(
+            [], 'x.id', cardinality='many', function=lambda: [1, 2, 3]
+        )
+        gc.register_rule(['x.id'], 'x.id2', function=lambda id: id)
+        gc.register_rule(['x.id'], 'x.id3', function=lambda id: id)
+
+        query = graphcore.QuerySearch(gc, {
+            'x.id2': 4,
+            'x.id3?': None,
+        })
+        query.backward()
+
+        clause = query.query.clause_map[Path('x.id2')]
+        assert clause.relation == Relation('==', 4)
+        assert len(query.call_graph.nodes) == 3
+
+    def test_backward_wide_query(self):
+        gc = graphcore.Graphcore()
+
+        query = {'x.id': 1}
+        for i in range(100):
+            gc.register_rule(
+                ['x.id'], 'x.p{}'.format(i), function=lambda id: id
+            )
+            query['x.p{}?'.format(i)] = None
+
+        query_search = graphcore.QuerySearch(gc, query)
+        query_search.backward()
+
+        assert len(query_search.call_graph.nodes) == 100
+
     def test_explain(self):
         gc = graphcore.Graphcore()
         assert isinstance(gc.explain({}), six.string_types)
@@ -4,24 +4,33 @@ from .sql_query import SQLQuery
 def constrain_sql_queries(call_graph):
     """ Move relations on SQLQuery nodes out of graphcore relations and into
     the where clause of the SQLQuery
+
+    nodes are replaced rather than modified so that nodes and functions which
+    are shared with other queries (or cached plans) are never changed.
     """
-    for node in call_graph.nodes:
-        if isinstance(node.function, SQLQuery):
-            new_relations = []
-            for select, relation in zip(node.function.selects, node.relations):
-                if relation is not None:
-                    # we don't want to modify this function for all future
-                    # queries, just this one.
-                    node.function = node.function.copy()
-
-                    if relation.operation == '==':
-                        key = select
-                    else:
-                        key = select + relation.operation
-
-                    node.function.where[key] = relation.value
-
-                    relation = None
-
-                new_relations.append(relation)
-            node.relations = new_relations
+    for node in list(call_graph.nodes):
+        if not isinstance(node.function, SQLQuery):
+            continue
+
+        if all(relation is None for relation in node.relations):
+            continue
+
+        function = node.function.copy()
+        new_relations = list(node.relations)
+        for i, (select, relation) in enumerate(
+            zip(function.selects, node.relations)
+        ):
+            if relation is not None:
+                if relation.operation == '==':
+                    key = select
+                else:
+                    key = select + relation.operation
+
+                function.where[key] = relation.value
+
+                new_relations[i] = None
+
+        call_graph.replace_node(
+            node, node.incoming_paths, node.outgoing_paths, function,
+            node.cardinality, new_relations
+        )
@@ -0,0 +1,31 @@
+from .call_graph import CallGraph
+from .relation import Relation
+from .sql_query import SQLQuery
+
+from .optimize_constrain_sql_queries import constrain_sql_queries
+
+
+def test_constrain_sql_queries():
+    sql_query = SQLQuery(['users'], 'users.age', {}, one_column=True)
+
+    call_graph = CallGraph()
+    call_graph.add_node(
+        [], ['user.name'], lambda: ['bob'], 'many'
+    )
+    node = call_graph.add_node(
+        [], ['user.age'], sql_query, 'many', relations=[Relation('>', 5)],
+        stats_key='user.age = users.age()', pure=True,
+    )
+
+    constrain_sql_queries(call_graph)
+
+    new_node = call_graph.nodes[1]
+    assert new_node.function.where == {'users.age>': 5}
+    assert new_node.relations == (None,)
+    assert call_graph.edge('user.age').setter is new_node
+    assert new_node.stats_key == 'user.age = users.age()'
+    assert new_node.pure
+
+    # neither the original node nor its function are modified
+    assert sql_query.where == {}
+    assert node.relations == (Relation('>', 5),)
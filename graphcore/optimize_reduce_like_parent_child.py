@@ -35,7 +35,8 @@ def reduce_like_parent_child(call_graph, rule_type, merge_function):
                 # TODO: less awkward insert pattern
                 parent = call_graph.add_node(
                     node.incoming_paths, node.outgoing_paths, node.function,
-                    node.cardinality, node.relations
+                    node.cardinality, node.relations,
+                    **node.rule_attributes()
                 )
 
                 changes_made = True
@@ -1,24 +1,69 @@
-def reduce_like_siblings(call_graph, rule_type, merge_function):
+def _group(nodes, key_function):
+    """ group nodes by key_function, in order.  Nodes whose key is None are
+    left out.  Keys are compared with == so they don't need to be
+    hashable """
+    groups = []
+    for node in nodes:
+        if key_function is None:
+            key = True
+        else:
+            key = key_function(node)
+            if key is None:
+                continue
+
+        for group_key, group in groups:
+            if group_key == key:
+                group.append(node)
+                break
+        else:
+            groups.append((key, [node]))
+
+    return [group for key, group in groups]
+
+
+def reduce_like_siblings(call_graph, rule_type, merge_function,
+                         key_function=None):
     """Given a call_graph, reduce sibling nodes of rule_type
     using merge_function.
 
+    key_function: if given, only siblings with equal keys are merged
+        together, and nodes whose key is None aren't merged at all.
+
     Returns a modified call_graph
     """
-    for path, edge in call_graph.edges.items():
-        nodes = [
-            node for node in edge.getters
-            if isinstance(node.function, rule_type)
-        ]
-        if len(nodes) > 1:
-            node = merge_function(nodes)
-
-            # TODO: less awkward insert pattern
-            call_graph.add_node(
-                node.incoming_paths, node.outgoing_paths, node.function,
-                node.cardinality, node.relations
-            )
-
-            for node in nodes:
-                call_graph.remove_node(node)
+    first_pass = True
+    changes_made = False
+    passes = 0
+
+    while changes_made or first_pass:
+        passes += 1
+        if passes > 100:
+            raise ValueError('looks like were in an infinite loop')
+        first_pass = False
+        changes_made = False
+
+        for path, edge in list(call_graph.edges.items()):
+            # keep the order of call_graph.nodes so that merged functions
+            # are the same from one search of a query to the next
+            nodes = sorted((
+                node for node in edge.getters
+                if isinstance(node.function, rule_type)
+            ), key=call_graph.nodes.index)
+
+            for group in _group(nodes, key_function):
+                if len(group) < 2:
+                    continue
+
+                node = merge_function(group)
+
+                call_graph.replace_node(
+                    group[0], node.incoming_paths, node.outgoing_paths,
+                    node.function, node.cardinality, node.relations,
+                    **node.rule_attributes()
+                )
+                for node in group[1:]:
+                    call_graph.remove_node(node)
+
+                changes_made = True
 
     return call_graph
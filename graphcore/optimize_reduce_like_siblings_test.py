@@ -58,3 +58,32 @@ def test_reduce_like_siblings():
 
     assert call_graph_expected1 == call_graph_out or \
         call_graph_expected2 == call_graph_out
+
+
+def test_reduce_like_siblings_key_function():
+    call_graph_in = CallGraph()
+    call_graph_in.add_node(
+        ['user.id'], ['user.first_name'], frozenset([1]), 'one'
+    )
+    call_graph_in.add_node(
+        ['user.id'], ['user.books.id'], frozenset([2]), 'many'
+    )
+    call_graph_in.add_node(
+        ['user.id'], ['user.last_name'], frozenset([3]), 'one'
+    )
+
+    # only merge nodes with the same cardinality
+    call_graph_out = reduce_like_siblings(
+        call_graph_in, frozenset, reducer, lambda node: node.cardinality
+    )
+
+    call_graph_expected = CallGraph()
+    call_graph_expected.add_node(
+        ['user.id'], ['user.first_name', 'user.last_name'],
+        frozenset([1, 3]), 'one'
+    )
+    call_graph_expected.add_node(
+        ['user.id'], ['user.books.id'], frozenset([2]), 'many'
+    )
+
+    assert call_graph_expected == call_graph_out
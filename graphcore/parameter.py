@@ -0,0 +1,145 @@
+"""
+Parameters stand in for the constant values of a query so that the work of
+searching, optimizing and planning a query can be shared by every query with
+the same shape.
+
+    {'user.id': 1, 'user.name?': None}
+
+is parameterized into the template and params:
+
+    {'user.id': Parameter(0), 'user.name?': None}, {0: 1}
+"""
+
+from .clause import Var
+
+
+class Parameter(object):
+    """ a placeholder for a value which will be bound when the query is
+    executed """
+
+    def __init__(self, name):
+        self.name = name
+
+    def __repr__(self):
+        return '<Parameter {name!r}>'.format(name=self.name)
+
+    def __eq__(self, other):
+        if isinstance(other, Parameter):
+            return self.name == other.name
+        return NotImplemented
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((Parameter, self.name))
+
+
+class MissingParameter(KeyError):
+    def __init__(self, name):
+        super(MissingParameter, self).__init__(name)
+        self.name = name
+
+    def __str__(self):
+        return 'no value bound for parameter {name!r}'.format(name=self.name)
+
+
+def _is_subquery(key, value):
+    return isinstance(value, list) and key[-2:] != '|='
+
+
+def parameterize_query(query):
+    """ return a (template, params) pair.  template is query with every
+    constant value replaced by a Parameter and params maps each Parameter
+    name to the value it replaced.
+
+    Values which change how the query is searched are kept in the template:
+    subqueries, None (ground to None) and Var instances.  Parameters which
+    are already present in query are left alone.
+    """
+    params = {}
+    template = _parameterize_query(query, params)
+    return template, params
+
+
+def _parameterize_query(query, params):
+    template = {}
+
+    # sort so that two queries with the same keys get the same parameter
+    # names no matter what order the keys were inserted in
+    for key in sorted(query):
+        value = query[key]
+        if _is_subquery(key, value):
+            template[key] = [_parameterize_query(value[0], params)]
+        elif key[-1] == '?':
+            # the value of an output clause is ignored
+            template[key] = None
+        elif value is None or isinstance(value, (Var, Parameter)):
+            template[key] = value
+        else:
+            parameter = Parameter(len(params))
+            params[parameter.name] = value
+            template[key] = parameter
+
+    return template
+
+
+def template_key(template):
+    """ return a hashable key which is equal for equal templates """
+    if isinstance(template, dict):
+        return tuple(
+            (key, template_key(value))
+            for key, value in sorted(template.items())
+        )
+    elif isinstance(template, list):
+        return tuple(template_key(value) for value in template)
+    elif isinstance(template, Var):
+        return template.__class__
+    else:
+        return template
+
+
+def contains_parameters(value):
+    if isinstance(value, Parameter):
+        return True
+    elif isinstance(value, (list, tuple)):
+        return any(contains_parameters(v) for v in value)
+    elif isinstance(value, dict):
+        return any(contains_parameters(v) for v in value.values())
+    else:
+        return False
+
+
+def bind_parameters(value, params):
+    """ return a copy of value with each Parameter replaced by its value in
+    params.  Values which contain no Parameters are returned as is. """
+    if isinstance(value, Parameter):
+        try:
+            return params[value.name]
+        except KeyError:
+            raise MissingParameter(value.name)
+    elif isinstance(value, list):
+        return [bind_parameters(v, params) for v in value]
+    elif isinstance(value, tuple):
+        return tuple(bind_parameters(v, params) for v in value)
+    elif isinstance(value, dict):
+        return {k: bind_parameters(v, params) for k, v in value.items()}
+    else:
+        return value
+
+
+def parameter_names(value):
+    """ return the set of names of all Parameters in value """
+    if isinstance(value, Parameter):
+        return set([value.name])
+    elif isinstance(value, (list, tuple)):
+        values = value
+    elif isinstance(value, dict):
+        values = value.values()
+    else:
+        return set()
+
+    names = set()
+    for v in values:
+        names.update(parameter_names(v))
+    return names
@@ -0,0 +1,80 @@
+import pytest
+
+from .clause import OutVar
+from .parameter import Parameter, MissingParameter
+from .parameter import parameterize_query, bind_parameters, template_key
+
+
+def test_parameterize_query():
+    template, params = parameterize_query({
+        'user.id': 1,
+        'user.name?': None,
+    })
+
+    assert template == {
+        'user.id': Parameter(0),
+        'user.name?': None,
+    }
+    assert params == {0: 1}
+
+
+def test_parameterize_query_relations_and_subqueries():
+    template, params = parameterize_query({
+        'user.id': 1,
+        'user.books': [{
+            'id>': 2,
+            'id|=': [3, 4],
+            'name?': None,
+        }],
+    })
+
+    assert template == {
+        'user.books': [{
+            'id>': Parameter(0),
+            'id|=': Parameter(1),
+            'name?': None,
+        }],
+        'user.id': Parameter(2),
+    }
+    assert params == {0: 2, 1: [3, 4], 2: 1}
+
+
+def test_parameterize_query_keeps_none_and_vars():
+    out_var = OutVar()
+    template, params = parameterize_query({
+        'x.a': None,
+        'x.b': out_var,
+        'x.c': Parameter('c'),
+    })
+
+    assert template == {'x.a': None, 'x.b': out_var, 'x.c': Parameter('c')}
+    assert params == {}
+
+
+def test_template_key_ignores_values_and_order():
+    template1, _ = parameterize_query({'a': 1, 'b?': None, 'c>': 2})
+    template2, _ = parameterize_query({'c>': 5, 'a': 6, 'b?': None})
+    template3, _ = parameterize_query({'a': 1, 'b?': None, 'c<': 2})
+
+    assert template_key(template1) == template_key(template2)
+    assert template_key(template1) != template_key(template3)
+    hash(template_key(template1))
+
+
+def test_bind_parameters():
+    template, params = parameterize_query({
+        'user.id': 1,
+        'user.books': [{'id|=': [3, 4]}],
+    })
+
+    assert bind_parameters(template, params) == {
+        'user.id': 1,
+        'user.books': [{'id|=': [3, 4]}],
+    }
+
+
+def test_bind_parameters_missing():
+    with pytest.raises(MissingParameter) as e:
+        bind_parameters({'user.id': Parameter('user_id')}, {})
+
+    assert 'user_id' in str(e.value)
@@ -0,0 +1,261 @@
+"""
+The PlanCache holds CompiledQuery objects keyed by the shape of the query
+they were compiled from so that repeated queries with the same shape only pay
+for QuerySearch, optimization and QueryPlanner once.
+"""
+
+import threading
+from collections import OrderedDict
+
+from .call_graph import Node
+from .relation import Relation
+from .parameter import bind_parameters, contains_parameters
+from .query_plan import QueryPlan
+from .query_planner import initial_result_set
+from .columnar_result_set import ColumnarResultSet
+from .result_set import default_exception_handler
+from .rule_stats import stats_key
+
+
+def _top_level_limit(limit):
+    """ True if limit limits the number of top level results.  See
+    QueryPlan._limits """
+    if isinstance(limit, dict):
+        return bool(limit.get(None))
+    return bool(limit)
+
+
+def _node_has_parameters(node):
+    for relation in node.relations:
+        if relation is not None and contains_parameters(relation.value):
+            return True
+
+    has_parameters = getattr(node.function, 'has_parameters', None)
+    return bool(has_parameters and has_parameters())
+
+
+def _bind_relation(relation, params):
+    if relation is None:
+        return None
+
+    return Relation(
+        relation.operation, bind_parameters(relation.value, params)
+    )
+
+
+def bind_node(node, params):
+    """ return a new Node with all Parameters in node bound.
+
+    Functions may contain Parameters too (for example an SQLQuery with a
+    relation moved into its where clause).  Those functions must implement
+    has_parameters() and bind_parameters(params).
+    """
+    function = node.function
+    if hasattr(function, 'bind_parameters'):
+        function = function.bind_parameters(params)
+
+    attributes = node.rule_attributes()
+    # the stats of every binding are recorded together
+    attributes['stats_key'] = stats_key(node)
+    if function is not node.function:
+        attributes['rule_id'] = None
+
+    return Node(
+        None, node.incoming_paths, node.outgoing_paths, function,
+        node.cardinality, [
+            _bind_relation(relation, params) for relation in node.relations
+        ], **attributes
+    )
+
+
+class CompiledQuery(object):
+    """ the result of searching, optimizing and planning a query template.
+
+    A CompiledQuery is never modified after it is built, so it can be shared
+    between threads.  Each execution builds its own QueryPlan and ResultSet.
+    """
+
+    def __init__(self, template, query, nodes, output_paths, mapper=map,
+                 executor=None, memo_stats=None, columnar=False,
+                 rule_stats=None, tracer=None, rule_executor=None,
+                 stats_generation=None):
+        """
+        template: the query with constant values replaced by Parameters
+        query: the Query after QuerySearch, used to seed the ResultSet
+        nodes: the planned nodes in execution order
+        stats_generation: the RuleStats.generation the plan was built from
+        """
+        self.template = template
+        self.query = query
+        self.nodes = tuple(nodes)
+        self.output_paths = tuple(output_paths)
+        self.mapper = mapper
+        self.executor = executor
+        self.memo_stats = memo_stats
+        self.columnar = columnar
+        self.rule_stats = rule_stats
+        self.tracer = tracer
+        self.rule_executor = rule_executor
+        self.stats_generation = stats_generation
+
+        # only nodes with Parameters need to be rebuilt for each execution
+        self._parameterized = frozenset(
+            i for i, node in enumerate(self.nodes)
+            if _node_has_parameters(node)
+        )
+
+    def _result_set(self, params, columnar=None):
+        if columnar is None:
+            columnar = self.columnar
+
+        query_shape = bind_parameters(self.template, params)
+
+        result_set = initial_result_set(self.query, query_shape, self.mapper)
+        if columnar:
+            result_set = ColumnarResultSet.from_result_set(result_set)
+        return result_set
+
+    def _append_nodes(self, plan, params):
+        for i, node in enumerate(self.nodes):
+            if i in self._parameterized:
+                node = bind_node(node, params)
+            plan.append(node)
+
+        return plan
+
+    def plan(self, params, profile=None, columnar=None):
+        """ return a new QueryPlan with params bound.  columnar overrides
+        self.columnar """
+        return self._append_nodes(QueryPlan(
+            self._result_set(params, columnar), list(self.output_paths),
+            executor=self.executor, memo_stats=self.memo_stats,
+            rule_stats=self.rule_stats, profile=profile, tracer=self.tracer,
+            rule_executor=self.rule_executor,
+        ), params)
+
+    def async_plan(self, params, concurrency=None):
+        """ return a new AsyncQueryPlan with params bound """
+        from .async_query_plan import AsyncQueryPlan
+
+        return self._append_nodes(AsyncQueryPlan(
+            self._result_set(params), list(self.output_paths),
+            concurrency=concurrency,
+        ), params)
+
+    def execute(self, params, exception_handler=default_exception_handler,
+                limit=None, profile=None):
+        """ profile: a QueryProfile to record the execution in """
+        # the columnar ResultSet applies each node to every row, so it can't
+        # stop early.  See QueryPlan._streamable
+        if _top_level_limit(limit):
+            columnar = False
+        else:
+            columnar = None
+
+        plan = self.plan(params, profile=profile, columnar=columnar)
+        if profile is None:
+            return plan.execute(
+                exception_handler=exception_handler, limit=limit
+            )
+
+        with profile.timer('execute'):
+            return plan.execute(
+                exception_handler=exception_handler, limit=limit
+            )
+
+    def iter_execute(self, params,
+                     exception_handler=default_exception_handler, limit=None):
+        """ return a generator of the output rows.  See
+        QueryPlan.iter_execute """
+        # streaming works one Result at a time, so it never uses the
+        # columnar ResultSet
+        plan = self._append_nodes(QueryPlan(
+            self._result_set(params, columnar=False),
+            list(self.output_paths), memo_stats=self.memo_stats,
+            rule_stats=self.rule_stats, tracer=self.tracer,
+        ), params)
+
+        return plan.iter_execute(
+            exception_handler=exception_handler, limit=limit
+        )
+
+    def aexecute(self, params, exception_handler=default_exception_handler,
+                 limit=None, concurrency=None):
+        """ return a coroutine which executes the query """
+        return self.async_plan(params, concurrency=concurrency).aexecute(
+            exception_handler=exception_handler, limit=limit
+        )
+
+    def explain(self):
+        return '\n'.join(node.explain() for node in self.nodes)
+
+
+class PlanCache(object):
+    """ a thread safe LRU cache of CompiledQuery objects """
+
+    def __init__(self, max_size=128):
+        self.max_size = max_size
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        with self._lock:
+            try:
+                compiled_query = self._entries.pop(key)
+            except KeyError:
+                self.misses += 1
+                return None
+
+            # reinsert to mark as most recently used
+            self._entries[key] = compiled_query
+            self.hits += 1
+            return compiled_query
+
+    def put(self, key, compiled_query):
+        if not self.max_size:
+            return
+
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = compiled_query
+
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        """ drop all cached plans.  Called whenever the rules or schema of
+        the Graphcore change """
+        with self._lock:
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+
+    def stats(self):
+        return {
+            'size': len(self),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations,
+        }
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __repr__(self):
+        return (
+            '<PlanCache size:{size}/{max_size}; hits:{hits}; '
+            'misses:{misses}; evictions:{evictions}; '
+            'invalidations:{invalidations}>'
+        ).format(**self.stats())
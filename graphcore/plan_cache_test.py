@@ -0,0 +1,65 @@
+from .call_graph import Node
+from .relation import Relation
+from .parameter import Parameter
+from .plan_cache import PlanCache, bind_node
+from .sql_query import SQLQuery
+
+
+def test_plan_cache_hit_miss():
+    plan_cache = PlanCache(2)
+
+    assert plan_cache.get('a') is None
+    plan_cache.put('a', 1)
+    assert plan_cache.get('a') == 1
+
+    assert plan_cache.hits == 1
+    assert plan_cache.misses == 1
+
+
+def test_plan_cache_lru_eviction():
+    plan_cache = PlanCache(2)
+
+    plan_cache.put('a', 1)
+    plan_cache.put('b', 2)
+    # touch a so that b is the least recently used
+    plan_cache.get('a')
+    plan_cache.put('c', 3)
+
+    assert 'a' in plan_cache
+    assert 'b' not in plan_cache
+    assert 'c' in plan_cache
+    assert plan_cache.evictions == 1
+
+
+def test_plan_cache_disabled():
+    plan_cache = PlanCache(0)
+    plan_cache.put('a', 1)
+
+    assert len(plan_cache) == 0
+
+
+def test_plan_cache_clear():
+    plan_cache = PlanCache()
+    plan_cache.put('a', 1)
+    plan_cache.clear()
+
+    assert len(plan_cache) == 0
+    assert plan_cache.invalidations == 1
+    assert 'invalidations:1' in repr(plan_cache)
+
+
+def test_bind_node():
+    sql_query = SQLQuery(['users'], 'users.id', {'users.age>': Parameter(0)})
+    node = Node(
+        None, [], ['user.id'], sql_query, 'many',
+        relations=[Relation('<', Parameter(1))]
+    )
+
+    bound = bind_node(node, {0: 10, 1: 20})
+
+    assert bound.function.where == {'users.age>': 10}
+    assert bound.relations == (Relation('<', 20),)
+
+    # the original node must not change
+    assert sql_query.where == {'users.age>': Parameter(0)}
+    assert node.relations == (Relation('<', Parameter(1)),)
@@ -0,0 +1,75 @@
+from .parameter import parameterize_query, parameter_names
+from .result_set import default_exception_handler
+
+
+class PreparedQuery(object):
+    """ a query which has been searched, optimized and planned once and can
+    then be executed many times with different parameter bindings:
+
+        prepared = gc.prepare({
+            'user.id': Parameter('user_id'),
+            'user.name?': None,
+        })
+        prepared.execute(user_id=5)
+
+    The PreparedQuery is not updated if rules are added to the Graphcore
+    after it was prepared.
+    """
+
+    def __init__(self, graphcore, query_template, limit=None,
+                 exception_handler=default_exception_handler):
+        # constant values in the template are lifted out too, so that the
+        # compiled query is the same as the one Graphcore.query would use
+        template, self.constants = parameterize_query(query_template)
+
+        self.parameter_names = frozenset(parameter_names(query_template))
+        self.limit = limit
+        self.exception_handler = exception_handler
+        self.concurrency = graphcore.concurrency
+
+        self.compiled_query = graphcore.compile(template)
+
+    def _params(self, bindings):
+        unknown = set(bindings) - self.parameter_names
+        if unknown:
+            raise TypeError('unknown parameters: {}'.format(
+                ', '.join(sorted(unknown))
+            ))
+
+        params = dict(self.constants)
+        params.update(bindings)
+        return params
+
+    def execute(self, **bindings):
+        return self.compiled_query.execute(
+            self._params(bindings), limit=self.limit,
+            exception_handler=self.exception_handler
+        )
+
+    __call__ = execute
+
+    def iter_execute(self, **bindings):
+        """ return a generator of the output rows.  See
+        Graphcore.iter_query """
+        return self.compiled_query.iter_execute(
+            self._params(bindings), limit=self.limit,
+            exception_handler=self.exception_handler
+        )
+
+    def aexecute(self, **bindings):
+        """ return a coroutine which executes the query on the running
+        asyncio event loop """
+        return self.compiled_query.aexecute(
+            self._params(bindings), limit=self.limit,
+            exception_handler=self.exception_handler,
+            concurrency=self.concurrency,
+        )
+
+    def explain(self):
+        return self.compiled_query.explain()
+
+    def __repr__(self):
+        return '<PreparedQuery ({parameters})\n{explain}>'.format(
+            parameters=', '.join(sorted(self.parameter_names)),
+            explain=self.explain(),
+        )
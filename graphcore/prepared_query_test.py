@@ -0,0 +1,91 @@
+import pytest
+
+from .graphcore import Graphcore
+from .parameter import Parameter, MissingParameter
+
+
+@pytest.fixture
+def gc():
+    gc = Graphcore()
+
+    gc.register_rule(['user.id'], 'user.name', function=lambda id: str(id))
+    gc.property_type('user', 'books', 'book')
+    gc.register_rule(
+        ['user.id'], 'user.books.id', function=lambda id: [1, 2, 3],
+        cardinality='many'
+    )
+
+    return gc
+
+
+def test_prepare(gc):
+    prepared = gc.prepare({
+        'user.id': Parameter('user_id'),
+        'user.name?': None,
+    })
+
+    assert prepared.execute(user_id=5) == [{'user.name': '5'}]
+    assert prepared(user_id=6) == [{'user.name': '6'}]
+
+
+def test_prepare_relation_parameter(gc):
+    prepared = gc.prepare({
+        'user.id': 1,
+        'user.books.id?': None,
+        'user.books.id>': Parameter('min_id'),
+    })
+
+    assert prepared.execute(min_id=1) == [
+        {'user.books.id': 2}, {'user.books.id': 3},
+    ]
+    assert prepared.execute(min_id=2) == [{'user.books.id': 3}]
+
+
+def test_prepare_limit(gc):
+    prepared = gc.prepare({
+        'user.id': Parameter('user_id'),
+        'user.books.id?': None,
+    }, limit=2)
+
+    assert len(prepared.execute(user_id=1)) == 2
+
+
+def test_prepare_missing_parameter(gc):
+    prepared = gc.prepare({
+        'user.id': Parameter('user_id'),
+        'user.name?': None,
+    })
+
+    with pytest.raises(MissingParameter):
+        prepared.execute()
+
+
+def test_prepare_unknown_parameter(gc):
+    prepared = gc.prepare({
+        'user.id': Parameter('user_id'),
+        'user.name?': None,
+    })
+
+    with pytest.raises(TypeError):
+        prepared.execute(user_id=1, other=2)
+
+
+def test_prepare_repr(gc):
+    prepared = gc.prepare({
+        'user.id': Parameter('user_id'),
+        'user.name?': None,
+    })
+
+    assert 'user_id' in repr(prepared)
+    assert 'user.name' in repr(prepared)
+
+
+def test_prepare_iter_execute(gc):
+    prepared = gc.prepare({
+        'user.id': Parameter('user_id'),
+        'user.books.id?': None,
+    })
+
+    assert list(prepared.iter_execute(user_id=5)) == [
+        {'user.books.id': i} for i in [1, 2, 3]
+    ]
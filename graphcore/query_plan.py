@@ -1,54 +1,767 @@
 """
-The query plan is a sequential list of rules to apply.  Other QueryPlans may in
-the future also handle parallel execution.
+The query plan is a sequential list of rules to apply.  Given an executor,
+the rule calls of nodes which don't depend on each other are made in
+parallel, but the nodes are still applied to the ResultSet in sequence.
 """
 
-from .result_set import RuleApplicationException
-from .result_set import default_exception_handler
+import time
+from collections import defaultdict
+from functools import partial
+from itertools import islice
+
+from .call_table import CallTable, CallSequence
+from .path import Path
+from .rule_stats import stats_key
+from .tracer import span
+from .sql_pool import connection_scope
+from .rule import Cardinality
+from .result_set import RuleApplicationException, ResultSet, NoResult
+from .result_set import default_exception_handler, call_rule
+from .result_set import simplify_scope, computable
+
+
+def _listed(function):
+    def listed(**kwargs):
+        return list(function(**kwargs))
+    return listed
+
+
+def is_batch(function):
+    """ batch functions are called once for all of the rows of a node.  See
+    rule.BatchFunction """
+    return getattr(function, 'batch', False)
+
+
+def is_pure(node):
+    """ the outcomes of the calls of a pure node are memoized for the rest
+    of the query.  A node is pure if it was built from a pure Rule or if
+    its function has a true pure attribute """
+    return node.pure or getattr(node.function, 'pure', False)
 
 
 class QueryPlan(object):
-    """ Execute a sequential list of nodes. """
+    """ Execute a sequential list of nodes.
+
+    If executor (a concurrent.futures.Executor) is provided, then before a
+    node is applied, it and every later node whose inputs are already
+    available are prefetched concurrently on the executor: the rule is
+    called for each distinct set of inputs in the current ResultSet and the
+    outcomes are recorded in a CallTable.  The nodes are then applied in plan
+    order, replaying the recorded outcomes, so the ResultSet is only ever
+    modified by one thread and the results are identical to the sequential
+    plan.
+
+    Prefetched rules may be called for rows which an earlier node in the
+    plan ends up filtering out, so rules run this way should be free of side
+    effects and thread safe.
 
-    def __init__(self, result_set, output_paths):
+    Calls to pure rules are memoized for the duration of the plan, keyed by
+    the rule function and its kwargs.  If memo_stats (a MemoStats) is
+    provided, the number of calls made and saved is added to it.
+
+    If rule_stats (a RuleStats) is provided, the latency and fan-out of the
+    rule calls forward makes and the pass rate of the relations it applies
+    are added to it.  The fan-out of rules whose values are consumed lazily
+    by iter_execute is not recorded.
+
+    If profile (a QueryProfile) is provided, forward records the time, rule
+    calls, rows, exceptions and cache hits of each node in it.
+
+    If rule_executor (an executors.Executor) is provided, or a node's rule
+    was registered with an executor, the rule is mapped over the inputs of
+    the node's rows (the distinct ones, if it is pure) on the executor and
+    the outcomes are recorded in a CallTable, like a prefetch, before the
+    node is applied.  Rows pipelined by iter_execute call the rules inline.
+
+    If tracer (a Tracer) is provided, forward is traced with an execute span
+    with a child span for each node, and a sample of the rule calls get a
+    span of their own.  Pipelined rows get a node span each time a node is
+    applied to one of them.
+    """
+
+    def __init__(self, result_set, output_paths, executor=None,
+                 memo_stats=None, rule_stats=None, profile=None,
+                 tracer=None, rule_executor=None):
         """
         query is necessary becuase the QueryPlan execution uses it to seed the
         state of the ResultSet object.
         """
         self.result_set = result_set
         self.output_paths = output_paths
+        self.executor = executor
+        self.memo_stats = memo_stats
+        self.rule_stats = rule_stats
+        self.profile = profile
+        self.tracer = tracer
+        self.rule_executor = rule_executor
+        # the execute span, the parent of rule call spans made on executor
+        # threads
+        self._span = None
 
         self.nodes = []
+        # {id(function): CallTable} of the pure rules called so far
+        self.memos = {}
 
     def append(self, node):
         self.nodes.append(node)
 
+    def _traced(self, node, function, listed=False):
+        """ wrap function so that a sample of its calls are traced.  If
+        listed, the values of many cardinality rules are consumed inside the
+        span """
+        tracer = self.tracer
+        if tracer is None:
+            return function
+
+        key = stats_key(node)
+        many = listed and node.cardinality == Cardinality.many
+
+        def traced(**kwargs):
+            if not tracer.sampled():
+                return function(**kwargs)
+
+            rule_span = tracer.start_span(
+                'rule', {'rule': key}, tracer.current() or self._span
+            )
+            error = None
+            try:
+                ret = function(**kwargs)
+                if many:
+                    ret = list(ret)
+                return ret
+            except Exception as e:
+                error = e
+                raise
+            finally:
+                tracer.end_span(rule_span, error)
+
+        return traced
+
+    def _timed(self, node, function, listed=True):
+        """ wrap function so that the latency and fan-out of its calls are
+        added to rule_stats and profile, and traced.  If not listed, the
+        values of many cardinality rules are left to be consumed lazily and
+        their fan-out isn't recorded """
+        if self.rule_stats is None and self.profile is None:
+            return self._traced(node, function, listed=listed)
+
+        key = stats_key(node)
+        many = listed and node.cardinality == Cardinality.many and \
+            self.rule_stats is not None
+
+        def timed(**kwargs):
+            values = None
+            start = time.time()
+            try:
+                ret = function(**kwargs)
+                if many:
+                    ret = list(ret)
+                    values = len(ret)
+                return ret
+            finally:
+                seconds = time.time() - start
+                if self.rule_stats is not None:
+                    self.rule_stats.record_calls(key, 1, seconds, values)
+                if self.profile is not None:
+                    self.profile.node(node).record_call(seconds)
+
+        return self._traced(node, timed, listed=listed)
+
+    def _output_prefix(self, node):
+        """ the shaped path of the list node outputs to """
+        output = self.result_set.shape_path(node.outgoing_paths[0])
+        return tuple(str(part) for part in output[:-1])
+
+    def _filter(self, node, path, relation):
+        if self.profile is not None:
+            prefix = self._output_prefix(node)
+            rows = self.result_set.count(prefix)
+            self._counted_filter(node, path, relation)
+            self.profile.node(node).rows_filtered += (
+                rows - self.result_set.count(prefix)
+            )
+        else:
+            self._counted_filter(node, path, relation)
+
+    def _counted_filter(self, node, path, relation):
+        if self.rule_stats is None:
+            self.result_set.filter(path, relation)
+            return
+
+        # [rows checked, rows passed]
+        counts = [0, 0]
+
+        def counted(value):
+            passed = relation(value)
+            counts[0] += 1
+            if passed:
+                counts[1] += 1
+            return passed
+
+        self.result_set.filter(path, counted)
+        self.rule_stats.record_filter(stats_key(node), *counts)
+
+    def _apply_node(self, node, exception_handler, call=call_rule):
+        if call is call_rule and (
+            self.rule_stats is not None or self.profile is not None or
+            self.tracer is not None
+        ):
+            timed = self._timed(node, node.function)
+
+            def call(fn, kwargs):
+                return timed(**kwargs)
+
+        try:
+            self.result_set = self.result_set.apply_rule(
+                node.function,
+                self.result_set.shape_paths(node.incoming_paths),
+                self.result_set.shape_paths(node.outgoing_paths),
+                node.cardinality,
+                exception_handler=exception_handler,
+                call=call,
+            )
+        except RuleApplicationException as e:
+            e.query_plan = self
+            e.node = node
+            raise
+
+        for outgoing_path, relation in zip(
+            node.outgoing_paths, node.relations
+        ):
+            if relation:
+                self._filter(node, outgoing_path, relation)
+
+    def _available_at(self):
+        """ return {step: [index of each node whose inputs are all available
+        once the nodes before step have been applied]} """
+        setters = {}
+        available_at = defaultdict(list)
+        for i, node in enumerate(self.nodes):
+            step = max(
+                [setters[path] + 1 for path in node.incoming_paths
+                 if path in setters] + [0]
+            )
+            available_at[step].append(i)
+
+            for path in node.outgoing_paths:
+                setters[path] = i
+
+        return available_at
+
+    def _call_kwargs(self, node):
+        """ return the kwargs node.function would be called with for each row
+        of the current ResultSet.  Returns None if the inputs can't be
+        collected yet """
+        try:
+            scopes = list(self.result_set.scopes(
+                self.result_set.shape_paths(node.incoming_paths),
+                self.result_set.shape_paths(node.outgoing_paths),
+            ))
+        except (KeyError, ValueError):
+            return None
+
+        return [simplify_scope(scope) for scope in scopes if computable(scope)]
+
+    def _executor(self, node):
+        """ the Executor to map node.function with, or None to call it
+        inline """
+        if is_batch(node.function):
+            return None
+
+        executor = node.executor or self.rule_executor
+        if executor is None or executor.inline:
+            return None
+        return executor
+
+    def _record_call_time(self, node, calls, seconds):
+        """ add calls calls to node.function which took seconds in total to
+        rule_stats and profile """
+        if self.rule_stats is not None and calls:
+            self.rule_stats.record_calls(stats_key(node), calls, seconds)
+        if self.profile is not None:
+            node_profile = self.profile.node(node)
+            node_profile.calls += calls
+            node_profile.call_seconds += seconds
+
+    def _call_table(self, node):
+        """ call node.function for each set of inputs in the current
+        ResultSet.  Returns None if the inputs can't be collected yet.
+
+        Pure rules are called once for each distinct set of inputs which
+        the plan hasn't called them with yet, and the outcomes are memoized
+        like _memo_call does.  Other rules are called once for each row.
+        """
+        calls = self._call_kwargs(node)
+        if calls is None:
+            return None
+
+        if node.cardinality == Cardinality.many:
+            cast = list
+        else:
+            cast = None
+
+        if is_batch(node.function):
+            call_table = CallTable()
+            start = time.time()
+            call_table.record_batch(node.function, calls, cast)
+            self._record_call_time(
+                node, len(call_table), time.time() - start
+            )
+            return call_table
+
+        if is_pure(node):
+            call_table = self.memos.setdefault(id(node.function), CallTable())
+            unrecorded = call_table.unrecorded(calls)
+            call_table.replays += len(calls) - len(unrecorded)
+            calls = unrecorded
+        else:
+            call_table = CallSequence()
+
+        executor = self._executor(node)
+        if executor is not None:
+            start = time.time()
+            with span(self.tracer, 'map', rule=stats_key(node)):
+                call_table.record_mapped(
+                    node.function, calls, executor, cast,
+                    rule_id=node.rule_id,
+                )
+            self._record_call_time(node, len(calls), time.time() - start)
+            return call_table
+
+        if node.cardinality == Cardinality.many:
+            # the recorded value may be replayed for more than one row, so
+            # it can't be a one shot iterator
+            function = _listed(node.function)
+        else:
+            function = node.function
+        function = self._timed(node, function)
+
+        for kwargs in calls:
+            call_table.record(function, kwargs)
+
+        return call_table
+
+    def _memo_call(self, node, timed=True):
+        """ return a call which memoizes the calls made to node.function """
+        memo = self.memos.setdefault(id(node.function), CallTable())
+
+        if node.cardinality == Cardinality.many:
+            function = _listed(node.function)
+        else:
+            function = node.function
+        if timed:
+            function = self._timed(node, function)
+        else:
+            function = self._traced(node, function)
+
+        def call(fn, kwargs):
+            return memo.call_memoized(function, kwargs)
+
+        return call
+
+    def memo_calls(self):
+        """ return (calls made, calls saved) by memoizing pure rules """
+        calls = sum(len(memo) for memo in self.memos.values())
+        calls_saved = sum(memo.replays for memo in self.memos.values())
+        return calls, calls_saved
+
+    def _prefetch(self, indexes):
+        """ build the CallTable of each node in indexes concurrently """
+        futures = [
+            (i, self.executor.submit(self._call_table, self.nodes[i]))
+            for i in indexes
+        ]
+
+        # wait for every future before returning so that no other thread is
+        # reading the ResultSet while it is modified
+        return {i: future.result() for i, future in futures}
+
+    def _limits(self, limit):
+        """ return [(shaped path of a list, limit)].
+
+        limit is either an int, the maximum number of top level results, or
+        {path: int} where path is the path of a nested list in the query,
+        such as 'user.books', or None for the top level list.
+        """
+        if not limit:
+            return []
+        if not isinstance(limit, dict):
+            return [((), limit)]
+
+        limits = []
+        for path, n in limit.items():
+            if path is None:
+                limits.append(((), n))
+                continue
+
+            # shape a path inside of the list to find the list's own path
+            shaped = self.result_set.shape_path(Path(path) + ('_',))[:-1]
+            if not shaped:
+                raise ValueError(
+                    '{} is not a nested list in the query'.format(path)
+                )
+            limits.append((tuple(str(part) for part in shaped), n))
+
+        return limits
+
+    def _limits_after(self, limit):
+        """ return {i: [(shaped path of a list, limit)]} of the limits which
+        can be applied as soon as node i has been.  -1 is before any node.
+
+        Rows are only ever added to or removed from a list by the nodes
+        which output to that list, so once the last of them has been
+        applied, truncating the list gives the same result as truncating it
+        at the end, and the nodes after it compute less.
+        """
+        limits_after = defaultdict(list)
+        for path, n in self._limits(limit):
+            last = -1
+            for i, node in enumerate(self.nodes):
+                if self._output_prefix(node) == path:
+                    last = i
+            limits_after[last].append((path, n))
+
+        return limits_after
+
+    def _apply_limits(self, limits):
+        for path, n in limits:
+            self.result_set.limit(n, path)
+
+    def _streamable(self):
+        """ True if forward can pipeline the rows through the nodes """
+        return (
+            self.executor is None and
+            self.profile is None and
+            isinstance(self.result_set, ResultSet) and
+            not any(
+                is_batch(node.function) or self._executor(node) is not None
+                for node in self.nodes
+            )
+        )
+
     def forward(self, exception_handler, limit=None):
-        for node in self.nodes:
+        # the SQLQuerys of the plan share one connection per pool
+        with span(self.tracer, 'execute') as execute_span, \
+                connection_scope():
+            self._span = execute_span
+            self._forward(exception_handler, limit)
+
+    def _forward(self, exception_handler, limit):
+        limits_after = self._limits_after(limit)
+        if any(path == () for path, _ in self._limits(limit)) and \
+                self._streamable():
+            # with a top level limit, pipelining the rows stops calling the
+            # rules as soon as there are enough of them
+            self.result_set = ResultSet(
+                list(self._stream(exception_handler, limits_after)),
+                self.result_set.query_shape, mapper=self.result_set.mapper
+            )
+            self._add_memo_stats()
+            return
+
+        self._apply_limits(limits_after[-1])
+
+        if self.executor is not None:
+            available_at = self._available_at()
+
+        # indexes of nodes whose inputs are available but which haven't been
+        # prefetched yet
+        pending = set()
+        call_tables = {}
+
+        for i, node in enumerate(self.nodes):
+            if self.executor is not None:
+                pending.update(available_at[i])
+
+                # only prefetch if there is more than one node to run at once
+                if i not in call_tables and len(pending) > 1:
+                    with span(self.tracer, 'prefetch', nodes=len(pending)):
+                        call_tables.update(self._prefetch(sorted(pending)))
+                    pending.clear()
+                pending.discard(i)
+
+            call_table = call_tables.pop(i, None)
+            with span(self.tracer, 'node', rule=stats_key(node)):
+                if self.profile is None:
+                    self._apply(node, exception_handler, call_table)
+                else:
+                    self._apply_profiled(node, exception_handler, call_table)
+
+            self._apply_limits(limits_after[i])
+
+        self._add_memo_stats()
+
+    def _apply(self, node, exception_handler, call_table):
+        """ apply node, replaying call_table if there is one """
+        if call_table is None and (
+            is_batch(node.function) or self._executor(node) is not None
+        ):
+            call_table = self._call_table(node)
+
+        if call_table is not None:
+            self._apply_node(node, exception_handler, call_table.call)
+        elif is_pure(node):
+            self._apply_node(node, exception_handler, self._memo_call(node))
+        else:
+            self._apply_node(node, exception_handler)
+
+    def _cache_hits(self, node):
+        """ the number of calls to node.function answered by memoization or
+        a TTLCache so far """
+        hits = 0
+        memo = self.memos.get(id(node.function))
+        if memo is not None:
+            hits += memo.replays
+
+        cache = getattr(node.function, 'cache', None)
+        if cache is not None and hasattr(cache, 'hits'):
+            hits += cache.hits + cache.negative_hits
+        return hits
+
+    def _apply_profiled(self, node, exception_handler, call_table):
+        node_profile = self.profile.node(node)
+        prefix = self._output_prefix(node)
+        cache_hits = self._cache_hits(node)
+
+        node_profile.rows_in += self.result_set.count(prefix)
+        start = time.time()
+        self._apply(
+            node, node_profile.counting(exception_handler), call_table
+        )
+        node_profile.seconds += time.time() - start
+        node_profile.rows_out += self.result_set.count(prefix)
+        node_profile.cache_hits += self._cache_hits(node) - cache_hits
+
+    def _add_memo_stats(self):
+        if self.memo_stats is not None and self.memos:
+            self.memo_stats.add(*self.memo_calls())
+
+    def outputs(self):
+        return self.result_set.extract_json(self.output_paths)
+
+    def _row_result_set(self, row):
+        return ResultSet(
+            [row], self.result_set.query_shape, mapper=self.result_set.mapper
+        )
+
+    def _fan_out(self, row, node, inputs, outputs, exception_handler, call,
+                 pages=None):
+        """ apply a many cardinality node whose outputs are at the top level
+        of the ResultSet to row.  The rule is called right away, but the
+        returned iterator lazily yields one new row for each value the rule
+        returns.
+
+        pages: if given, it is called instead of the rule to fetch its values
+            a page at a time.  See _pages
+        """
+        scope = {}
+        for input in inputs:
+            scope[str(input[0])] = row[input[0]]
+
+        if not computable(scope):
+            return self._row_result_set(row).apply_rule(
+                node.function, inputs, outputs, node.cardinality,
+                exception_handler=exception_handler, call=call
+            )
+
+        try:
+            if pages is not None:
+                ret = pages(**simplify_scope(scope))
+            else:
+                ret = call(node.function, simplify_scope(scope))
+        except Exception as e:
             try:
-                self.result_set = self.result_set.apply_rule(
-                    node.function,
-                    self.result_set.shape_paths(node.incoming_paths),
-                    self.result_set.shape_paths(node.outgoing_paths),
-                    node.cardinality,
-                    exception_handler=exception_handler
+                ret = exception_handler(
+                    row, e, node.function, outputs, node.cardinality, scope
                 )
+            except NoResult:
+                return []
+
+        return self._fan_out_rows(row, outputs, ret)
+
+    def _fan_out_rows(self, row, outputs, ret):
+        for values in ret:
+            if len(outputs) == 1:
+                values = (values,)
+
+            new_row = row.copy()
+            for output, value in zip(outputs, values):
+                new_row[output[0]] = value
+            yield new_row
+
+    def _streamed_relation(self, node, relation):
+        """ return relation, counting the rows it checks in rule_stats.
+        Streamed rows are checked one at a time, so each is recorded as it
+        is checked """
+        if self.rule_stats is None:
+            return relation
+
+        key = stats_key(node)
+
+        def counted(value):
+            passed = relation(value)
+            self.rule_stats.record_filter(key, 1, 1 if passed else 0)
+            return passed
+
+        return counted
+
+    def _pages(self, node, page_size, limit=None):
+        """ return a function which fetches the values of node's rule
+        page_size at a time, or None if it isn't pageable (see
+        SQLQuery.iter_pages).
+
+        limit: the most values any row needs, which is passed on to the
+            rule's query if it can be limited (see SQLQuery.limited)
+        """
+        function = node.function
+        if not page_size or not getattr(function, 'pageable', False):
+            return None
+
+        if limit is not None and hasattr(function, 'limited'):
+            function = function.limited(limit)
+
+        return self._timed(
+            node, partial(function.iter_pages, page_size), listed=False
+        )
+
+    def _stream_node(self, rows, node, exception_handler, page_size=None,
+                     limit=None):
+        """ apply node to each of the top level rows in rows, yielding the
+        resulting rows as soon as they are computed.  See _pages for
+        page_size and limit """
+        inputs = self.result_set.shape_paths(node.incoming_paths)
+        outputs = self.result_set.shape_paths(node.outgoing_paths)
+
+        lazy = (
+            node.cardinality == Cardinality.many and len(outputs[0]) == 1
+        )
+        if lazy:
+            pages = self._pages(node, page_size, limit)
+        else:
+            pages = None
+
+        if is_pure(node):
+            call = self._memo_call(node)
+        elif self.tracer is not None or self.rule_stats is not None:
+            # the values of lazy rules are consumed by the nodes after this
+            # one, so only the call itself is timed
+            timed = self._timed(node, node.function, listed=not lazy)
+
+            def call(fn, kwargs):
+                return timed(**kwargs)
+        else:
+            call = call_rule
+
+        relations = [
+            (path, self._streamed_relation(node, relation))
+            for path, relation in zip(node.outgoing_paths, node.relations)
+            if relation
+        ]
+        key = stats_key(node)
+
+        for row in rows:
+            try:
+                # the span covers applying the node to this row, but not
+                # the nodes before it producing the row or the lazy values
+                # being consumed by the nodes after it
+                with span(self.tracer, 'node', rule=key):
+                    if lazy:
+                        new_rows = self._fan_out(
+                            row, node, inputs, outputs, exception_handler,
+                            call, pages
+                        )
+                    else:
+                        new_rows = self._row_result_set(row).apply_rule(
+                            node.function, inputs, outputs,
+                            node.cardinality,
+                            exception_handler=exception_handler, call=call
+                        )
+
+                for new_row in new_rows:
+                    if relations:
+                        result_set = self._row_result_set(new_row)
+                        for path, relation in relations:
+                            result_set.filter(path, relation)
+                        if not len(result_set):
+                            continue
+
+                    yield new_row
             except RuleApplicationException as e:
                 e.query_plan = self
                 e.node = node
                 raise
 
-            for outgoing_path, relation in zip(
-                node.outgoing_paths, node.relations
-            ):
-                if relation:
-                    self.result_set.filter(outgoing_path, relation)
+    def iter_execute(self, exception_handler=default_exception_handler,
+                     limit=None):
+        """ like execute, but each top level row is pipelined through all of
+        the nodes and its output is yielded as soon as it is complete.
 
-            if limit:
-                self.result_set.limit(limit)
+        Many cardinality rules which return generators at the top level are
+        consumed lazily.  The calls to batch rules are made one row at a
+        time, and the executor is not used.
 
-    def outputs(self):
-        return self.result_set.extract_json(self.output_paths)
+        See Graphcore.query for limit.
+        """
+        rows = self._stream(exception_handler, self._limits_after(limit))
+        for row in rows:
+            yield self._row_result_set(row).extract_json(
+                self.output_paths
+            )[0]
+
+        self._add_memo_stats()
+
+    def _limit_rows(self, rows, limits):
+        """ apply limits to each of the top level rows in rows """
+        for row in rows:
+            result_set = self._row_result_set(row)
+            for path, n in limits:
+                result_set.limit(n, path)
+            yield row
+
+    def _stream(self, exception_handler, limits_after):
+        """ return a generator of the top level rows after each of them has
+        been pipelined through all of the nodes """
+        top_limit = None
+        for i, limits in limits_after.items():
+            for path, n in limits:
+                if path == ():
+                    top_limit = (i, n)
+
+        def limited(rows, i):
+            limits = [
+                (path, n) for path, n in limits_after.get(i, ()) if path
+            ]
+            if limits:
+                rows = self._limit_rows(rows, limits)
+            if top_limit is not None and top_limit[0] == i:
+                # the nodes before this one stop as soon as there are
+                # enough rows
+                rows = islice(rows, top_limit[1])
+            return rows
+
+        rows = limited(iter(self.result_set), -1)
+        for i, node in enumerate(self.nodes):
+            # until the top level limit is applied, rules which can fetch
+            # their values a page at a time start with a page of that size
+            if top_limit is not None and i <= top_limit[0]:
+                page_size = top_limit[1]
+            else:
+                page_size = None
+
+            # the rows of the last node before the top level limit are only
+            # dropped by its own relations, so without any, no call needs to
+            # return more rows than the limit
+            if top_limit is not None and i == top_limit[0] and \
+                    not any(node.relations):
+                limit = top_limit[1]
+            else:
+                limit = None
+
+            rows = limited(self._stream_node(
+                rows, node, exception_handler, page_size, limit
+            ), i)
+
+        return rows
 
     def execute(self, exception_handler=default_exception_handler, limit=None):
         self.forward(exception_handler, limit=limit)
@@ -1,7 +1,9 @@
+import threading
+
 from .relation import Relation
 from .query_plan import QueryPlan
 from .call_graph import Node
-from .result_set import ResultSet
+from .result_set import ResultSet, NoResult
 
 
 def multiple_outputs(in1):
@@ -57,3 +59,76 @@ def test_query_plan_multi_relation():
     ret = query_plan.execute()
 
     assert ret == [{'a.out1': 2, 'a.out2': 2}]
+
+
+def test_query_plan_executor_runs_independent_nodes_concurrently():
+    from concurrent.futures import ThreadPoolExecutor
+
+    y_started = threading.Event()
+    z_started = threading.Event()
+
+    def y(x):
+        y_started.set()
+        # if the nodes were run one after another, this would time out
+        return z_started.wait(5)
+
+    def z(x):
+        z_started.set()
+        return y_started.wait(5)
+
+    with ThreadPoolExecutor(2) as executor:
+        query_plan = QueryPlan(
+            ResultSet({'a.x': 1}, {}), ['a.y', 'a.z'], executor=executor
+        )
+        query_plan.append(Node(None, ['a.x'], ['a.y'], y, 'one'))
+        query_plan.append(Node(None, ['a.x'], ['a.z'], z, 'one'))
+
+        ret = query_plan.execute()
+
+    assert ret == [{'a.y': True, 'a.z': True}]
+
+
+def test_query_plan_executor_same_results_as_sequential():
+    from concurrent.futures import ThreadPoolExecutor
+
+    def no_result_for_2(x):
+        if x == 2:
+            raise NoResult()
+        return x * 10
+
+    def build(executor):
+        query_plan = QueryPlan(
+            ResultSet({}, {}), ['a.x', 'a.y', 'a.z'], executor=executor
+        )
+        query_plan.append(Node(None, [], ['a.x'], lambda: [1, 2, 3], 'many'))
+        query_plan.append(Node(
+            None, ['a.x'], ['a.y'], lambda x: x, 'one',
+            relations=[Relation('>', 1)]
+        ))
+        query_plan.append(Node(None, ['a.x'], ['a.z'], no_result_for_2, 'one'))
+        query_plan.append(Node(
+            None, ['a.x'], ['a.w'], lambda x: range(x), 'many'
+        ))
+        return query_plan
+
+    with ThreadPoolExecutor(4) as executor:
+        assert build(executor).execute() == build(None).execute()
+
+
+def test_query_plan_memoizes_pure_many_rules():
+    calls = []
+
+    def ys(x):
+        calls.append(x)
+        return iter([x, x + 1])
+    ys.pure = True
+
+    query_plan = QueryPlan(ResultSet({}, {}), ['a.y'])
+    query_plan.append(Node(None, [], ['a.x'], lambda: [1, 1, 2], 'many'))
+    query_plan.append(Node(None, ['a.x'], ['a.y'], ys, 'many'))
+
+    ret = query_plan.execute()
+
+    assert [r['a.y'] for r in ret] == [1, 2, 1, 2, 2, 3]
+    assert calls == [1, 2]
+    assert query_plan.memo_calls() == (2, 1)
@@ -3,148 +3,301 @@ This QueryPlanner will be very nieve.  Its role is to convert a CallGraph into
 a QueryPlan
 """
 
+import heapq
+
+from .path import Path
 from .query_plan import QueryPlan
 from .result_set import ResultSet, Result
 
 
-class CallGraphIterator(object):
-    # TODO: this iterator could only check nodes for grounded ness if
-    # one of its incoming_nodes changed groundedness
+class NodeScheduler(object):
+    """ Kahn style topological scheduler over the nodes of a CallGraph.
+
+    Each node has a counter of the incoming nodes which haven't been marked
+    done yet.  A node is ready once that counter reaches 0.  Ready nodes
+    with relations are handed out before ready nodes without relations so
+    that the ResultSet can be filtered before running unnecessary
+    computation.
+
+    Ready nodes without relations are handed out in order of how close they
+    bring the plan to a node with relations: the number of nodes on the
+    shortest path from the node to the nearest node with relations which
+    depends on it, counting the node but not the node with relations.
+    Nodes which no node with relations depends on come last.
+
+    If rule_stats (a RuleStats) is given, each node counts as its
+    estimated cost instead of 1, and ready nodes with relations are handed
+    out cheapest and most selective first (see RuleStats.rank).  Otherwise
+    ties are broken by the order of the nodes in the CallGraph.
+
+    The priority of each node is computed once, when the scheduler is
+    built, so scheduling is O(n log n) in the number of nodes.
+
+    Sequential use:
+
+        while scheduler:
+            node = scheduler.pop()
+            ...
+            scheduler.done(node)
+
+    A parallel executor may pop several ready nodes before marking any of
+    them done.
+    """
 
-    def __init__(self, call_graph):
+    def __init__(self, call_graph, rule_stats=None):
         self._call_graph = call_graph
+        self._rule_stats = rule_stats
 
-        # contains the python object id of nodes which have been grounded
-        self._grounded = set()
+        # {id(node): number of incoming nodes which aren't done}
+        self._in_degree = {}
+        # {id(node): [nodes which depend on node]}
+        self._dependents = {}
 
-    def _is_grounded(self, node):
-        """ Retursn true if node is in _grounded or if all incoming nodes
-        are """
+        # heaps of (priority, position in call_graph.nodes, node)
+        self._ready_with_relations = []
+        self._ready_without_relations = []
 
-        if id(node) in self._grounded:
-            return True
+        self._remaining = len(call_graph.nodes)
+        self._done = set()
 
-        nodes = node.incoming_nodes()
-        if len(nodes) == 0:
-            return True
+        # {id(node): position of node in call_graph.nodes}
+        self._positions = {}
+        for position, node in enumerate(call_graph.nodes):
+            self._dependents[id(node)] = []
+            self._positions[id(node)] = position
+
+        roots = []
+        for node in call_graph.nodes:
+            incoming_nodes = {}
+            for incoming_node in node.incoming_nodes():
+                incoming_nodes[id(incoming_node)] = incoming_node
+
+            self._in_degree[id(node)] = len(incoming_nodes)
+            for incoming_node in incoming_nodes.values():
+                self._dependents[id(incoming_node)].append(node)
+
+            if not incoming_nodes:
+                roots.append(node)
+
+        # {id(node): cost} snapshot when the scheduler is built, so rule_stats
+        # is only read once per node
+        if rule_stats is None:
+            self._costs = None
         else:
-            return all(id(n) in self._grounded for n in nodes)
-
-    def _ground(self, node):
-        """ Add node to the _grounded set """
-        self._grounded.add(id(node))
-
-    def _grounded_nodes(self, nodes):
-        nodes_with_no_relations = []
-        for node in list(nodes):
-            if self._is_grounded(node):
-                # put nodes with relations first so we can filter result set
-                # before running unnecessary computation
-                if node.relations != (None,):
-                    yield node
+            self._costs = rule_stats.costs(call_graph.nodes)
+
+        self._priorities = self._compute_priorities()
+
+        for node in roots:
+            self._push(node)
+
+    @staticmethod
+    def _has_relations(node):
+        return any(relation is not None for relation in node.relations)
+
+    def _topological_order(self):
+        """ the nodes, each after the nodes it depends on.  Nodes in a cycle
+        are left out """
+        in_degree = dict(self._in_degree)
+        order = [
+            node for node in self._call_graph.nodes
+            if in_degree[id(node)] == 0
+        ]
+        for node in order:
+            for dependent in self._dependents[id(node)]:
+                in_degree[id(dependent)] -= 1
+                if in_degree[id(dependent)] == 0:
+                    order.append(dependent)
+        return order
+
+    def _cost(self, node):
+        if self._costs is None:
+            return 1
+        return self._costs[id(node)]
+
+    def _compute_priorities(self):
+        """ return {id(node): priority} in one pass over the nodes in
+        reverse topological order.  The priority of a node with relations
+        is its rank (or 0 without rule_stats).  The priority of a node
+        without relations is its distance to the nearest node with
+        relations which depends on it """
+        priorities = {}
+        # {id(node): distance to the nearest node with relations which
+        # depends on node, or None}
+        distances = {}
+        for node in reversed(self._topological_order()):
+            distance = None
+            for dependent in self._dependents[id(node)]:
+                if self._has_relations(dependent):
+                    candidate = 0
                 else:
-                    nodes_with_no_relations.append(node)
+                    candidate = distances[id(dependent)]
 
-        # we could use above algorithm and yield all nodes we know are ground
-        # but have no relations, or we could just pick one to yield and then
-        # see if that happens to ground any new nodes with relations before
-        # running all of the others
-        # There should be a smarter way to chose this search so as to optimally
-        # hit nodes with relations as soon as possible
-        if len(nodes_with_no_relations) > 0:
-            yield nodes_with_no_relations[0]
+                if candidate is not None and (
+                    distance is None or candidate < distance
+                ):
+                    distance = candidate
 
-    def __iter__(self):
-        # local copy of set that we can modify
-        nodes = list(self._call_graph.nodes)
-
-        # if a node is grounded, add it to the plan
-        # iterate over a copy so that we can remove while we go
-        while len(nodes):
-            grounded_node = False
-            for node in self._grounded_nodes(nodes):
-                grounded_node = True
-                yield node
-                nodes.remove(node)
-                self._ground(node)
-
-            # if we get here it means we made it through the entire list of
-            # nodes and didnt find a grounded_node at all
-            if not grounded_node:
-                raise ValueError(
-                    ('CallGraphIterator never saw some nodes: {nodes}.  '
-                     'Did see these nodes: {grounded_nodes}').format(
-                        nodes=nodes,
-                        grounded_nodes=set(self._call_graph.nodes) - nodes,
+            if distance is not None:
+                distance += self._cost(node)
+            distances[id(node)] = distance
+
+            if self._has_relations(node):
+                if self._rule_stats is None:
+                    priorities[id(node)] = 0
+                else:
+                    priorities[id(node)] = self._rule_stats.rank(
+                        node, self._cost(node)
                     )
+            else:
+                priorities[id(node)] = (distance is None, distance or 0)
+
+        return priorities
+
+    def _push(self, node):
+        entry = (
+            self._priorities[id(node)], self._positions[id(node)], node
+        )
+        if self._has_relations(node):
+            heapq.heappush(self._ready_with_relations, entry)
+        else:
+            heapq.heappush(self._ready_without_relations, entry)
+
+    def ready(self):
+        """ return a list of the nodes which are ready to run, in the order
+        they would be popped """
+        return [
+            entry[-1] for entry in
+            sorted(self._ready_with_relations) +
+            sorted(self._ready_without_relations)
+        ]
+
+    def pop(self):
+        """ remove and return the next ready node """
+        if self._ready_with_relations:
+            return heapq.heappop(self._ready_with_relations)[-1]
+        elif self._ready_without_relations:
+            return heapq.heappop(self._ready_without_relations)[-1]
+        else:
+            raise ValueError(
+                ('CallGraphIterator never saw some nodes: {nodes}.  '
+                 'Did see these nodes: {done_nodes}').format(
+                    nodes=[
+                        node for node in self._call_graph.nodes
+                        if id(node) not in self._done
+                    ],
+                    done_nodes=[
+                        node for node in self._call_graph.nodes
+                        if id(node) in self._done
+                    ],
                 )
+            )
+
+    def done(self, node):
+        """ mark node as finished, possibly making its dependents ready """
+        self._done.add(id(node))
+        self._remaining -= 1
+
+        for dependent in self._dependents[id(node)]:
+            self._in_degree[id(dependent)] -= 1
+            if self._in_degree[id(dependent)] == 0:
+                self._push(dependent)
+
+    def __len__(self):
+        """ the number of nodes which haven't been marked done """
+        return self._remaining
+
+    def __bool__(self):
+        return self._remaining > 0
+
+    # python2 support
+    __nonzero__ = __bool__
+
+
+class CallGraphIterator(object):
+    """ iterate over the nodes of a CallGraph in an order in which every
+    node comes after the nodes it depends on """
+
+    def __init__(self, call_graph, rule_stats=None):
+        self._call_graph = call_graph
+        self._rule_stats = rule_stats
+
+    def __iter__(self):
+        scheduler = NodeScheduler(self._call_graph, self._rule_stats)
+        while scheduler:
+            node = scheduler.pop()
+            yield node
+            scheduler.done(node)
+
+
+def _extract_initial_bindings_from_query(query, query_shape, mapper):
+    """ convert a regular json query_shape into a nested structure of
+    ResultSets and Results.
+
+    WARNING: this wont work with list values like in a |= clause.  It
+    would be ideal if the query object could be useful since it already
+    knows these things.  Unfortunately it is the wrong shape though ...
+    """
+
+    if isinstance(query_shape, (list, tuple)):
+        assert len(query_shape) == 1
+
+        return ResultSet([
+            _extract_initial_bindings_from_query(q, qs, mapper)
+            for q, qs in zip([query], query_shape)
+        ], mapper=mapper)
+    elif isinstance(query_shape, dict):
+        initial_bindings = {}
+        for k, v in query_shape.items():
+            # if the query shape has a list on the right hand side, we
+            # assume it is a nested resultset.
+            if isinstance(v, list) and k[-2:] != '|=':
+                subquery = query.subquery(k)
+
+                v = _extract_initial_bindings_from_query(subquery, v, mapper)
+                initial_bindings[k] = v
+            else:
+                # otherwise, look in the query to see what value it has
+                if Path(k) in query.clause_map:
+                    initial_bindings[k] = v
+
+        return Result(initial_bindings, mapper=mapper)
+
+
+def initial_result_set(query, query_shape, mapper=map):
+    """ return the ResultSet which seeds the execution of a QueryPlan """
+    initial_bindings = _extract_initial_bindings_from_query(
+        query, query_shape, mapper
+    )
+
+    # attach query_shape to ResultSet
+    if isinstance(initial_bindings, ResultSet):
+        return ResultSet(initial_bindings, query_shape, mapper=mapper)
+    else:
+        return ResultSet([initial_bindings], query_shape, mapper=mapper)
 
 
 class QueryPlanner(object):
 
-    def __init__(self, call_graph, query, query_shape, mapper):
+    def __init__(self, call_graph, query, query_shape, mapper,
+                 rule_stats=None):
         """
         query is necessary becuase the QueryPlan execution uses it to seed the
         state of the ResultSet object.
+
+        rule_stats: a RuleStats used to order the nodes.  See NodeScheduler
         """
         self.mapper = mapper
         self.call_graph = call_graph
-
-        initial_bindings = self._extract_initial_bindings_from_query(
-            query, query_shape
-        )
-
-        # attach query_shape to ResultSet
-        if isinstance(initial_bindings, ResultSet):
-            result_set = ResultSet(
-                initial_bindings, query_shape, mapper=self.mapper
-            )
-        else:
-            result_set = ResultSet(
-                [initial_bindings], query_shape, mapper=self.mapper
-            )
+        self.rule_stats = rule_stats
 
         self.plan = QueryPlan(
-            result_set,
+            initial_result_set(query, query_shape, self.mapper),
             call_graph.output_paths(),
         )
 
-    def _extract_initial_bindings_from_query(self, query, query_shape):
-        """ convert a regular json query_shape into a nested structure of
-        ResultSets and Results.
-
-        WARNING: this wont work with list values like in a |= clause.  It
-        would be ideal if the query object could be useful since it already
-        knows these things.  Unfortunately it is the wrong shape though ...
-        """
-
-        if isinstance(query_shape, (list, tuple)):
-            assert len(query_shape) == 1
-
-            return ResultSet([
-                self._extract_initial_bindings_from_query(q, qs)
-                for q, qs in zip([query], query_shape)
-            ], mapper=self.mapper)
-        elif isinstance(query_shape, dict):
-            initial_bindings = {}
-            for k, v in query_shape.items():
-                # if the query shape has a list on the right hand side, we
-                # assume it is a nested resultset.
-                if isinstance(v, list) and k[-2:] != '|=':
-                    subquery = query.subquery(k)
-
-                    v = self._extract_initial_bindings_from_query(subquery, v)
-                    initial_bindings[k] = v
-                else:
-                    # otherwise, look in the query to see what value it has
-                    for clause in query:
-                        if clause.lhs == k:
-                            initial_bindings[k] = v
-
-            return Result(initial_bindings, mapper=self.mapper)
-
     def plan_query(self):
-        for node in CallGraphIterator(self.call_graph):
+        for node in CallGraphIterator(self.call_graph, self.rule_stats):
             self.plan.append(node)
 
         return self.plan
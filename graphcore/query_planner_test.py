@@ -0,0 +1,189 @@
+import pytest
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from .call_graph import CallGraph
+from .relation import Relation
+from .query_planner import NodeScheduler, CallGraphIterator
+from .rule_stats import RuleStats, stats_key
+
+
+def f():
+    pass
+
+
+def test_call_graph_iterator_dependencies_first():
+    call_graph = CallGraph()
+    c = call_graph.add_node(['a.y'], ['a.z'], f, 'one')
+    b = call_graph.add_node(['a.x'], ['a.y'], f, 'one')
+    a = call_graph.add_node([], ['a.x'], f, 'many')
+
+    assert list(CallGraphIterator(call_graph)) == [a, b, c]
+
+
+def test_call_graph_iterator_relations_first():
+    call_graph = CallGraph()
+    a = call_graph.add_node([], ['a.x'], f, 'many')
+    b = call_graph.add_node(['a.x'], ['a.y'], f, 'one')
+    c = call_graph.add_node(
+        ['a.x'], ['a.z'], f, 'one', relations=[Relation('>', 1)]
+    )
+
+    assert list(CallGraphIterator(call_graph)) == [a, c, b]
+
+
+def test_call_graph_iterator_nodes_leading_to_relations_first():
+    call_graph = CallGraph()
+    a = call_graph.add_node([], ['a.x'], f, 'many')
+    # b is ready before c, but nothing filters on what b computes
+    b = call_graph.add_node(['a.x'], ['a.y'], f, 'one')
+    c = call_graph.add_node(['a.x'], ['a.z'], f, 'one')
+    d = call_graph.add_node(
+        ['a.z'], ['a.w'], f, 'one', relations=[Relation('>', 1)]
+    )
+
+    assert list(CallGraphIterator(call_graph)) == [a, c, d, b]
+
+
+def test_call_graph_iterator_nearest_relation_first():
+    call_graph = CallGraph()
+    a = call_graph.add_node([], ['a.x'], f, 'many')
+    # two nodes need to run before the relation on a.c
+    b1 = call_graph.add_node(['a.x'], ['a.b1'], f, 'one')
+    b2 = call_graph.add_node(['a.b1'], ['a.b2'], f, 'one')
+    b3 = call_graph.add_node(
+        ['a.b2'], ['a.b3'], f, 'one', relations=[Relation('==', 1)]
+    )
+    # only one before the relation on a.c2
+    c1 = call_graph.add_node(['a.x'], ['a.c1'], f, 'one')
+    c2 = call_graph.add_node(
+        ['a.c1'], ['a.c2'], f, 'one', relations=[Relation('|=', [1])]
+    )
+
+    assert list(CallGraphIterator(call_graph)) == [a, c1, c2, b1, b2, b3]
+
+
+def test_call_graph_iterator_rule_stats():
+    call_graph = CallGraph()
+    a = call_graph.add_node([], ['a.x'], f, 'many')
+    b1 = call_graph.add_node(['a.x'], ['a.b1'], f, 'one')
+    b2 = call_graph.add_node(
+        ['a.b1'], ['a.b2'], f, 'one', relations=[Relation('==', 1)]
+    )
+    c1 = call_graph.add_node(['a.x'], ['a.c1'], f, 'one')
+    c2 = call_graph.add_node(
+        ['a.c1'], ['a.c2'], f, 'one', relations=[Relation('==', 1)]
+    )
+
+    # by count, both relations are as close.  by cost, b2 is closer
+    rule_stats = RuleStats()
+    rule_stats.record_calls(stats_key(b1), 1, 0.1)
+    rule_stats.record_calls(stats_key(c1), 1, 1.0)
+
+    assert list(CallGraphIterator(call_graph)) == [a, b1, b2, c1, c2]
+    assert list(CallGraphIterator(call_graph, rule_stats)) == [
+        a, b1, b2, c1, c2
+    ]
+
+    rule_stats.record_calls(stats_key(b1), 1, 10.0)
+    assert list(CallGraphIterator(call_graph, rule_stats)) == [
+        a, c1, c2, b1, b2
+    ]
+
+
+def test_node_scheduler_ready():
+    call_graph = CallGraph()
+    a = call_graph.add_node([], ['a.x'], f, 'many')
+    b = call_graph.add_node(['a.x'], ['a.y'], f, 'one')
+    c = call_graph.add_node(['a.x'], ['a.z'], f, 'one')
+    d = call_graph.add_node(['a.y', 'a.z'], ['a.w'], f, 'one')
+
+    scheduler = NodeScheduler(call_graph)
+    assert scheduler.ready() == [a]
+    assert len(scheduler) == 4
+
+    scheduler.done(scheduler.pop())
+    assert scheduler.ready() == [b, c]
+
+    # pop both independent nodes before either is done, as a parallel
+    # executor would
+    assert scheduler.pop() is b
+    assert scheduler.pop() is c
+    assert scheduler.ready() == []
+
+    scheduler.done(b)
+    assert scheduler.ready() == []
+    scheduler.done(c)
+    assert scheduler.ready() == [d]
+
+    scheduler.done(scheduler.pop())
+    assert not scheduler
+
+
+def test_node_scheduler_cycle():
+    call_graph = CallGraph()
+    call_graph.add_node(['a.x'], ['a.y'], f, 'one')
+    call_graph.add_node(['a.y'], ['a.x'], f, 'one')
+
+    with pytest.raises(ValueError):
+        list(CallGraphIterator(call_graph))
+
+
+def test_node_scheduler_computes_distances_once():
+    call_graph = CallGraph()
+    call_graph.add_node([], ['a.x'], f, 'many')
+    for i in range(50):
+        call_graph.add_node(['a.x'], ['a.p{}'.format(i)], f, 'one')
+        call_graph.add_node(
+            ['a.p{}'.format(i)], ['a.q{}'.format(i)], f, 'one',
+            relations=[Relation('>', 1)]
+        )
+
+    costs = []
+    _cost = NodeScheduler._cost
+
+    def cost(self, node):
+        costs.append(node)
+        return _cost(self, node)
+
+    with mock.patch.object(NodeScheduler, '_cost', cost):
+        nodes = list(CallGraphIterator(call_graph))
+
+    assert len(nodes) == 101
+    # one cost for each node a node with relations depends on, rather than
+    # one for each ready node each time a node is popped
+    assert len(costs) == 51
+
+
+def test_node_scheduler_reads_rule_stats_once():
+    call_graph = CallGraph()
+    call_graph.add_node([], ['a.x'], f, 'many')
+    for i in range(50):
+        call_graph.add_node(['a.x'], ['a.p{}'.format(i)], f, 'one')
+        call_graph.add_node(
+            ['a.p{}'.format(i)], ['a.q{}'.format(i)], f, 'one',
+            relations=[Relation('>', 1)]
+        )
+
+    class CountingRuleStats(RuleStats):
+        latencies = 0
+        pass_rates = 0
+
+        def latency(self, key):
+            self.latencies += 1
+            return super(CountingRuleStats, self).latency(key)
+
+        def pass_rate(self, key):
+            self.pass_rates += 1
+            return super(CountingRuleStats, self).pass_rate(key)
+
+    rule_stats = CountingRuleStats()
+    assert len(list(CallGraphIterator(call_graph, rule_stats))) == 101
+
+    # the latency of each node and the pass rate of each node with
+    # relations are read once
+    assert rule_stats.latencies == 101
+    assert rule_stats.pass_rates == 50
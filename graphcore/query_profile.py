@@ -0,0 +1,149 @@
+"""
+A QueryProfile records where the time of a single query went: searching,
+optimizing and planning it, and then, for each node of the plan, the wall
+time, rule calls, rows, exceptions and cache hits.  See
+Graphcore.explain_analyze.
+"""
+
+import time
+import threading
+
+
+def _ms(seconds):
+    return '{:.3f}ms'.format(seconds * 1000)
+
+
+class NodeProfile(object):
+    """ the counters of one node of a profiled QueryPlan """
+
+    def __init__(self, node):
+        self.node = node
+
+        # wall time spent applying the node to the ResultSet
+        self.seconds = 0.0
+        # the number of calls to the rule and the time spent in them.  Calls
+        # prefetched on an executor and calls answered by a TTLCache are
+        # counted here too
+        self.calls = 0
+        self.call_seconds = 0.0
+        # the number of rows at the node's output level before and after it
+        # was applied
+        self.rows_in = 0
+        self.rows_out = 0
+        # the number of rows removed by the relations on the node's outputs
+        self.rows_filtered = 0
+        # the number of exceptions passed to the exception handler
+        self.exceptions = 0
+        # the number of calls answered by memoization or a TTLCache
+        self.cache_hits = 0
+
+        # calls may be recorded by executor threads
+        self._lock = threading.Lock()
+
+    def record_call(self, seconds):
+        with self._lock:
+            self.calls += 1
+            self.call_seconds += seconds
+
+    def counting(self, exception_handler):
+        """ wrap exception_handler so the exceptions it is passed are
+        counted """
+        def counted(*args, **kwargs):
+            self.exceptions += 1
+            return exception_handler(*args, **kwargs)
+        return counted
+
+    def explain(self):
+        return (
+            '{node}\n'
+            '    time: {seconds}; calls: {calls} ({call_seconds}); '
+            'rows: {rows_in} -> {rows_out}; filtered: {rows_filtered}; '
+            'exceptions: {exceptions}; cache hits: {cache_hits}'
+        ).format(
+            node='\n'.join(
+                line.rstrip() for line in self.node.explain().splitlines()
+            ),
+            seconds=_ms(self.seconds),
+            calls=self.calls,
+            call_seconds=_ms(self.call_seconds),
+            rows_in=self.rows_in,
+            rows_out=self.rows_out,
+            rows_filtered=self.rows_filtered,
+            exceptions=self.exceptions,
+            cache_hits=self.cache_hits,
+        )
+
+    def __repr__(self):
+        return '<NodeProfile {}>'.format(self.explain())
+
+
+class QueryProfile(object):
+    """ the time spent in each phase of a query and a NodeProfile for each
+    node of its plan, in plan order """
+
+    def __init__(self):
+        self.search_seconds = 0.0
+        self.optimize_seconds = 0.0
+        self.plan_seconds = 0.0
+        self.execute_seconds = 0.0
+
+        self.nodes = []
+        # {id(node): NodeProfile}
+        self._nodes_by_id = {}
+
+        # the output of the query
+        self.result = None
+
+    def node(self, node):
+        """ return the NodeProfile of node, creating it if necessary """
+        node_profile = self._nodes_by_id.get(id(node))
+        if node_profile is None:
+            node_profile = self._nodes_by_id[id(node)] = NodeProfile(node)
+            self.nodes.append(node_profile)
+        return node_profile
+
+    def timer(self, phase):
+        """ return a context manager which adds the time spent in it to
+        phase_seconds """
+        return _Timer(self, '{}_seconds'.format(phase))
+
+    @property
+    def seconds(self):
+        return (
+            self.search_seconds + self.optimize_seconds + self.plan_seconds +
+            self.execute_seconds
+        )
+
+    def explain(self):
+        lines = [
+            (
+                'total: {}; search: {}; optimize: {}; plan: {}; execute: {}'
+            ).format(
+                _ms(self.seconds), _ms(self.search_seconds),
+                _ms(self.optimize_seconds), _ms(self.plan_seconds),
+                _ms(self.execute_seconds),
+            )
+        ]
+        lines.extend(node_profile.explain() for node_profile in self.nodes)
+        return '\n'.join(lines)
+
+    __str__ = explain
+
+    def __repr__(self):
+        return '<QueryProfile {}>'.format(self.explain())
+
+
+class _Timer(object):
+
+    def __init__(self, profile, attribute):
+        self.profile = profile
+        self.attribute = attribute
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *args):
+        setattr(self.profile, self.attribute, getattr(
+            self.profile, self.attribute
+        ) + time.time() - self.start)
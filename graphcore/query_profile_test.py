@@ -0,0 +1,88 @@
+from .graphcore import Graphcore
+from .query_profile import QueryProfile
+from .result_set import NoResult
+from .rule_cache import TTLCache
+
+
+def test_timer():
+    profile = QueryProfile()
+
+    with profile.timer('search'):
+        pass
+
+    assert profile.search_seconds > 0
+    assert profile.seconds == profile.search_seconds
+
+
+def graphcore():
+    gc = Graphcore()
+    gc.property_type('user', 'books', 'book')
+
+    gc.register_rule(
+        [], 'user.id', function=lambda: range(10), cardinality='many'
+    )
+
+    @gc.rule(['user.id'], 'user.age')
+    def age(id):
+        if id == 3:
+            raise NoResult()
+        return id * 5
+
+    gc.register_rule(
+        ['user.id'], 'user.books.id', function=lambda id: range(id % 3),
+        cardinality='many'
+    )
+    gc.register_rule(
+        ['book.id'], 'book.title', function=lambda id: str(id),
+        cache=TTLCache(),
+    )
+
+    return gc
+
+
+QUERY = {
+    'user.id?': None,
+    'user.age>': 20,
+    'user.books': [{
+        'title?': None,
+    }],
+}
+
+
+def test_explain_analyze():
+    gc = graphcore()
+    profile = gc.explain_analyze(QUERY)
+
+    assert profile.result == gc.query(QUERY)
+    assert profile.search_seconds > 0
+    assert profile.optimize_seconds > 0
+    assert profile.plan_seconds > 0
+    assert profile.execute_seconds > 0
+
+    user_id, age, books, title = profile.nodes
+    assert str(age.node.outgoing_paths[0]) == 'user.age'
+
+    assert (user_id.calls, user_id.rows_in, user_id.rows_out) == (1, 1, 10)
+
+    # id 3 raises NoResult and ids 0 to 4 are filtered out
+    assert (age.calls, age.rows_in, age.rows_out) == (10, 10, 5)
+    assert age.exceptions == 1
+    assert age.rows_filtered == 4
+
+    # users 5 to 9 have 2, 0, 1, 2 and 0 books
+    assert (books.calls, books.rows_in, books.rows_out) == (5, 5, 5)
+    assert (title.calls, title.rows_in, title.rows_out) == (5, 5, 5)
+    # books 0 and 1 were looked up more than once
+    assert title.cache_hits == 3
+
+    explain = profile.explain()
+    assert explain.startswith('total: ')
+    assert 'rows: 10 -> 5; filtered: 4; exceptions: 1;' in explain
+
+
+def test_query_profile():
+    rows, profile = graphcore().query(QUERY, limit=2, profile=True)
+
+    assert rows == graphcore().query(QUERY, limit=2)
+    assert isinstance(profile, QueryProfile)
+    assert profile.result is rows
@@ -1,5 +1,11 @@
 import inspect
 
+try:
+    from inspect import getfullargspec as getargspec
+except ImportError:
+    # python 2
+    from inspect import getargspec
+
 from .path import Path
 from . import result_set
 
@@ -37,7 +43,8 @@ class ModuleReflector(object):
     def _reflect(self):
         for name, value in self.module.__dict__.items():
             if inspect.isfunction(value):
-                arg_names, _, __, defaults = inspect.getargspec(value)
+                argspec = getargspec(value)
+                arg_names, defaults = argspec.args, argspec.defaults
 
                 # dont map arguments with defaults to inputs
                 if defaults:
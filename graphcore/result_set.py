@@ -7,17 +7,6 @@ from .path import Path
 from .rule import Cardinality
 
 
-def mapper(fn, data):
-    # override this if you want to implement a different distributed
-    # execution model
-    if len(data) > 20:
-        from plotwatt.pwcloud import pwcloud
-
-        return pwcloud.chunk_imap(fn, data, chunk_size=len(data)/8)
-    else:
-        return map(fn, data)
-
-
 def shape_path(path, query_shape):
     """ return a tuple of subpaths which add together to path, but are split
     in the same way as the data result_set.
@@ -75,6 +64,28 @@ def input_mapping(keys, parts=1):
     return mapping
 
 
+def simplify_scope(scope):
+    """ convert a scope keyed by full path into the kwargs a rule function
+    is called with """
+    mapping = input_mapping(scope.keys())
+    return {mapping[k]: v for k, v in scope.items()}
+
+
+def computable(scope):
+    """ a rule can not be computed if any of its inputs are NoneResult """
+    for v in scope.values():
+        if isinstance(v, NoneResult):
+            return False
+
+    return True
+
+
+def call_rule(fn, kwargs):
+    """ the default way a rule function is called.  QueryPlan may pass a
+    different call to apply_rule to intercept the call to the function """
+    return fn(**kwargs)
+
+
 class RuleApplicationException(Exception):
     def __init__(self, fn, scope, exception, traceback):
         super(RuleApplicationException, self).__init__(
@@ -137,6 +148,8 @@ class Result(EqualityMixin):
 
     def __init__(self, result=None, mapper=map):
         self.mapper = mapper
+        # True if self.result may be shared with another Result.  See copy
+        self._shared = False
         if isinstance(result, Result):
             self.result = result.result.copy()
         elif isinstance(result, dict):
@@ -187,10 +200,39 @@ class Result(EqualityMixin):
 
         return Result(new_result, mapper=self.mapper)
 
+    def copy(self):
+        """ return a copy of self which shares its data, including nested
+        ResultSets, with self.  Whichever is modified first copies the parts
+        it modifies. """
+        self._shared = True
+        for v in self.result.values():
+            if isinstance(v, ResultSet):
+                v._shared = True
+
+        new = Result(mapper=self.mapper)
+        new.result = self.result
+        new._shared = True
+        return new
+
+    def _nested_result_set(self, k, default=None):
+        """ return the ResultSet at k, ready to be modified """
+        result_set = self.get(k, default)
+        if result_set is None:
+            raise KeyError(str(k))
+
+        if result_set._shared:
+            result_set = result_set.copy()
+            self[k] = result_set
+        return result_set
+
     def __getitem__(self, k):
         return self.result[str(k)]
 
     def __setitem__(self, k, v):
+        if self._shared:
+            self.result = dict(self.result)
+            self._shared = False
+
         self.result[str(k)] = v
 
     def __repr__(self):
@@ -205,7 +247,7 @@ class Result(EqualityMixin):
         return NotImplemented
 
     def apply_rule(self, fn, inputs, outputs, cardinality, scope,
-                   exception_handler):
+                   exception_handler, call=call_rule):
         # collect inputs at this level
         for input in inputs:
             if len(input) == 1:
@@ -217,7 +259,7 @@ class Result(EqualityMixin):
         # which are deeper
         if len(outputs[0]) == 1:
             return self._apply_rule(
-                fn, outputs, cardinality, scope, exception_handler
+                fn, outputs, cardinality, scope, exception_handler, call
             )
         else:
             # recur down to the next level of the data
@@ -232,28 +274,52 @@ class Result(EqualityMixin):
             default = ResultSet(
                 [Result(mapper=self.mapper)], mapper=self.mapper
             )
-            existing_result_set = self.get(sub_path, default)
+            existing_result_set = self._nested_result_set(sub_path, default)
             self[sub_path] = existing_result_set.apply_rule(
                 fn, new_inputs, new_outputs, cardinality, scope,
-                exception_handler=exception_handler
+                exception_handler=exception_handler, call=call
             )
 
             # return a list boxing the data so the return value is the same as
             # cardinality many
             return ResultSet([self], mapper=self.mapper)
 
+    def scopes(self, inputs, outputs, scope):
+        """ yield the scope that apply_rule would call the rule function
+        with for each row below this Result.  Nothing is modified. """
+        scope = dict(scope)
+        for input in inputs:
+            if len(input) == 1:
+                scope[str(input[0])] = self[input[0]]
+
+        if len(outputs[0]) == 1:
+            yield scope
+        else:
+            inputs = [input for input in inputs if len(input) > 1]
+
+            sub_path = next_sub_path(inputs + outputs)
+
+            new_inputs = [input[1:] for input in inputs]
+            new_outputs = [output[1:] for output in outputs]
+
+            # apply_rule would create a ResultSet with one empty Result here
+            result_set = self.get(sub_path)
+            if result_set is None:
+                result_set = ResultSet([Result()])
+
+            for sub_scope in result_set.scopes(
+                new_inputs, new_outputs, scope
+            ):
+                yield sub_scope
+
     def _simplify_scope(self, scope):
-        mapping = input_mapping(scope.keys())
-        return {mapping[k]: v for k, v in scope.items()}
+        return simplify_scope(scope)
 
     def _computable(self, scope):
-        for v in scope.values():
-            if isinstance(v, NoneResult):
-                return False
-
-        return True
+        return computable(scope)
 
-    def _apply_rule(self, fn, outputs, cardinality, scope, exception_handler):
+    def _apply_rule(self, fn, outputs, cardinality, scope, exception_handler,
+                    call=call_rule):
         """ this one finally calls `fn` """
         cardinality = Cardinality.cast(cardinality)
 
@@ -261,7 +327,7 @@ class Result(EqualityMixin):
 
         if computable:
             try:
-                ret = fn(**self._simplify_scope(scope))
+                ret = call(fn, self._simplify_scope(scope))
             except Exception as e:
                 try:
                     ret = exception_handler(
@@ -297,8 +363,9 @@ class Result(EqualityMixin):
 
             new_datas = []
             for values in values_set:
-                # deepcopy: recursively copy Result and ResultSet objects only
-                new_data = self.deepcopy()
+                # copy on write: only the outputs are new, everything else is
+                # shared until it is modified
+                new_data = self.copy()
                 for output, value in zip(outputs, values):
                     new_data[output[0]] = value
                 new_datas.append(new_data)
@@ -325,6 +392,9 @@ class ResultSet(EqualityMixin):
         """
 
         self.mapper = mapper
+        # True if this ResultSet may be shared by more than one Result.  See
+        # Result.copy
+        self._shared = False
 
         if isinstance(init, ResultSet):
             self.results = init.results
@@ -364,13 +434,38 @@ class ResultSet(EqualityMixin):
         # if this is a nested filter, recur down into the next level
         else:
             for result in self.results:
-                result[path[0]].filter(
+                result._nested_result_set(path[0]).filter(
                     path[1:], relation
                 )
 
-    def limit(self, limit):
-        """ naive limit for now.  won't limit sub results """
-        self.results = self.results[:limit]
+    def limit(self, limit, path=()):
+        """ keep only the first limit results.  If path, a shaped path to a
+        nested list, is given, the nested ResultSets at path are limited
+        instead """
+        if not path:
+            self.results = self.results[:limit]
+            return
+
+        for result in self.results:
+            result_set = result.get(path[0])
+            if result_set is None:
+                continue
+
+            if len(path) > 1 or len(result_set) > limit:
+                result._nested_result_set(path[0]).limit(limit, path[1:])
+
+    def count(self, path=()):
+        """ the number of rows in the lists at path, a shaped path to a list
+        """
+        if not path:
+            return len(self.results)
+
+        count = 0
+        for result in self.results:
+            result_set = result.get(path[0])
+            if result_set is not None:
+                count += result_set.count(path[1:])
+        return count
 
     def deepcopy(self):
         new_results = []
@@ -382,6 +477,14 @@ class ResultSet(EqualityMixin):
 
         return ResultSet(new_results, mapper=self.mapper)
 
+    def copy(self):
+        """ return a new ResultSet whose Results share their data with the
+        Results in self until they are modified.  See Result.copy """
+        return ResultSet([
+            result.copy() if isinstance(result, Result) else result
+            for result in self.results
+        ], self.query_shape, mapper=self.mapper)
+
     def __repr__(self):
         return '<ResultSet {str}>'.format(str=str(self))
 
@@ -408,8 +511,22 @@ class ResultSet(EqualityMixin):
     def shape_path(self, path):
         return shape_path(path, self.query_shape)
 
+    def scopes(self, inputs, outputs, scope=None):
+        """ yield the scope each row would be called with by apply_rule """
+        if scope is None:
+            scope = {}
+
+        for result in self.results:
+            for sub_scope in result.scopes(inputs, outputs, scope):
+                yield sub_scope
+
     def apply_rule(self, fn, inputs, outputs, cardinality, scope=None,
-                   exception_handler=default_exception_handler):
+                   exception_handler=default_exception_handler,
+                   call=call_rule):
+        """
+        call: call(fn, kwargs) is used to call fn for each row.  It can be
+            replaced to intercept calls to fn.
+        """
         if scope is None:
             scope = {}
 
@@ -423,7 +540,8 @@ class ResultSet(EqualityMixin):
 
         def wrapped_fn(result):
             return result.apply_rule(
-                fn, inputs, outputs, cardinality, scope, exception_handler
+                fn, inputs, outputs, cardinality, scope, exception_handler,
+                call
             )
 
         wrapped_fn.__name__ = fn.__name__
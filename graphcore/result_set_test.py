@@ -317,3 +317,65 @@ def test_result_set_extract_json_none_result():
     assert ResultSet([Result({'x': NoneResult()})]).extract_json(['x']) == [{
         'x': None,
     }]
+
+
+def test_apply_rule_cardinality_many_shares_nested(data):
+    ret = data.apply_rule(
+        lambda c: [1, 2],
+        inputs=[('c',)],
+        outputs=[('e',)],
+        cardinality='many',
+    )
+
+    first, second = ret.results
+    assert first['a'] is second['a']
+    assert first['e'] == 1
+    assert second['e'] == 2
+
+    # modifying the nested ResultSet of one row doesn't change the other
+    ret = ret.apply_rule(
+        lambda b, e: b + e,
+        inputs=[('e',), ('a', 'b')],
+        outputs=[('a', 'f')],
+        cardinality='one',
+    )
+    ret.filter(('e',), Relation('==', 2))
+
+    assert ret.extract_json(['a.f', 'e']) == [{
+        'a': [{'f': 12}, {'f': 22}],
+        'e': 2,
+    }]
+    assert first.extract_json([('a', 'f')]) == {'a': [{'f': 11}, {'f': 21}]}
+    assert data.extract_json(['a.b', 'a.d', 'c']) == [{
+        'a': [{'b': 10, 'd': 10}, {'b': 20, 'd': 20}],
+        'c': 100,
+    }]
+
+
+def test_result_copy_nested_filter(data):
+    copy = data.results[0].copy()
+    copy_set = ResultSet([copy], data.query_shape)
+
+    copy_set.filter('a.b', Relation('>', 15))
+
+    assert copy_set.extract_json(['a.b']) == [{'a': [{'b': 20}]}]
+    assert data.extract_json(['a.b']) == [{'a': [{'b': 10}, {'b': 20}]}]
+
+
+def test_result_copy_setitem():
+    result = Result({'a': 1})
+    copy = result.copy()
+
+    copy['a'] = 2
+
+    assert result['a'] == 1
+    assert copy['a'] == 2
+
+
+def test_limit_nested_copy(data):
+    copy = data.copy()
+
+    copy.limit(1, ('a',))
+
+    assert copy.extract_json(['a.b']) == [{'a': [{'b': 10}]}]
+    assert data.extract_json(['a.b']) == [{'a': [{'b': 10}, {'b': 20}]}]
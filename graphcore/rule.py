@@ -22,9 +22,63 @@ class Cardinality(Enum):
             )
 
 
+class BatchFunction(object):
+    """ wrap a rule function which is called once for many rows.
+
+    The function is called with a list of values for each input and must
+    return a list with one output for each element.  An exception instance
+    in the returned list (for example NoResult()) is raised for that row
+    only.  Rows with a NoneResult input aren't passed to the function.
+    """
+
+    batch = True
+
+    def __init__(self, function):
+        self.function = function
+        self.__name__ = getattr(function, '__name__', repr(function))
+
+    def call_batch(self, calls):
+        """ call the function once for a list of kwargs """
+        if calls:
+            keys = calls[0].keys()
+        else:
+            keys = []
+
+        return self.function(**{
+            key: [kwargs[key] for kwargs in calls] for key in keys
+        })
+
+    def __call__(self, **kwargs):
+        """ call the function for a single row """
+        ret = self.function(**{key: [value] for key, value in kwargs.items()})
+
+        ret = list(ret)
+        if len(ret) != 1:
+            raise ValueError(
+                'batch function {} returned {} values for 1 row'.format(
+                    self.__name__, len(ret)
+                )
+            )
+        if isinstance(ret[0], Exception):
+            raise ret[0]
+        return ret[0]
+
+    def __repr__(self):
+        return '<BatchFunction {}>'.format(self.__name__)
+
+
 class Rule(HashMixin, EqualityMixin):
 
-    def __init__(self, function, inputs, outputs, cardinality):
+    def __init__(self, function, inputs, outputs, cardinality,
+                 executor=None, pure=False):
+        """
+        executor: the Executor which runs the calls of this rule.  None
+            means the Graphcore's rule_executor.  See executors
+        pure: True if function always returns the same value given the same
+            inputs and has no side effects, so QueryPlan may reuse the
+            outcome of a call with the same inputs instead of calling it
+            again
+        """
         self.function = function
         self.inputs = [Path(input) for input in inputs]
         if isinstance(outputs, (Path, six.string_types)):
@@ -32,6 +86,19 @@ class Rule(HashMixin, EqualityMixin):
         else:
             self.outputs = [Path(output) for output in outputs]
         self.cardinality = Cardinality.cast(cardinality)
+        self.executor = executor
+        self.pure = pure
+
+    @property
+    def key(self):
+        """ a string which identifies the rule, see rule_stats """
+        return '{outputs} = {function_name}({inputs})'.format(
+            outputs=', '.join(map(str, self.outputs)),
+            function_name=getattr(
+                self.function, '__name__', repr(self.function)
+            ),
+            inputs=', '.join(map(str, self.inputs)),
+        )
 
     def __repr__(self):
         string = '<Rule {outputs} = {function_name}({inputs}) {cardinality}'
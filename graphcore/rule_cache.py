@@ -0,0 +1,310 @@
+"""
+A TTLCache shares the results of rule calls across queries.  Pass one to
+Graphcore.rule or Graphcore.register_rule:
+
+    @gc.rule(['book.id'], 'book.name', cache=TTLCache(ttl=60))
+    def book_name(id):
+        ...
+
+Entries are keyed by rule and inputs.  NoResult outcomes are cached too, with
+their own negative_ttl.  Other exceptions are never cached.
+"""
+
+import sys
+import time
+import inspect
+import threading
+from collections import OrderedDict
+
+from .call_table import call_key
+from .result_set import NoResult
+
+
+def sizeof(value):
+    """ an approximation of the number of bytes used by value and the
+    lists, tuples, sets and dicts it contains """
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        for k, v in value.items():
+            size += sizeof(k) + sizeof(v)
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        for v in value:
+            size += sizeof(v)
+    return size
+
+
+class TTLCache(object):
+    """ a thread safe LRU cache whose entries expire ttl seconds after they
+    are added """
+
+    def __init__(self, ttl=60, max_entries=None, max_bytes=None,
+                 negative_ttl=None, clock=time.time, sizeof=sizeof):
+        """
+        ttl: seconds until a value expires
+        max_entries: the maximum number of entries to keep.  None is no limit
+        max_bytes: the maximum total size of the entries to keep, as measured
+            by sizeof.  None is no limit
+        negative_ttl: seconds until a NoResult outcome expires.  Defaults to
+            ttl.  0 disables caching NoResult.
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        if negative_ttl is None:
+            self.negative_ttl = ttl
+        else:
+            self.negative_ttl = negative_ttl
+        self.clock = clock
+        self.sizeof = sizeof
+
+        # {key: (expires_at, value, no_result, size)}
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.bytes = 0
+
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        """ return (found, value, no_result) """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                self.misses += 1
+                return False, None, False
+
+            expires_at, value, no_result, size = entry
+            if expires_at <= self.clock():
+                self.bytes -= size
+                self.expirations += 1
+                self.misses += 1
+                return False, None, False
+
+            # reinsert to mark as most recently used
+            self._entries[key] = entry
+            if no_result:
+                self.negative_hits += 1
+            else:
+                self.hits += 1
+            return True, value, no_result
+
+    def put(self, key, value):
+        self._put(key, value, False, self.ttl)
+
+    def put_no_result(self, key):
+        self._put(key, None, True, self.negative_ttl)
+
+    def _put(self, key, value, no_result, ttl):
+        if not ttl:
+            return
+
+        size = self.sizeof(key) + self.sizeof(value)
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.bytes -= old[3]
+
+            self._entries[key] = (self.clock() + ttl, value, no_result, size)
+            self.bytes += size
+
+            self._evict()
+
+    def _evict(self):
+        while self._entries and (
+            (self.max_entries is not None and
+             len(self._entries) > self.max_entries) or
+            (self.max_bytes is not None and self.bytes > self.max_bytes)
+        ):
+            _, entry = self._entries.popitem(last=False)
+            self.bytes -= entry[3]
+            self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        return {
+            'size': len(self),
+            'bytes': self.bytes,
+            'hits': self.hits,
+            'negative_hits': self.negative_hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+        }
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __repr__(self):
+        return (
+            '<TTLCache size:{size}; bytes:{bytes}; hits:{hits}; '
+            'negative_hits:{negative_hits}; misses:{misses}; '
+            'evictions:{evictions}; expirations:{expirations}>'
+        ).format(**self.stats())
+
+
+# python2 support: there are no awaitables
+_isawaitable = getattr(inspect, 'isawaitable', lambda value: False)
+
+
+def _then(awaitable, function, exception_function=None):
+    """ return a future of function(the value of awaitable).
+    exception_function is called with the exception awaitable raises, if
+    any, before it is passed on.
+
+    A future and a callback are used rather than a coroutine so that this
+    module can still be imported by python 2 """
+    import asyncio
+
+    loop = asyncio.get_event_loop()
+    inner = asyncio.ensure_future(awaitable, loop=loop)
+    outer = loop.create_future()
+
+    def done(inner):
+        if outer.cancelled():
+            return
+        if inner.cancelled():
+            outer.cancel()
+            return
+
+        try:
+            value = inner.result()
+        except Exception as e:
+            if exception_function is not None:
+                exception_function(e)
+            outer.set_exception(e)
+            return
+
+        try:
+            outer.set_result(function(value))
+        except Exception as e:
+            outer.set_exception(e)
+
+    inner.add_done_callback(done)
+    return outer
+
+
+def _cacheable(value):
+    """ iterators are consumed by the first caller, so they are cached as
+    lists """
+    try:
+        if iter(value) is value:
+            return list(value)
+    except TypeError:
+        pass
+    return value
+
+
+class CachedFunction(object):
+    """ wrap a rule function so its outcomes are stored in a TTLCache.
+
+    The batch and pure flags of the wrapped function are preserved.  Rules
+    which return awaitables return a future instead, and their value is
+    cached once it has been awaited.
+    """
+
+    def __init__(self, function, cache):
+        self.function = function
+        self.cache = cache
+        self.__name__ = getattr(function, '__name__', repr(function))
+
+        self.batch = getattr(function, 'batch', False)
+        self.pure = getattr(function, 'pure', False)
+
+    def _key(self, kwargs):
+        key = call_key(kwargs)
+        if key is None:
+            return None
+        return (self, key)
+
+    def __call__(self, **kwargs):
+        key = self._key(kwargs)
+        if key is None:
+            return self.function(**kwargs)
+
+        found, value, no_result = self.cache.get(key)
+        if found:
+            if no_result:
+                raise NoResult()
+            return value
+
+        try:
+            value = self.function(**kwargs)
+        except NoResult:
+            self.cache.put_no_result(key)
+            raise
+
+        if _isawaitable(value):
+            def no_result(e):
+                if isinstance(e, NoResult):
+                    self.cache.put_no_result(key)
+
+            return _then(value, lambda value: self._put(key, value),
+                         no_result)
+
+        return self._put(key, value)
+
+    def _put(self, key, value):
+        value = _cacheable(value)
+        self.cache.put(key, value)
+        return value
+
+    def call_batch(self, calls):
+        """ look up each call in the cache and pass the rest to the wrapped
+        function's call_batch """
+        ret = [None] * len(calls)
+        misses = []
+        for i, kwargs in enumerate(calls):
+            key = self._key(kwargs)
+            found = False
+            if key is not None:
+                found, value, no_result = self.cache.get(key)
+
+            if found:
+                ret[i] = NoResult() if no_result else value
+            else:
+                misses.append((i, key, kwargs))
+
+        if not misses:
+            return ret
+
+        values = self.function.call_batch([kwargs for _, _, kwargs in misses])
+        if _isawaitable(values):
+            return _then(
+                values, lambda values: self._put_batch(ret, misses, values)
+            )
+
+        return self._put_batch(ret, misses, values)
+
+    def _put_batch(self, ret, misses, values):
+        """ cache the values of the calls which missed and fill them into
+        ret """
+        values = list(values)
+        if len(values) != len(misses):
+            # let CallTable.set_batch report the mismatch
+            return values
+
+        for (i, key, _), value in zip(misses, values):
+            if isinstance(value, NoResult):
+                if key is not None:
+                    self.cache.put_no_result(key)
+            elif not isinstance(value, Exception):
+                value = _cacheable(value)
+                if key is not None:
+                    self.cache.put(key, value)
+            ret[i] = value
+
+        return ret
+
+    def __repr__(self):
+        return '<CachedFunction {} {}>'.format(self.__name__, self.cache)
@@ -0,0 +1,156 @@
+import pytest
+
+from .graphcore import Graphcore
+from .result_set import NoResult
+from .rule_cache import TTLCache, CachedFunction
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+def test_ttl_cache_expires():
+    clock = Clock()
+    cache = TTLCache(ttl=10, clock=clock)
+
+    cache.put('a', 1)
+    assert cache.get('a') == (True, 1, False)
+
+    clock.now = 10
+    assert cache.get('a') == (False, None, False)
+    assert cache.stats()['expirations'] == 1
+    assert cache.bytes == 0
+
+
+def test_ttl_cache_negative_ttl():
+    clock = Clock()
+    cache = TTLCache(ttl=10, negative_ttl=1, clock=clock)
+
+    cache.put_no_result('a')
+    assert cache.get('a') == (True, None, True)
+
+    clock.now = 1
+    assert cache.get('a') == (False, None, False)
+
+    assert cache.stats()['negative_hits'] == 1
+
+
+def test_ttl_cache_lru_eviction():
+    cache = TTLCache(max_entries=2)
+
+    cache.put('a', 1)
+    cache.put('b', 2)
+    cache.get('a')
+    cache.put('c', 3)
+
+    assert cache.get('b') == (False, None, False)
+    assert cache.get('a') == (True, 1, False)
+    assert cache.evictions == 1
+
+
+def test_ttl_cache_max_bytes():
+    cache = TTLCache(max_bytes=250, sizeof=lambda value: 100)
+
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.bytes == 200
+    assert len(cache) == 1
+    assert cache.get('a') == (False, None, False)
+
+
+def test_cached_function():
+    calls = []
+
+    def name(id):
+        calls.append(id)
+        if id == 2:
+            raise NoResult()
+        return str(id)
+
+    function = CachedFunction(name, TTLCache())
+
+    assert function(id=1) == '1'
+    assert function(id=1) == '1'
+    for _ in range(2):
+        with pytest.raises(NoResult):
+            function(id=2)
+
+    assert calls == [1, 2]
+
+
+def test_cached_function_doesnt_cache_exceptions():
+    calls = []
+
+    def name(id):
+        calls.append(id)
+        raise ValueError()
+
+    function = CachedFunction(name, TTLCache())
+    for _ in range(2):
+        with pytest.raises(ValueError):
+            function(id=1)
+
+    assert calls == [1, 1]
+
+
+def test_cached_function_iterator():
+    function = CachedFunction(lambda id: iter([1, 2]), TTLCache())
+
+    assert function(id=1) == [1, 2]
+    assert function(id=1) == [1, 2]
+
+
+def test_register_rule_cache():
+    cache = TTLCache(ttl=60)
+    calls = []
+
+    gc = Graphcore()
+    gc.property_type('user', 'books', 'book')
+    gc.register_rule(
+        ['user.id'], 'user.books.id', cardinality='many',
+        function=lambda id: [1, 2],
+    )
+
+    @gc.rule(['book.id'], 'book.name', cache=cache)
+    def book_name(id):
+        calls.append(id)
+        return 'book{}'.format(id)
+
+    for user_id in [1, 2]:
+        ret = gc.query({
+            'user.id': user_id,
+            'user.books.name?': None,
+        })
+        assert ret == [
+            {'user.books.name': 'book1'}, {'user.books.name': 'book2'}
+        ]
+
+    assert calls == [1, 2]
+    assert cache.hits == 2
+    assert cache.misses == 2
+
+
+def test_register_rule_cache_batch():
+    cache = TTLCache(ttl=60)
+    calls = []
+
+    gc = Graphcore()
+    gc.register_rule(
+        ['x.in1'], 'x.out1', function=lambda in1: [in1 * 10, in1 * 10 + 1],
+        cardinality='many',
+    )
+
+    @gc.rule(['x.out1'], 'x.out2', batch=True, cache=cache)
+    def out2(out1):
+        calls.append(out1)
+        return [NoResult() if v == 21 else v + 1 for v in out1]
+
+    for in1 in [1, 2, 2]:
+        gc.query({'x.in1': in1, 'x.out2?': None})
+
+    assert calls == [[10, 11], [20, 21]]
+    assert cache.negative_hits == 1
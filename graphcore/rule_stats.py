@@ -0,0 +1,229 @@
+"""
+RuleStats records how each rule behaves at runtime so that the planner can
+use it.  Pass one to Graphcore:
+
+    gc = Graphcore(rule_stats=RuleStats(path='rule_stats.json'))
+    ...
+    gc.rule_stats.save()
+
+For each rule it keeps the mean latency of a call, the mean number of values
+a many cardinality rule returns (its fan-out) and the fraction of rows which
+pass the relations on its outputs.  Rules are identified by a string key
+(see stats_key) so the stats can be saved to and loaded from a json file.
+"""
+
+import os
+import json
+import threading
+
+
+def stats_key(node):
+    """ the key of the rule a Node applies.  Nodes built by QuerySearch
+    carry the key of their Rule.  Other nodes (for example those built by
+    the optimizer) are keyed by their function name and paths """
+    if node.stats_key is not None:
+        return node.stats_key
+
+    return '{outputs} = {name}({inputs})'.format(
+        outputs=', '.join(map(str, node.outgoing_paths)),
+        name=node.name,
+        inputs=', '.join(map(str, node.incoming_paths)),
+    )
+
+
+class _Entry(object):
+    __slots__ = (
+        'calls', 'seconds', 'counted_calls', 'values', 'rows_in', 'rows_out'
+    )
+
+    def __init__(self, calls=0, seconds=0.0, counted_calls=0, values=0,
+                 rows_in=0, rows_out=0):
+        self.calls = calls
+        self.seconds = seconds
+        # the number of calls to a many cardinality rule whose values were
+        # counted and the number of values they returned
+        self.counted_calls = counted_calls
+        self.values = values
+        # the number of rows checked by relations and the number which passed
+        self.rows_in = rows_in
+        self.rows_out = rows_out
+
+    def to_json(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class RuleStats(object):
+    """ thread safe runtime statistics for each rule """
+
+    def __init__(self, path=None):
+        """
+        path: a json file to load the stats from, if it exists, and to save
+            them to
+        """
+        self.path = path
+        # {key: _Entry}
+        self._entries = {}
+        self._lock = threading.Lock()
+        # incremented whenever the stats change enough that plans built from
+        # them should be rebuilt: when a rule is first measured and each
+        # time its number of calls or checked rows doubles after that.  So
+        # cached plans are rebuilt O(log(calls)) times per rule
+        self.generation = 0
+
+        if path is not None and os.path.exists(path):
+            self.load(path)
+
+    def _entry(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = self._entries[key] = _Entry()
+        return entry
+
+    def _count(self, before, after):
+        """ bump generation if a count grew from before to after past a
+        power of two """
+        if after and (not before or after.bit_length() > before.bit_length()):
+            self.generation += 1
+
+    def record_calls(self, key, calls, seconds, values=None):
+        """ record that calls calls to the rule took seconds in total.  For
+        many cardinality rules, values is the number of values they
+        returned, if it is known """
+        with self._lock:
+            entry = self._entry(key)
+            self._count(entry.calls, entry.calls + calls)
+            entry.calls += calls
+            entry.seconds += seconds
+            if values is not None:
+                entry.counted_calls += calls
+                entry.values += values
+
+    def record_filter(self, key, rows_in, rows_out):
+        """ record that rows_out of rows_in rows passed the relations on the
+        rule's outputs """
+        with self._lock:
+            entry = self._entry(key)
+            self._count(entry.rows_in, entry.rows_in + rows_in)
+            entry.rows_in += rows_in
+            entry.rows_out += rows_out
+
+    def latency(self, key):
+        """ the mean seconds per call, or None if the rule was never called
+        """
+        entry = self._entries.get(key)
+        if entry is None or not entry.calls:
+            return None
+        return entry.seconds / entry.calls
+
+    def fan_out(self, key):
+        """ the mean number of values returned per call of a many
+        cardinality rule, or None if it was never called """
+        entry = self._entries.get(key)
+        if entry is None or not entry.counted_calls:
+            return None
+        return float(entry.values) / entry.counted_calls
+
+    def pass_rate(self, key):
+        """ the fraction of rows which passed the relations on the rule's
+        outputs, or None if none were checked """
+        entry = self._entries.get(key)
+        if entry is None or not entry.rows_in:
+            return None
+        return float(entry.rows_out) / entry.rows_in
+
+    def _default_cost(self):
+        """ the mean latency of the rules which were called, or 1 if there
+        are none """
+        with self._lock:
+            latencies = [
+                entry.seconds / entry.calls
+                for entry in self._entries.values() if entry.calls
+            ]
+        if latencies:
+            return sum(latencies) / len(latencies)
+        return 1.0
+
+    def cost(self, node):
+        """ the estimated seconds per call of node.  Rules which were never
+        called are assumed to cost the mean latency of the ones which were,
+        or 1 if there are none """
+        latency = self.latency(stats_key(node))
+        if latency is not None:
+            return latency
+        return self._default_cost()
+
+    def costs(self, nodes):
+        """ return {id(node): cost} for each node in nodes, computing the
+        cost of rules which were never called only once """
+        default = None
+        costs = {}
+        for node in nodes:
+            latency = self.latency(stats_key(node))
+            if latency is None:
+                if default is None:
+                    default = self._default_cost()
+                latency = default
+            costs[id(node)] = latency
+        return costs
+
+    def rank(self, node, cost=None):
+        """ the order in which to apply ready nodes with relations: cheap
+        nodes which filter out many rows first.
+
+        cost: the cost of node, if it is already known
+        """
+        pass_rate = self.pass_rate(stats_key(node))
+        if pass_rate is None:
+            pass_rate = 0.5
+        if pass_rate >= 1:
+            return float('inf')
+        if cost is None:
+            cost = self.cost(node)
+        return cost / (1 - pass_rate)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.generation += 1
+
+    def to_json(self):
+        with self._lock:
+            return {
+                key: entry.to_json() for key, entry in self._entries.items()
+            }
+
+    def load(self, path=None):
+        """ add the stats saved in path to self """
+        with open(path or self.path) as f:
+            saved = json.load(f)
+
+        with self._lock:
+            for key, values in saved.items():
+                entry = self._entry(key)
+                for name in _Entry.__slots__:
+                    setattr(
+                        entry, name, getattr(entry, name) + values.get(name, 0)
+                    )
+            self.generation += 1
+
+    def save(self, path=None):
+        """ write the stats to path as json """
+        path = path or self.path
+        if path is None:
+            raise ValueError('RuleStats has no path to save to')
+
+        # write to a temporary file first so that readers never see half of
+        # a file
+        tmp_path = '{}.tmp'.format(path)
+        with open(tmp_path, 'w') as f:
+            json.dump(self.to_json(), f, indent=2, sort_keys=True)
+        getattr(os, 'replace', os.rename)(tmp_path, path)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __repr__(self):
+        return '<RuleStats rules:{}>'.format(len(self))
@@ -0,0 +1,220 @@
+import time
+
+import pytest
+
+from .call_graph import Node
+from .graphcore import Graphcore
+from .rule_stats import RuleStats, stats_key
+
+
+def f():
+    pass
+
+
+def test_stats_key():
+    node = Node(None, ['a.x'], ['a.y'], f, 'one')
+    assert stats_key(node) == 'a.y = f(a.x)'
+
+    node.stats_key = 'b.y = f(b.x)'
+    assert stats_key(node) == 'b.y = f(b.x)'
+
+
+def test_record():
+    stats = RuleStats()
+    assert stats.latency('a') is None
+    assert stats.fan_out('a') is None
+    assert stats.pass_rate('a') is None
+
+    stats.record_calls('a', 2, 1.0, values=6)
+    stats.record_calls('a', 2, 3.0)
+    stats.record_filter('a', 10, 4)
+
+    assert stats.latency('a') == 1.0
+    assert stats.fan_out('a') == 3.0
+    assert stats.pass_rate('a') == 0.4
+    assert 'a' in stats
+    assert len(stats) == 1
+
+
+def test_cost_and_rank():
+    a = Node(None, [], ['a.x'], f, 'one')
+    b = Node(None, [], ['a.y'], f, 'one')
+
+    stats = RuleStats()
+    assert stats.cost(a) == 1.0
+
+    stats.record_calls(stats_key(a), 1, 2.0)
+    assert stats.cost(a) == 2.0
+    # b was never called, so it is assumed to cost as much as the mean
+    assert stats.cost(b) == 2.0
+
+    stats.record_filter(stats_key(a), 4, 3)
+    assert stats.rank(a) == 8.0
+    stats.record_filter(stats_key(b), 4, 4)
+    assert stats.rank(b) == float('inf')
+
+
+def test_save_load(tmpdir):
+    path = str(tmpdir.join('stats.json'))
+
+    stats = RuleStats(path)
+    stats.record_calls('a', 2, 1.0, values=4)
+    stats.record_filter('a', 10, 5)
+    stats.save()
+
+    loaded = RuleStats(path)
+    assert loaded.to_json() == stats.to_json()
+    assert loaded.fan_out('a') == 2.0
+
+    # loading again adds to the stats already there
+    loaded.load()
+    assert loaded.to_json()['a']['calls'] == 4
+
+
+def test_save_without_path():
+    with pytest.raises(ValueError):
+        RuleStats().save()
+
+
+def _users_graphcore(rule_stats):
+    gc = Graphcore(rule_stats=rule_stats)
+
+    @gc.rule([], 'user.id', cardinality='many')
+    def user_id():
+        return range(10)
+
+    @gc.rule(['user.id'], 'user.age')
+    def user_age(id):
+        return id * 5
+
+    return gc
+
+
+def test_query_records_stats():
+    stats = RuleStats()
+    gc = _users_graphcore(stats)
+
+    assert gc.query({'user.id?': None, 'user.age>': 20}) == [
+        {'user.id': i} for i in range(5, 10)
+    ]
+
+    assert stats.fan_out('user.id = user_id()') == 10
+    assert stats.latency('user.age = user_age(user.id)') is not None
+    assert stats.pass_rate('user.age = user_age(user.id)') == 0.5
+
+
+def test_query_with_limit_records_stats():
+    stats = RuleStats()
+    gc = _users_graphcore(stats)
+
+    assert gc.query({'user.id?': None, 'user.age>': 20}, limit=2) == [
+        {'user.id': 5}, {'user.id': 6}
+    ]
+
+    # the rows are pipelined, so the rules stop being called once there
+    # are enough of them
+    assert stats.latency('user.age = user_age(user.id)') is not None
+    assert stats.to_json()['user.age = user_age(user.id)']['calls'] == 7
+    assert stats.pass_rate('user.age = user_age(user.id)') == 2.0 / 7
+    assert 'user.id = user_id()' in stats
+
+
+def test_choose_between_alternative_rules():
+    calls = []
+
+    def fast(id):
+        calls.append('fast')
+        return 'name'
+
+    def slow(id):
+        calls.append('slow')
+        return 'name'
+
+    def graphcore(rule_stats):
+        gc = _users_graphcore(rule_stats)
+        gc.register_rule(['user.id'], 'user.name', function=fast)
+        gc.register_rule(['user.id'], 'user.name', function=slow)
+        return gc
+
+    query = {'user.id': 1, 'user.name?': None}
+
+    # without stats, the latest rule registered is used
+    graphcore(None).query(query)
+    assert calls == ['slow']
+
+    stats = RuleStats()
+    stats.record_calls('user.name = slow(user.id)', 1, 1.0)
+
+    # fast hasn't been measured yet, so it is tried
+    del calls[:]
+    graphcore(stats).query(query)
+    assert calls == ['fast']
+
+    stats.record_calls('user.name = fast(user.id)', 1, 2.0)
+    del calls[:]
+    graphcore(stats).query(query)
+    assert calls == ['slow']
+
+
+def test_choose_between_alternative_rules_cached():
+    calls = []
+
+    def fast(id):
+        calls.append('fast')
+        return 'name'
+
+    def slow(id):
+        calls.append('slow')
+        time.sleep(0.01)
+        return 'name'
+
+    gc = _users_graphcore(RuleStats())
+    gc.register_rule(['user.id'], 'user.name', function=fast)
+    gc.register_rule(['user.id'], 'user.name', function=slow)
+
+    for id in range(4):
+        gc.query({'user.id': id, 'user.name?': None})
+
+    # the cached plan is rebuilt once each rule has been measured
+    assert calls == ['slow', 'fast', 'fast', 'fast']
+
+
+def test_generation():
+    stats = RuleStats()
+    generations = []
+    for _ in range(8):
+        stats.record_calls('a', 1, 1.0)
+        generations.append(stats.generation)
+
+    # bumped on the 1st, 2nd, 4th and 8th call
+    assert generations == [1, 2, 2, 3, 3, 3, 3, 4]
+
+    stats.record_filter('a', 10, 5)
+    assert stats.generation == 5
+
+    stats.clear()
+    assert stats.generation == 6
+
+
+def test_filter_order():
+    stats = RuleStats()
+
+    gc = _users_graphcore(stats)
+    gc.register_rule(['user.id'], 'user.x', function=lambda id: id)
+    gc.register_rule(['user.id'], 'user.y', function=lambda id: id)
+
+    query = {'user.id?': None, 'user.x>': 0, 'user.y<': 9}
+    assert [str(node.outgoing_paths[0]) for node in gc.compile(
+        query
+    ).nodes] == ['user.id', 'user.x', 'user.y']
+
+    stats.record_filter('user.y = <lambda>(user.id)', 10, 1)
+    stats.record_filter('user.x = <lambda>(user.id)', 10, 9)
+    gc.plan_cache.clear()
+    assert [str(node.outgoing_paths[0]) for node in gc.compile(
+        query
+    ).nodes] == ['user.id', 'user.y', 'user.x']
+
+    assert gc.query(query) == [{'user.id': i} for i in range(1, 9)]
+    # 1 of the 10 recorded rows passed and 9 of the 10 queried rows did
+    assert stats.pass_rate('user.y = <lambda>(user.id)') == 0.5
@@ -1,6 +1,6 @@
 import pytest
 
-from .rule import Rule, Cardinality
+from .rule import Rule, Cardinality, BatchFunction
 
 
 def test_rule_str():
@@ -14,3 +14,29 @@ def test_cardinality_cast_many():
 def test_cardinality_cast_err():
     with pytest.raises(TypeError):
         Cardinality.cast(lambda x: x)
+
+
+def test_batch_function():
+    function = BatchFunction(lambda x, y: [a + b for a, b in zip(x, y)])
+
+    assert function.batch
+    assert function.call_batch([{'x': 1, 'y': 2}, {'x': 3, 'y': 4}]) == [3, 7]
+    assert function(x=1, y=2) == 3
+
+
+def test_batch_function_single_row_exception():
+    function = BatchFunction(lambda x: [ValueError(v) for v in x])
+
+    with pytest.raises(ValueError):
+        function(x=1)
+
+
+def test_rule_pure():
+    def function(x):
+        return x
+
+    assert not Rule(function, ['a.x'], 'a.y', 'one').pure
+    assert Rule(function, ['a.x'], 'a.y', 'one', pure=True).pure
+
+    # purity belongs to the rule, not to the function
+    assert not hasattr(function, 'pure')
@@ -0,0 +1,219 @@
+"""
+A ConnectionPool bounds the number of connections SQLQuery calls check out
+of an engine at once and lets the calls of a plan share one of them.
+
+While a connection_scope is open on a thread, the first connection each
+pool hands out on that thread is held until the scope exits and reused by
+every later query.  QueryPlan.forward opens one, so all of the SQLQuery
+calls a plan makes on one thread share a single connection per pool.
+
+Connections are closed when they are released, which hands a sqlalchemy
+connection back to the engine's own pool.  That pool resets (rolls back)
+the connection, so the next plan doesn't read the snapshot of an old
+transaction, and applies pool_recycle and pool_pre_ping to it.  Connections
+are never kept open between plans here.
+"""
+
+import time
+import weakref
+import threading
+
+
+_local = threading.local()
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class connection_scope(object):
+    """ hold the connection each pool hands out on this thread until the
+    outermost connection_scope exits """
+
+    def __enter__(self):
+        depth = getattr(_local, 'depth', 0)
+        if depth == 0:
+            # {pool: connection}
+            _local.held = {}
+        _local.depth = depth + 1
+        return self
+
+    def __exit__(self, *args):
+        _local.depth -= 1
+        if _local.depth == 0:
+            held = _local.held
+            _local.held = None
+            for pool, connection in held.items():
+                pool.release(connection)
+
+
+def _held():
+    """ the {pool: connection} of the open connection_scope, or None """
+    return getattr(_local, 'held', None)
+
+
+class _Checkout(object):
+
+    def __init__(self, pool, exclusive):
+        self.pool = pool
+        self.exclusive = exclusive
+
+    def __enter__(self):
+        held = _held()
+        if held is None or self.exclusive:
+            self.connection = self.pool.acquire()
+            self.release = True
+        else:
+            self.connection = held.get(self.pool)
+            if self.connection is None:
+                self.connection = held[self.pool] = self.pool.acquire()
+            self.release = False
+        return self.connection
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None and not issubclass(exc_type, GeneratorExit):
+            # the connection may be broken, so don't hand it out again
+            held = _held()
+            if held is not None and held.get(self.pool) is self.connection:
+                del held[self.pool]
+            self.pool.discard(self.connection)
+        elif self.release:
+            self.pool.release(self.connection)
+
+
+class ConnectionPool(object):
+    """ a thread safe bound of at most max_size connections checked out of
+    engine at once.
+
+    The thread running a plan holds its connection while it waits for the
+    calls prefetched on an executor, so max_size should be larger than the
+    number of executor threads.
+    """
+
+    def __init__(self, engine, max_size=10, timeout=None):
+        """
+        engine: anything with a connect() method which returns a connection
+            with execute(SQL, vals) and close() methods, like a sqlalchemy
+            engine.  It should pool the connections itself: a sqlalchemy
+            engine does, so closing a connection only returns it to the
+            engine
+        timeout: seconds to wait for a connection when max_size are in use
+            before raising PoolTimeout.  None waits forever
+        """
+        self.engine = engine
+        self.max_size = max_size
+        self.timeout = timeout
+
+        # the number of connections checked out
+        self._size = 0
+        self._condition = threading.Condition()
+
+        self.checkouts = 0
+        self.waits = 0
+        self.wait_seconds = 0.0
+
+    def acquire(self):
+        """ return a connection from the engine, waiting for one to be
+        released if max_size are checked out """
+        with self._condition:
+            start = None
+            while self._size >= self.max_size:
+                if start is None:
+                    start = time.time()
+                    self.waits += 1
+
+                remaining = None
+                if self.timeout is not None:
+                    remaining = self.timeout - (time.time() - start)
+                    if remaining <= 0:
+                        self.wait_seconds += time.time() - start
+                        raise PoolTimeout(
+                            'no connection was released within {} '
+                            'seconds'.format(self.timeout)
+                        )
+                self._condition.wait(remaining)
+
+            if start is not None:
+                self.wait_seconds += time.time() - start
+
+            self.checkouts += 1
+            self._size += 1
+
+        try:
+            return self.engine.connect()
+        except Exception:
+            self._checked_in()
+            raise
+
+    def _checked_in(self):
+        with self._condition:
+            self._size -= 1
+            self._condition.notify()
+
+    def release(self, connection):
+        """ close connection, returning it to the engine, and make room for
+        another one """
+        try:
+            connection.close()
+        finally:
+            self._checked_in()
+
+    def discard(self, connection):
+        """ close connection after an error and make room for another
+        one """
+        try:
+            connection.close()
+        except Exception:
+            pass
+        finally:
+            self._checked_in()
+
+    def connection(self, exclusive=False):
+        """ return a context manager which checks a connection out:
+
+            with pool.connection() as connection:
+                connection.execute(sql, vals)
+
+        Inside of a connection_scope, the connection is held until the scope
+        exits, unless exclusive is True.
+        """
+        return _Checkout(self, exclusive)
+
+    def stats(self):
+        return {
+            'size': self._size,
+            'max_size': self.max_size,
+            'checkouts': self.checkouts,
+            'waits': self.waits,
+            'wait_seconds': self.wait_seconds,
+        }
+
+    def __repr__(self):
+        return (
+            '<ConnectionPool size:{size}/{max_size}; '
+            'checkouts:{checkouts}; waits:{waits}; '
+            'wait_seconds:{wait_seconds:.3f}>'
+        ).format(**self.stats())
+
+
+# {engine: ConnectionPool} of the pools made by pool_for.  Engines which
+# can't be weakly referenced are kept in _strong_pools
+_pools = weakref.WeakKeyDictionary()
+_strong_pools = {}
+_pools_lock = threading.Lock()
+
+
+def pool_for(engine):
+    """ return the ConnectionPool shared by the SQLQuerys of engine which
+    weren't given one of their own """
+    with _pools_lock:
+        try:
+            pools = _pools
+            pool = pools.get(engine)
+        except TypeError:
+            pools = _strong_pools
+            pool = pools.get(engine)
+
+        if pool is None:
+            pool = pools[engine] = ConnectionPool(engine)
+        return pool
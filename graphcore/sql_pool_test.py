@@ -0,0 +1,118 @@
+import time
+import pytest
+import threading
+
+from .sql_pool import ConnectionPool, PoolTimeout, connection_scope, pool_for
+
+
+class Connection(object):
+
+    def __init__(self):
+        self.closed = False
+        self.executed = []
+
+    def execute(self, sql, vals):
+        self.executed.append((sql, vals))
+
+    def close(self):
+        self.closed = True
+
+
+class Engine(object):
+
+    def connect(self):
+        return Connection()
+
+
+def test_close_on_release():
+    pool = ConnectionPool(Engine())
+
+    with pool.connection() as first:
+        assert pool.stats()['size'] == 1
+    with pool.connection() as second:
+        pass
+
+    # connections are handed back to the engine rather than kept open
+    assert first.closed
+    assert second.closed
+    assert first is not second
+    assert pool.stats()['size'] == 0
+    assert pool.stats()['checkouts'] == 2
+
+
+def test_connection_scope():
+    pool = ConnectionPool(Engine())
+
+    with connection_scope():
+        with pool.connection() as first:
+            pass
+        with connection_scope():
+            with pool.connection() as second:
+                pass
+        # the connection is held until the outer scope exits
+        assert not first.closed
+
+    assert first is second
+    assert first.closed
+    assert pool.stats()['checkouts'] == 1
+    assert pool.stats()['size'] == 0
+
+
+def test_discard_on_error():
+    pool = ConnectionPool(Engine())
+
+    with pytest.raises(ValueError):
+        with connection_scope():
+            with pool.connection() as connection:
+                raise ValueError()
+
+    assert connection.closed
+    assert pool.stats()['size'] == 0
+
+
+def test_bounded():
+    pool = ConnectionPool(Engine(), max_size=1)
+    connection = pool.acquire()
+
+    def release():
+        time.sleep(0.05)
+        pool.release(connection)
+
+    thread = threading.Thread(target=release)
+    thread.start()
+    assert pool.acquire() is not connection
+    thread.join()
+
+    assert connection.closed
+    assert pool.stats()['size'] == 1
+    assert pool.stats()['waits'] == 1
+    assert pool.stats()['wait_seconds'] > 0
+
+
+def test_timeout():
+    pool = ConnectionPool(Engine(), max_size=1, timeout=0.01)
+    pool.acquire()
+
+    with pytest.raises(PoolTimeout):
+        pool.acquire()
+    assert pool.stats()['wait_seconds'] >= 0.01
+
+
+def test_pool_for():
+    engine = Engine()
+    assert pool_for(engine) is pool_for(engine)
+    assert pool_for(engine) is not pool_for(Engine())
+
+
+def test_exclusive():
+    pool = ConnectionPool(Engine())
+
+    with connection_scope():
+        with pool.connection() as held:
+            pass
+        with pool.connection(exclusive=True) as exclusive:
+            pass
+
+    assert held is not exclusive
+    assert held.closed and exclusive.closed
+    assert pool.stats()['size'] == 0
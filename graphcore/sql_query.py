@@ -1,10 +1,46 @@
+import re
 import six
 import sql_query_dict
+from decimal import Decimal, InvalidOperation
+from collections import OrderedDict, defaultdict
 
 from .equality_mixin import EqualityMixin, HashMixin
 from .rule import Cardinality
 from .call_graph import Node
-from .result_set import NoResult
+from .result_set import NoResult, input_mapping as _kwargs_names
+from .parameter import bind_parameters, contains_parameters
+from .sql_pool import pool_for, connection_scope
+from .sql_statement import StatementCache, render, value_shape, is_parameter
+
+
+def _is_column(column):
+    """ True if column is a plain column, without a comparison operator """
+    return re.match(r'^[\w.]+$', column) is not None
+
+
+def _hashable(value):
+    try:
+        hash(value)
+    except TypeError:
+        return False
+    return True
+
+
+def _loose_key(value):
+    """ a key which matches value to the value the database returns for it
+    when the two differ in type (a str id compared with an int column) or
+    case (a case insensitive collation) """
+    if isinstance(value, six.string_types):
+        try:
+            return Decimal(value)
+        except (InvalidOperation, ValueError):
+            return value.lower()
+    return value
+
+
+def _chunks(values, size):
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
 
 
 def parse_comma_seperated_set(input):
@@ -20,9 +56,15 @@ def parse_comma_seperated_list(input):
 
 class SQLQuery(HashMixin, EqualityMixin):
 
+    # the rendered SQL of each structure of call, shared by every SQLQuery
+    # and so by the copies made by the optimizer.  See sql_statement
+    statement_cache = StatementCache()
+
     def __init__(self, tables, selects, where,
                  limit=None, one_column=False, first=False,
-                 input_mapping=None, engine=None, param_style='%s'):
+                 input_mapping=None, engine=None, param_style='%s',
+                 batch_size=None, pool=None, stream=False,
+                 fetch_size=1000):
         """
         tables: ['table_name_1', 'table_name_2', ...] or
                 'table_name_1, table_name_2, ...'
@@ -54,9 +96,31 @@ class SQLQuery(HashMixin, EqualityMixin):
 
                 engine.connect().execute(SQL, vals)
 
+            connections are checked out of the ConnectionPool shared by
+            every SQLQuery of engine.  See sql_pool.
+
         param_style: str
             the style the engine expects parameters to take.  MySQL expects
             %s and sqlite expects ?
+
+        batch_size: int
+            if set, QueryPlan makes one call to call_batch for all of the
+            rows of a node, which looks them up with `column IN (...)`
+            queries of at most batch_size values each.
+
+        pool: ConnectionPool
+            the pool to check connections out of instead of the shared pool
+            of engine.  engine may be left out.
+
+        stream: bool
+            if stream is True (and first is not), __call__ returns a
+            generator which fetches the rows fetch_size at a time with a
+            server side cursor, when the engine supports one, on a
+            connection of its own.  The connection is returned to the pool
+            once the generator is exhausted or closed.  Rows aren't
+            buffered, so a many cardinality rule over a large table runs in
+            bounded memory and its first rows arrive sooner.  call_batch
+            still fetches all of the rows of each batch.
         """
 
         self.tables = parse_comma_seperated_set(tables)
@@ -71,6 +135,10 @@ class SQLQuery(HashMixin, EqualityMixin):
             self.input_mapping = {}
         self.engine = engine
         self.param_style = param_style
+        self.batch_size = batch_size
+        self.pool = pool
+        self.stream = stream
+        self.fetch_size = fetch_size
 
     @property
     def __name__(self):
@@ -80,7 +148,8 @@ class SQLQuery(HashMixin, EqualityMixin):
         return (
             '<SQLQuery tables:{tables}; selects:{selects}; where:{where} '
             'input_mapping:{input_mapping}; limit:{limit}; '
-            'one_column:{one_column}; first:{first}>'
+            'one_column:{one_column}; first:{first}; '
+            'batch_size:{batch_size}>'
         ).format(
             tables=', '.join(self.tables),
             selects=', '.join(self.selects),
@@ -89,6 +158,7 @@ class SQLQuery(HashMixin, EqualityMixin):
             limit=self.limit,
             one_column=self.one_column,
             first=self.first,
+            batch_size=self.batch_size,
         )
 
     def copy(self):
@@ -98,8 +168,22 @@ class SQLQuery(HashMixin, EqualityMixin):
             input_mapping=dict(self.input_mapping),
             engine=self.engine,
             param_style=self.param_style,
+            batch_size=self.batch_size,
+            pool=self.pool,
+            stream=self.stream,
+            fetch_size=self.fetch_size,
         )
 
+    def has_parameters(self):
+        return contains_parameters(self.where)
+
+    def bind_parameters(self, params):
+        """ return a copy of self with the Parameters in where bound to their
+        values in params """
+        new = self.copy()
+        new.where = bind_parameters(self.where, params)
+        return new
+
     def _assert_flattenable(self):
         """ ensure that the query is flattenable
 
@@ -203,6 +287,7 @@ class SQLQuery(HashMixin, EqualityMixin):
 
         # can't merge sql queries backed by different databases
         assert self.engine == other.engine
+        assert self.pool == other.pool
 
         return self.__class__(
             self.tables.union(other.tables),
@@ -211,62 +296,362 @@ class SQLQuery(HashMixin, EqualityMixin):
             input_mapping=input_mapping,
             engine=self.engine,
             param_style=self.param_style,
+            batch_size=self.batch_size,
+            pool=self.pool,
+            stream=self.stream,
+            fetch_size=self.fetch_size,
         )
 
     def __call__(self, **kwargs):
+        sql, vals = self._sql(kwargs)
+
+        if self.stream and not self.first:
+            return self._stream_result(self.iter_driver(sql, vals))
+
+        return self._result(self.driver(sql, vals))
+
+    def _sql(self, kwargs):
+        """ return the (sql, vals) of a call with kwargs """
+        self._check_kwargs(kwargs)
+
+        if all(is_parameter(value) for value in kwargs.values()):
+            statement = self._statement(kwargs)
+            return statement.sql, statement.values(self.where, kwargs)
+
+        # kwargs which are rendered into the SQL, like lists, would only
+        # fill the cache with statements used once
+        return sql_query_dict.select(
+            self.tables, self.selects, self._where(kwargs),
+            limit=self.limit, param_style=self.param_style
+        )
+
+    def _statement_key(self, kwargs):
+        return (
+            frozenset(self.tables), tuple(self.selects),
+            tuple(
+                value_shape(key, value) for key, value in self.where.items()
+            ),
+            tuple(sorted(
+                (name,) + value_shape(self.input_mapping[name], value)
+                for name, value in kwargs.items()
+            )),
+            self.limit, self.param_style,
+        )
+
+    def _statement(self, kwargs):
+        """ return the cached Statement of a call with kwargs, rendering it
+        if this is the first call with its structure """
+        key = self._statement_key(kwargs)
+
+        statement = self.statement_cache.get(key)
+        if statement is None:
+            statement = render(
+                self.tables, self.selects, self.where, self.input_mapping,
+                kwargs, limit=self.limit, param_style=self.param_style
+            )
+            self.statement_cache.put(key, statement)
+
+        return statement
+
+    def _check_kwargs(self, kwargs):
         if set(self.input_mapping.keys()) != set(kwargs.keys()):
             raise ValueError('input mapping keys {} != kwargs keys {}'.format(
                 self.input_mapping.keys(), kwargs.keys()
             ))
 
-        # compose where query
+    def _where(self, kwargs):
+        """ compose the where clause of a call with kwargs """
+        self._check_kwargs(kwargs)
+
         where = self.where.copy()
         for k, v in kwargs.items():
             where[self.input_mapping[k]] = v
+        return where
 
-        sql, vals = sql_query_dict.select(
-            self.tables, self.selects, where, limit=self.limit,
-            param_style=self.param_style
-        )
+    @property
+    def pageable(self):
+        """ True if iter_pages can be used in place of __call__.  Streamed
+        results already stop being fetched when the caller stops
+        iterating """
+        return not self.first and not self.stream
+
+    def iter_pages(self, page_size, **kwargs):
+        """ lazily yield the values __call__ would return.  The query is run
+        once and its rows are fetched page_size at a time, doubling after
+        each page up to fetch_size, so no more rows are fetched once the
+        caller stops iterating.  See iter_driver.
+
+        Without an engine or pool (subclasses which override driver), the
+        rows are all fetched by driver.
+        """
+        sql, vals = self._sql(kwargs)
+        if self.engine is None and self.pool is None:
+            return iter(self._result(self.driver(sql, vals)))
+
+        return self._stream_result(self.iter_driver(sql, vals, page_size))
+
+    def limited(self, limit):
+        """ return a copy of self which returns at most limit rows """
+        if self.limit is not None and self.limit <= limit:
+            return self
 
-        ret = self.driver(sql, vals)
+        new = self.copy()
+        new.limit = limit
+        return new
 
+    def _result(self, rows):
         if self.one_column:
-            ret = [row[0] for row in ret]
+            rows = [row[0] for row in rows]
 
         if self.first:
-            if len(ret):
-                ret = ret[0]
+            if len(rows):
+                return rows[0]
             else:
                 raise NoResult()
 
+        return rows
+
+    def _stream_result(self, rows):
+        if self.one_column:
+            for row in rows:
+                yield row[0]
+        else:
+            for row in rows:
+                yield row
+
+    @property
+    def batch(self):
+        """ True if QueryPlan should use call_batch """
+        if not self.batch_size or self.limit is not None:
+            return False
+
+        return bool(self.input_mapping) and all(
+            _is_column(column) for column in self.input_mapping.values()
+        )
+
+    def call_batch(self, calls):
+        """ given a list of kwargs, return a list of the value __call__ would
+        return (or the exception it would raise) for each of them.
+
+        Calls are grouped by the value of the first input (sorted by name),
+        and each group is run as `column IN (...)` queries of at most
+        batch_size values.  The rows are then scattered back to the calls
+        they belong to.  All of the queries use the same connection.
+        """
+        with connection_scope():
+            return self._call_batch(calls)
+
+    def _call_batch(self, calls):
+        batch_key = sorted(self.input_mapping)[0]
+        column = self.input_mapping[batch_key]
+
+        ret = [None] * len(calls)
+
+        # {(other inputs): [batch_key values]}
+        groups = OrderedDict()
+        for i, kwargs in enumerate(calls):
+            value = kwargs[batch_key]
+            others = tuple(sorted(
+                (k, v) for k, v in kwargs.items() if k != batch_key
+            ))
+
+            # None becomes IS NULL and lists become IN (...), neither of
+            # which can be batched
+            if (value is None or isinstance(value, (list, tuple)) or
+                    not _hashable(value) or not _hashable(others)):
+                try:
+                    ret[i] = self(**kwargs)
+                except Exception as e:
+                    ret[i] = e
+                continue
+
+            values = groups.setdefault(others, OrderedDict())
+            values.setdefault(value, []).append(i)
+
+        for others, values in groups.items():
+            rows = defaultdict(list)
+            # the database may coerce the values it compares, so rows which
+            # don't match any value exactly are matched by _loose_key
+            loose_rows = defaultdict(list)
+            for chunk in _chunks(list(values), self.batch_size):
+                for row in self._select_in(others, column, chunk):
+                    row = tuple(row)
+                    rows[row[-1]].append(row[:-1])
+                    loose_rows[_loose_key(row[-1])].append(row[:-1])
+
+            for value, indexes in values.items():
+                if value in rows:
+                    value_rows = rows[value]
+                else:
+                    value_rows = loose_rows.get(_loose_key(value), [])
+
+                try:
+                    result = self._result(value_rows)
+                except Exception as e:
+                    result = e
+
+                for i in indexes:
+                    ret[i] = result
+
         return ret
 
-    def driver(self, sql, vals):
+    def _select_in(self, others, column, values):
+        where = self.where.copy()
+        for k, v in others:
+            where[self.input_mapping[k]] = v
+        where[column] = list(values)
+
+        # the batched column is selected last so rows can be scattered back
+        sql, vals = sql_query_dict.select(
+            self.tables, self.selects + [column], where,
+            param_style=self.param_style
+        )
+
+        return self.driver(sql, vals)
+
+    def _pool(self):
+        if self.pool is not None:
+            return self.pool
         if self.engine is None:
             raise ValueError('can not execute SQLQueries with no engine')
+        return pool_for(self.engine)
 
-        return self.engine.execute(sql, vals).fetchall()
+    def driver(self, sql, vals):
+        with self._pool().connection() as connection:
+            return connection.execute(sql, vals).fetchall()
+
+    def iter_driver(self, sql, vals, page_size=None):
+        """ yield the rows of sql, fetching them fetch_size at a time.  If
+        page_size is given, the first page_size rows are fetched first and
+        the size of each fetch doubles from there up to fetch_size """
+        if page_size:
+            fetch_size = page_size
+            max_fetch_size = max(page_size, self.fetch_size)
+        else:
+            fetch_size = max_fetch_size = self.fetch_size
+
+        # the cursor stays open while the caller iterates, so other queries
+        # can't share its connection
+        with self._pool().connection(exclusive=True) as connection:
+            if hasattr(connection, 'execution_options'):
+                # ask sqlalchemy for a server side cursor
+                connection = connection.execution_options(stream_results=True)
+
+            result = connection.execute(sql, vals)
+            try:
+                while True:
+                    rows = result.fetchmany(fetch_size)
+                    if not rows:
+                        return
+                    for row in rows:
+                        yield row
+                    fetch_size = min(fetch_size * 2, max_fetch_size)
+            finally:
+                result.close()
+
+    def _merge_where(self, where):
+        """ add the clauses of where to self.where.  Clauses which are
+        already there must have the same value """
+        for key, value in where.items():
+            if key in self.where and self.where[key] != value:
+                raise ValueError(
+                    'where clauses had conflicting values for {key}: '
+                    '{a} != {b}'.format(key=key, a=self.where[key], b=value)
+                )
+            self.where[key] = value
+
+    @staticmethod
+    def sibling_key(node):
+        """ return a key which is equal for the sibling nodes
+        merge_like_siblings can merge without changing their results, or
+        None if node shouldn't be merged.
+
+        Only lookups of the first row (rules with Cardinality.one) are
+        merged, and only with lookups of the same rows: the same tables,
+        where clause and column for each incoming path.  Selecting more
+        columns doesn't change which row is first.
+        """
+        function = node.function
+        if node.cardinality != Cardinality.one or not function.first:
+            return None
+        if function.limit is not None:
+            return None
+
+        paths = {
+            name: path for path, name in
+            _kwargs_names(node.incoming_paths).items()
+        }
+        try:
+            inputs = sorted(
+                (paths[name], column)
+                for name, column in function.input_mapping.items()
+            )
+        except KeyError:
+            return None
+
+        return (
+            type(function), function.engine, function.pool,
+            function.param_style, function.batch_size, function.tables,
+            function.where, node.incoming_paths, inputs,
+        )
 
     @staticmethod
     def merge_like_siblings(nodes):
-        # combine nodes
+        """ merge SQLQuery nodes with Cardinality.one which share an input
+        into one node which selects the columns of all of them.
+
+        A node is called with kwargs named after its incoming paths, so the
+        input_mapping of each node is renamed to the kwargs of the merged
+        node.  If two nodes map the same kwarg to different columns, the
+        columns are joined in the where clause.
+        """
         incoming_paths = []
         outgoing_paths = []
         relations = []
         for node in nodes:
-            incoming_paths.extend(node.incoming_paths)
+            for path in node.incoming_paths:
+                if path not in incoming_paths:
+                    incoming_paths.append(path)
             outgoing_paths.extend(node.outgoing_paths)
             relations.extend(node.relations)
 
+        # {path: kwarg name} of the merged node
+        kwargs_names = _kwargs_names(incoming_paths)
+
         function = nodes[0].function.copy()
+        function.selects = []
+        function.where = {}
+        function.input_mapping = {}
         function.one_column = False
-        for node in nodes[1:]:
-            function.tables.update(node.function.tables)
-            function.where.update(node.function.where)
-            function.selects.extend(node.function.selects)
-            assert function.input_mapping == node.function.input_mapping
-            function.input_mapping.update(node.function.input_mapping)
+        for node in nodes:
+            other = node.function
+            if other.engine != function.engine or other.pool != function.pool:
+                raise ValueError(
+                    "can't merge SQLQueries backed by different databases"
+                )
+
+            function.tables.update(other.tables)
+            function.selects.extend(other.selects)
+            function._merge_where(other.where)
+
+            paths = {
+                name: path for path, name in
+                _kwargs_names(node.incoming_paths).items()
+            }
+            for name, column in other.input_mapping.items():
+                name = kwargs_names[paths[name]]
+                mapped = function.input_mapping.setdefault(name, column)
+                if mapped == column:
+                    continue
+
+                if not (_is_column(mapped) and _is_column(column)):
+                    raise ValueError((
+                        "can't join {mapped} and {column}, which are both "
+                        "mapped to {name}"
+                    ).format(mapped=mapped, column=column, name=name))
+                function._merge_where({
+                    column: sql_query_dict.mysql_col(mapped)
+                })
 
         return Node(
             None, incoming_paths, outgoing_paths, function, Cardinality.one,
@@ -7,6 +7,7 @@ except ImportError:
     import mock
 
 from .sql_query import SQLQuery
+from .result_set import NoResult
 from .call_graph import Node
 
 
@@ -26,6 +27,86 @@ def test_unqualified_select():
         )
 
 
+def _property(column, **kwargs):
+    return Node(None, ['user.id'], ['user.' + column], SQLQuery(
+        ['users'], 'users.' + column, {}, input_mapping={'id': 'users.id'},
+        one_column=True, first=True, **kwargs
+    ), 'one')
+
+
+def test_merge_like_siblings():
+    merged = SQLQuery.merge_like_siblings([
+        _property('first_name'), _property('last_name'),
+    ])
+
+    assert merged == Node(
+        None, ['user.id'], ['user.first_name', 'user.last_name'], SQLQuery(
+            ['users'], ['users.first_name', 'users.last_name'], {},
+            input_mapping={'id': 'users.id'}, first=True,
+        ), 'one'
+    )
+
+
+def test_merge_like_siblings_different_input_mapping():
+    name = Node(None, ['user.id'], ['user.name'], SQLQuery(
+        ['users'], 'users.name', {}, input_mapping={'id': 'users.id'},
+        first=True,
+    ), 'one')
+    bio = Node(None, ['user.id', 'book.id'], ['user.bio'], SQLQuery(
+        ['profiles'], 'profiles.bio', {}, input_mapping={
+            'user_id': 'profiles.user_id', 'book_id': 'profiles.book_id',
+        }, first=True,
+    ), 'one')
+
+    merged = SQLQuery.merge_like_siblings([name, bio])
+
+    # id is renamed to user_id, which both users.id and profiles.user_id
+    # are equal to
+    assert merged.incoming_paths == ('book.id', 'user.id')
+    assert merged.function == SQLQuery(
+        ['users', 'profiles'], ['users.name', 'profiles.bio'], {
+            'profiles.user_id': sql_query_dict.mysql_col('users.id'),
+        }, input_mapping={
+            'user_id': 'users.id', 'book_id': 'profiles.book_id',
+        }, first=True,
+    )
+
+
+def test_merge_like_siblings_conflicting_where():
+    with pytest.raises(ValueError):
+        SQLQuery.merge_like_siblings([
+            Node(None, [], ['user.name'], SQLQuery(
+                ['users'], 'users.name', {'users.id': 1}, first=True
+            ), 'one'),
+            Node(None, [], ['user.age'], SQLQuery(
+                ['users'], 'users.age', {'users.id': 2}, first=True
+            ), 'one'),
+        ])
+
+
+def test_sibling_key():
+    key = SQLQuery.sibling_key(_property('first_name'))
+    assert key is not None
+    assert key == SQLQuery.sibling_key(_property('last_name'))
+
+    # different rows
+    assert key != SQLQuery.sibling_key(Node(
+        None, ['user.id'], ['user.last_name'], SQLQuery(
+            ['users'], 'users.last_name', {'users.active': True},
+            input_mapping={'id': 'users.id'}, first=True,
+        ), 'one'
+    ))
+    assert key != SQLQuery.sibling_key(_property('age', batch_size=10))
+
+    # every row
+    assert SQLQuery.sibling_key(Node(
+        None, ['user.id'], ['user.books.id'], SQLQuery(
+            ['books'], 'books.id', {}, input_mapping={'id': 'books.user_id'},
+            one_column=True,
+        ), 'many'
+    )) is None
+
+
 def test_simple_query_merge():
     book_id = SQLQuery(['users', 'books'], 'books.id', {
         'users.id': 1,
@@ -237,6 +318,145 @@ def test_call_with_input_mapping():
     assert sql_query(name='john') == 4
 
 
+def test_batch():
+    sql_query = SQLQuery(['users'], 'users.name', {}, input_mapping={
+        'id': 'users.id'
+    }, one_column=True, first=True)
+    assert not sql_query.batch
+
+    sql_query.batch_size = 2
+    assert sql_query.batch
+
+    sql_query.input_mapping = {'id': 'users.id>'}
+    assert not sql_query.batch
+
+
+def test_call_batch():
+    sql_query = SQLQuery(['users'], 'users.name', {}, input_mapping={
+        'id': 'users.id'
+    }, one_column=True, first=True, batch_size=2)
+
+    names = {1: 'a', 2: 'b', 4: 'd'}
+    queries = []
+
+    def driver(sql, vals):
+        queries.append(sql)
+        ids = eval(sql[sql.index('IN') + 2:sql.rindex(')')])
+        if not isinstance(ids, tuple):
+            ids = (ids,)
+        return [(names[id], id) for id in ids if id in names]
+
+    sql_query.driver = driver
+
+    ret = sql_query.call_batch([{'id': 1}, {'id': 2}, {'id': 3}, {'id': 4}])
+
+    assert len(queries) == 2
+    assert 'users.id IN (1,2)' in queries[0]
+    assert 'users.id IN (3,4)' in queries[1]
+    assert ret[0] == 'a'
+    assert ret[1] == 'b'
+    assert isinstance(ret[2], NoResult)
+    assert ret[3] == 'd'
+
+
+def test_call_batch_coerced_values():
+    sql_query = SQLQuery(['users'], 'users.name', {}, input_mapping={
+        'name': 'users.name'
+    }, one_column=True, first=True, batch_size=10)
+    # a case insensitive collation returns the stored case
+    sql_query.driver = mock.MagicMock(
+        return_value=[('Bob', 'Bob'), ('bob2', 'bob2')]
+    )
+
+    assert sql_query.call_batch([
+        {'name': 'bob'}, {'name': 'Bob'}, {'name': 'BOB2'},
+    ]) == ['Bob', 'Bob', 'bob2']
+
+
+def test_call_batch_str_id_int_column():
+    import sqlalchemy
+
+    engine = sqlalchemy.create_engine('sqlite://')
+    engine.execute('CREATE TABLE users (id INTEGER PRIMARY KEY, name TEXT)')
+    engine.execute("INSERT INTO users VALUES (1, 'alice'), (2, 'bob')")
+
+    sql_query = SQLQuery(['users'], 'users.name', {}, input_mapping={
+        'id': 'users.id'
+    }, one_column=True, first=True, batch_size=10, engine=engine,
+        param_style='?')
+
+    alice, bob, missing = sql_query.call_batch([
+        {'id': '1'}, {'id': 2}, {'id': '3'},
+    ])
+    assert (alice, bob) == ('alice', 'bob')
+    assert isinstance(missing, NoResult)
+
+
+def test_call_batch_many():
+    sql_query = SQLQuery(['books'], 'books.id', {}, input_mapping={
+        'id': 'books.user_id'
+    }, one_column=True, batch_size=10)
+    sql_query.driver = mock.MagicMock(
+        return_value=[(10, 1), (11, 1), (30, 3)]
+    )
+
+    assert sql_query.call_batch([{'id': 1}, {'id': 2}, {'id': 3}]) == [
+        [10, 11], [], [30]
+    ]
+    assert sql_query.driver.call_count == 1
+
+
+def test_iter_pages():
+    from itertools import islice
+    from .sql_pool import ConnectionPool
+
+    result = StreamResult((i,) for i in range(20))
+    connection = StreamConnection(result)
+    queries = []
+    connection.execute = lambda sql, vals: queries.append(sql) or result
+    pool = ConnectionPool(mock.Mock(connect=lambda: connection))
+
+    sql_query = SQLQuery(
+        ['users'], 'users.id', {}, one_column=True, pool=pool, fetch_size=6,
+    )
+
+    rows = sql_query.iter_pages(2)
+    assert list(islice(rows, 3)) == [0, 1, 2]
+    # one query, whose rows are fetched in pages which double in size up to
+    # fetch_size
+    assert len(queries) == 1
+    assert 'OFFSET' not in queries[0]
+    assert result.fetches == [2, 4]
+
+    assert list(rows) == list(range(3, 20))
+    assert result.fetches == [2, 4, 6, 6, 6, 6]
+    assert result.closed
+
+
+def test_iter_pages_driver():
+    sql_query = SQLQuery(['users'], 'users.id', {}, one_column=True)
+    sql_query.driver = mock.MagicMock(return_value=[(1,), (2,)])
+
+    # without an engine or pool, the rows are all fetched by driver
+    assert list(sql_query.iter_pages(1)) == [1, 2]
+    assert sql_query.driver.call_count == 1
+
+
+def test_limited():
+    sql_query = SQLQuery(['users'], 'users.id', {}, one_column=True)
+
+    limited = sql_query.limited(5)
+    assert limited.limit == 5
+    assert sql_query.limit is None
+    assert limited.limited(10) is limited
+    assert limited.limited(2).limit == 2
+
+
+def test_pageable():
+    assert SQLQuery(['users'], 'users.id', {}).pageable
+    assert not SQLQuery(['users'], 'users.id', {}, first=True).pageable
+
+
 def test_copy():
     sql_query = SQLQuery(
         ['x'], ['x.a'], {'x.b': 2}, input_mapping={'x_c': 'x.c'}
@@ -278,3 +498,58 @@ def test_driver():
 
     assert sql_query()[0].name == name
     assert sql_query()[0][0] == name
+
+
+class StreamResult(object):
+
+    def __init__(self, rows):
+        self.rows = list(rows)
+        self.fetches = []
+        self.closed = False
+
+    def fetchmany(self, size):
+        self.fetches.append(size)
+        rows, self.rows = self.rows[:size], self.rows[size:]
+        return rows
+
+    def close(self):
+        self.closed = True
+
+
+class StreamConnection(object):
+
+    def __init__(self, result):
+        self.result = result
+
+    def execute(self, sql, vals):
+        return self.result
+
+    def close(self):
+        pass
+
+
+def test_stream():
+    from itertools import islice
+    from .sql_pool import ConnectionPool
+
+    result = StreamResult((i,) for i in range(10))
+    connection = StreamConnection(result)
+    pool = ConnectionPool(mock.Mock(connect=lambda: connection))
+
+    sql_query = SQLQuery(
+        ['users'], 'users.id', {}, one_column=True, pool=pool, stream=True,
+        fetch_size=3,
+    )
+    assert not sql_query.pageable
+
+    rows = sql_query()
+    # nothing is fetched until the rows are iterated
+    assert result.fetches == []
+
+    assert list(islice(rows, 4)) == [0, 1, 2, 3]
+    assert result.fetches == [3, 3]
+    assert pool.stats()['size'] == 1
+
+    rows.close()
+    assert result.closed
+    assert pool.stats()['size'] == 0
@@ -15,17 +15,30 @@ def _column_to_property(column):
 class SQLReflector(object):
 
     def __init__(self, graphcore, engine, sql_query_class=SQLQuery,
-                 param_style='%s', exclude_tables=None):
+                 param_style='%s', exclude_tables=None, batch_size=None,
+                 pool=None, stream=False, fetch_size=1000):
         """ add rules to graphcore instance based on schema found in SQL db.
 
         graphcore: Graphcore instance
         engine: sqlalchemy.engine instance
+        batch_size: if set, rules which take ids look up the rows of a node
+            together with `id IN (...)` queries of this many ids.  See
+            SQLQuery.
+        pool: a ConnectionPool the rules execute their queries with.  See
+            sql_pool.
+        stream: if True, the many cardinality rules (backrefs and the ids
+            of each table) stream their rows fetch_size at a time instead
+            of loading them all at once.  See SQLQuery.
 
         assumes all tables have a primary key id
         """
         self.graphcore = graphcore
         self.sql_query_class = sql_query_class
         self.param_style = param_style
+        self.batch_size = batch_size
+        self.pool = pool
+        self.stream = stream
+        self.fetch_size = fetch_size
 
         if exclude_tables is None:
             exclude_tables = []
@@ -99,7 +112,9 @@ class SQLReflector(object):
             [table], '{}.id'.format(table), {},
             input_mapping={
                 'id': '{}.{}'.format(table, column),
-            }, one_column=True, param_style=self.param_style
+            }, one_column=True, param_style=self.param_style,
+            batch_size=self.batch_size, pool=self.pool, stream=self.stream,
+            fetch_size=self.fetch_size,
         )
 
     def _sql_query_property(self, table, column):
@@ -107,13 +122,15 @@ class SQLReflector(object):
             [table], '{}.{}'.format(table, column), {},
             input_mapping={
                 'id': '{}.id'.format(table),
-            }, one_column=True, first=True, param_style=self.param_style
+            }, one_column=True, first=True, param_style=self.param_style,
+            batch_size=self.batch_size, pool=self.pool,
         )
 
     def _sql_query_unground_property(self, table, column):
         return self.sql_query_class(
             [table], '{}.{}'.format(table, column), {},
-            one_column=True, param_style=self.param_style
+            one_column=True, param_style=self.param_style, pool=self.pool,
+            stream=self.stream, fetch_size=self.fetch_size,
         )
 
     def sql_reflect_column(self, table, column_name):
@@ -0,0 +1,178 @@
+"""
+The StatementCache holds the SQL rendered for each structure of SQLQuery
+call: its tables, selects, where keys (and operators), input_mapping and
+limit.  Values which are sent to the database as parameters aren't part of
+the structure, so a call only has to look its statement up and put its
+values in parameter order instead of rendering the SQL again.
+
+Values which sql_query_dict renders into the SQL itself (None, lists,
+mysql_col, ...) are part of the structure.
+"""
+
+import six
+import threading
+from collections import OrderedDict
+
+import sql_query_dict
+
+
+# the shape of a value sent to the database as a parameter
+_PARAMETER = object()
+
+# types which are always sent as parameters.  Subclasses such as mysql_col
+# are not
+_PARAMETER_TYPES = frozenset(
+    (bool, float, bytes) + six.integer_types + six.string_types
+)
+
+# values which sql_query_dict renders into the SQL: IS NULL, NOW() and
+# clauses it leaves out
+_RENDERED_VALUES = (
+    None, sql_query_dict.mysql_now, sql_query_dict.mysql_ignore
+)
+
+
+def is_parameter(value):
+    """ True if sql_query_dict sends value as a parameter rather than
+    rendering it into the SQL """
+    if type(value) in _PARAMETER_TYPES:
+        return True
+    if isinstance(value, (list, tuple, set, frozenset, dict)):
+        return False
+    if isinstance(value, sql_query_dict.mysql_col):
+        return False
+    return not any(value is rendered for rendered in _RENDERED_VALUES)
+
+
+def _between(key):
+    return key[-2:] == '><'
+
+
+def value_shape(key, value):
+    """ the part of the statement key contributed by the where clause
+    key: value """
+    if _between(key) and isinstance(value, (list, tuple)) and all(
+        is_parameter(v) for v in value
+    ):
+        return (key, len(value))
+    if is_parameter(value):
+        return (key, _PARAMETER)
+    return (key, type(value), repr(value))
+
+
+class _Slot(object):
+    """ stands in for a parameter value while a statement is rendered """
+
+    def __init__(self, source, name, index=None):
+        self.source = source
+        self.name = name
+        self.index = index
+
+
+class Statement(object):
+    """ rendered SQL and the order its parameter values are read in """
+
+    def __init__(self, sql, order):
+        self.sql = sql
+        # [(source, name, index)] where source is 'where' or 'kwargs'
+        self.order = tuple(order)
+
+    def values(self, where, kwargs):
+        """ return the parameter values of a call, in order """
+        vals = []
+        for source, name, index in self.order:
+            if source == 'kwargs':
+                value = kwargs[name]
+            else:
+                value = where[name]
+
+            if index is not None:
+                value = value[index]
+            vals.append(value)
+        return vals
+
+
+def _slotted(source, name, key, value):
+    if _between(key) and isinstance(value, (list, tuple)) and all(
+        is_parameter(v) for v in value
+    ):
+        return [_Slot(source, name, i) for i in range(len(value))]
+    if is_parameter(value):
+        return _Slot(source, name)
+    return value
+
+
+def render(tables, selects, where, input_mapping, kwargs, limit=None,
+           param_style='%s'):
+    """ render the Statement of a call with kwargs """
+    slotted = OrderedDict()
+    for key, value in where.items():
+        slotted[key] = _slotted('where', key, key, value)
+    for name, value in kwargs.items():
+        key = input_mapping[name]
+        slotted[key] = _slotted('kwargs', name, key, value)
+
+    sql, slots = sql_query_dict.select(
+        tables, selects, slotted, limit=limit, param_style=param_style
+    )
+
+    return Statement(
+        sql, [(slot.source, slot.name, slot.index) for slot in slots]
+    )
+
+
+class StatementCache(object):
+    """ a thread safe LRU cache of Statements """
+
+    def __init__(self, max_size=1024):
+        self.max_size = max_size
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            try:
+                statement = self._entries.pop(key)
+            except KeyError:
+                self.misses += 1
+                return None
+
+            self._entries[key] = statement
+            self.hits += 1
+            return statement
+
+    def put(self, key, statement):
+        if not self.max_size:
+            return
+
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = statement
+
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        return {
+            'size': len(self),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __repr__(self):
+        return (
+            '<StatementCache size:{size}/{max_size}; hits:{hits}; '
+            'misses:{misses}>'
+        ).format(**self.stats())
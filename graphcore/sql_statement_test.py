@@ -0,0 +1,92 @@
+import pytest
+import sql_query_dict
+
+from .sql_query import SQLQuery
+from .sql_statement import StatementCache, render, value_shape, is_parameter
+
+
+@pytest.mark.parametrize('where', [
+    {},
+    {'users.age>': 3, 'users.name': 'bob'},
+    {'users.age><': (3, 10)},
+    {'users.name': None, 'users.age!=': None},
+    {'users.id': [1, 2, None], 'users.age!=': [4]},
+    {'users.id': sql_query_dict.mysql_col('books.user_id')},
+])
+def test_render_same_as_select(where):
+    kwargs = {'id': 5}
+    statement = render(
+        ['users'], ['users.name'], where, {'id': 'users.id'}, kwargs,
+        limit=2, param_style='?',
+    )
+
+    composed = dict(where)
+    composed['users.id'] = 5
+    sql, vals = sql_query_dict.select(
+        ['users'], ['users.name'], composed, limit=2, param_style='?'
+    )
+    assert statement.sql == sql
+    assert statement.values(where, kwargs) == vals
+
+
+def test_is_parameter():
+    class Value(object):
+        pass
+
+    for value in [1, 1.5, 'a', True, Value()]:
+        assert is_parameter(value)
+
+    for value in [
+        None, [1], (1,), sql_query_dict.mysql_col('users.id'),
+        sql_query_dict.mysql_now, sql_query_dict.mysql_ignore,
+    ]:
+        assert not is_parameter(value)
+
+
+def test_value_shape():
+    assert value_shape('a', 1) == value_shape('a', 2)
+    assert value_shape('a', 1) != value_shape('b', 1)
+    assert value_shape('a', [1]) != value_shape('a', [2])
+    assert value_shape('a', None) != value_shape('a', 'None')
+    assert value_shape('a><', (1, 2)) == value_shape('a><', (3, 4))
+
+
+def test_statement_cache_shared_by_copies(monkeypatch):
+    cache = StatementCache()
+    monkeypatch.setattr(SQLQuery, 'statement_cache', cache)
+
+    calls = []
+
+    def driver(sql, vals):
+        calls.append((sql, vals))
+        return [(vals[-1],)]
+
+    sql_query = SQLQuery(['users'], 'users.name', {'users.age>': 3},
+                         input_mapping={'id': 'users.id'}, one_column=True)
+    sql_query.driver = driver
+    copy = sql_query.bind_parameters({})
+    copy.where['users.age>'] = 5
+    copy.driver = driver
+
+    assert sql_query(id=1) == [1]
+    assert sql_query(id=2) == [2]
+    assert copy(id=3) == [3]
+
+    assert cache.stats()['misses'] == 1
+    assert cache.stats()['hits'] == 2
+    assert calls[0][0] == calls[2][0]
+    assert [vals for _, vals in calls] == [[3, 1], [3, 2], [5, 3]]
+
+    # lists are rendered into the SQL, so they aren't cached
+    sql_query(id=[1, 2])
+    assert len(cache) == 1
+    assert 'IN (1,2)' in calls[-1][0]
+
+
+def test_statement_cache_lru():
+    cache = StatementCache(max_size=1)
+    cache.put('a', 1)
+    cache.put('b', 2)
+
+    assert cache.get('a') is None
+    assert cache.get('b') == 2
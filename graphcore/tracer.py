@@ -0,0 +1,224 @@
+"""
+A Tracer receives a span for each phase of a query: the query itself, the
+QuerySearch, each optimization pass, the QueryPlanner, each node of the
+QueryPlan and a sample of the individual rule calls.  Pass one to
+Graphcore:
+
+    collector = InMemoryCollector(sample_rate=0.01)
+    gc = Graphcore(tracer=collector)
+
+Spans nest: a span started while another is open on the same thread is its
+child, so wrapping an API request in tracer.span('request') ties the queries
+it makes, and the rules that made them slow, to the request.
+
+Subclass Tracer and override on_start and on_end to send spans elsewhere.
+"""
+
+import six
+import json
+import time
+import random
+import itertools
+import threading
+
+
+_span_ids = itertools.count(1)
+
+
+class Span(object):
+    """ a named and timed phase of a query """
+
+    def __init__(self, name, attributes=None, parent=None):
+        self.name = name
+        self.attributes = attributes or {}
+        self.parent = parent
+
+        self.id = next(_span_ids)
+        if parent is None:
+            self.trace_id = self.id
+        else:
+            self.trace_id = parent.trace_id
+
+        self.start = time.time()
+        self.end = None
+        # repr of the exception which ended the span, if any
+        self.error = None
+
+    @property
+    def seconds(self):
+        if self.end is None:
+            return None
+        return self.end - self.start
+
+    def to_json(self):
+        return {
+            'name': self.name,
+            'id': self.id,
+            'parent_id': self.parent.id if self.parent else None,
+            'trace_id': self.trace_id,
+            'start': self.start,
+            'seconds': self.seconds,
+            'attributes': self.attributes,
+            'error': self.error,
+        }
+
+    def __repr__(self):
+        return '<Span {name} {attributes}>'.format(
+            name=self.name, attributes=self.attributes
+        )
+
+
+class _SpanContext(object):
+
+    def __init__(self, tracer, name, attributes, parent):
+        self.tracer = tracer
+        self.name = name
+        self.attributes = attributes
+        self.parent = parent
+
+    def __enter__(self):
+        self.span = self.tracer.start_span(
+            self.name, self.attributes, self.parent
+        )
+        return self.span
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.tracer.end_span(self.span, exc_value)
+
+
+class _NullContext(object):
+
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *args):
+        pass
+
+
+_null_context = _NullContext()
+
+
+def span(tracer, name, **attributes):
+    """ return tracer.span(name, **attributes), or a context manager which
+    does nothing if tracer is None """
+    if tracer is None:
+        return _null_context
+    return tracer.span(name, **attributes)
+
+
+class Tracer(object):
+    """ a Tracer which does nothing with the spans.  Subclasses override
+    on_start and on_end. """
+
+    def __init__(self, sample_rate=1.0, random=random.random):
+        """
+        sample_rate: the fraction of rule calls which get a span.  Every
+            query, search, optimization pass, plan and node gets one.
+        """
+        self.sample_rate = sample_rate
+        self._random = random
+        self._local = threading.local()
+
+    def on_start(self, span):
+        pass
+
+    def on_end(self, span):
+        pass
+
+    def sampled(self):
+        """ True if the next rule call should get a span """
+        return self._random() < self.sample_rate
+
+    def _stack(self):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def current(self):
+        """ the innermost span open on this thread, or None """
+        stack = self._stack()
+        if stack:
+            return stack[-1]
+
+    def start_span(self, name, attributes=None, parent=None):
+        """ start and return a span.  If parent isn't given, the innermost
+        span open on this thread is used """
+        if parent is None:
+            parent = self.current()
+
+        span = Span(name, attributes, parent)
+        self._stack().append(span)
+        self.on_start(span)
+        return span
+
+    def end_span(self, span, error=None):
+        span.end = time.time()
+        if error is not None:
+            span.error = repr(error)
+
+        stack = self._stack()
+        if stack and stack[-1] is span:
+            stack.pop()
+        elif span in stack:
+            stack.remove(span)
+
+        self.on_end(span)
+
+    def span(self, name, parent=None, **attributes):
+        """ return a context manager which starts a span on enter and ends
+        it on exit:
+
+            with tracer.span('request', path='/users'):
+                gc.query(...)
+        """
+        return _SpanContext(self, name, attributes, parent)
+
+
+class InMemoryCollector(Tracer):
+    """ keep every finished span in self.spans """
+
+    def __init__(self, sample_rate=1.0, random=random.random):
+        super(InMemoryCollector, self).__init__(sample_rate, random)
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def on_end(self, span):
+        with self._lock:
+            self.spans.append(span)
+
+    def find(self, name):
+        """ return the finished spans named name """
+        return [span for span in self.spans if span.name == name]
+
+    def clear(self):
+        with self._lock:
+            del self.spans[:]
+
+
+class JSONLinesExporter(Tracer):
+    """ write each finished span to a file as a line of json.  See
+    Span.to_json """
+
+    def __init__(self, file, sample_rate=1.0, random=random.random):
+        """
+        file: a path to append to or a file like object
+        """
+        super(JSONLinesExporter, self).__init__(sample_rate, random)
+        if isinstance(file, six.string_types):
+            self.file = open(file, 'a')
+            self._owns_file = True
+        else:
+            self.file = file
+            self._owns_file = False
+        self._lock = threading.Lock()
+
+    def on_end(self, span):
+        line = json.dumps(span.to_json(), default=repr)
+        with self._lock:
+            self.file.write(line + '\n')
+            self.file.flush()
+
+    def close(self):
+        if self._owns_file:
+            self.file.close()
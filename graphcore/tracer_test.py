@@ -0,0 +1,151 @@
+import io
+import json
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+
+from .graphcore import Graphcore
+from .tracer import InMemoryCollector, JSONLinesExporter, Tracer
+
+
+def test_span_nesting():
+    tracer = InMemoryCollector()
+
+    with tracer.span('request', path='/users') as request:
+        with tracer.span('query') as query:
+            pass
+
+    assert tracer.spans == [query, request]
+    assert query.parent is request
+    assert query.trace_id == request.id
+    assert request.attributes == {'path': '/users'}
+    assert request.seconds >= query.seconds >= 0
+    assert tracer.current() is None
+
+
+def test_span_error():
+    tracer = InMemoryCollector()
+
+    with pytest.raises(ValueError):
+        with tracer.span('query'):
+            raise ValueError('bad')
+
+    assert tracer.spans[0].error == "ValueError('bad')"
+
+
+def test_sampled():
+    values = iter([0.1, 0.6])
+    tracer = Tracer(sample_rate=0.5, random=lambda: next(values))
+
+    assert tracer.sampled()
+    assert not tracer.sampled()
+
+
+def test_json_lines_exporter():
+    file = io.StringIO()
+    tracer = JSONLinesExporter(file)
+
+    with tracer.span('request'):
+        with tracer.span('query', n=1):
+            pass
+
+    query, request = [
+        json.loads(line) for line in file.getvalue().splitlines()
+    ]
+    assert query['name'] == 'query'
+    assert query['attributes'] == {'n': 1}
+    assert query['parent_id'] == request['id']
+    assert request['parent_id'] is None
+
+
+def graphcore(**kwargs):
+    gc = Graphcore(**kwargs)
+
+    gc.register_rule(
+        [], 'user.id', function=lambda: range(3), cardinality='many'
+    )
+
+    @gc.rule(['user.id'], 'user.age')
+    def age(id):
+        return id * 5
+
+    @gc.rule(['user.id'], 'user.name')
+    def name(id):
+        return str(id)
+
+    return gc
+
+
+QUERY = {'user.id?': None, 'user.age?': None, 'user.name?': None}
+
+
+def test_query_spans():
+    tracer = InMemoryCollector()
+    gc = graphcore(tracer=tracer)
+
+    with tracer.span('request') as request:
+        gc.query(QUERY)
+
+    names = [span.name for span in tracer.spans]
+    assert names[:7] == [
+        'search', 'optimize.reduce_like_siblings',
+        'optimize.reduce_like_parent_child', 'optimize.constrain_sql_queries',
+        'optimize', 'plan', 'rule',
+    ]
+    assert names[-3:] == ['execute', 'query', 'request']
+
+    nodes = tracer.find('node')
+    assert [node.attributes['rule'] for node in nodes] == [
+        'user.id = <lambda>()', 'user.age = age(user.id)',
+        'user.name = name(user.id)',
+    ]
+
+    rules = tracer.find('rule')
+    assert len(rules) == 7
+    assert rules[-1].parent is nodes[-1]
+    assert all(span.trace_id == request.id for span in tracer.spans)
+
+    # the second query uses the plan cache
+    tracer.clear()
+    gc.query(QUERY)
+    assert 'search' not in [span.name for span in tracer.spans]
+
+
+def test_query_with_limit_spans():
+    tracer = InMemoryCollector()
+    gc = graphcore(tracer=tracer)
+    gc.query(QUERY, limit=2)
+
+    execute, = tracer.find('execute')
+    nodes = tracer.find('node')
+    # user.id is called once, then age and name are applied to each row
+    assert [node.attributes['rule'] for node in nodes] == [
+        'user.id = <lambda>()',
+        'user.age = age(user.id)', 'user.name = name(user.id)',
+        'user.age = age(user.id)', 'user.name = name(user.id)',
+    ]
+    assert all(node.parent is execute for node in nodes)
+
+    rules = tracer.find('rule')
+    assert len(rules) == 5
+    assert all(span.parent.name == 'node' for span in rules)
+
+
+def test_rule_spans_sampled():
+    tracer = InMemoryCollector(sample_rate=0)
+    graphcore(tracer=tracer).query(QUERY)
+
+    assert tracer.find('rule') == []
+    assert len(tracer.find('node')) == 3
+
+
+def test_executor_rule_spans():
+    tracer = InMemoryCollector()
+    with ThreadPoolExecutor(2) as executor:
+        graphcore(tracer=tracer, executor=executor).query(QUERY)
+
+    execute, = tracer.find('execute')
+    assert len(tracer.find('prefetch')) == 1
+    # rules prefetched on executor threads are children of the execute span
+    assert sorted(
+        span.parent.name for span in tracer.find('rule')
+    ) == ['execute'] * 6 + ['node']
@@ -4,13 +4,16 @@ import sys
 
 install_requires = []
 install_requires.append('six')
-install_requires.append('sql_query_dict>=0.5')
+install_requires.append('sql_query_dict>=0.7')
 install_requires.append('sqlalchemy')
 install_requires.append('inflect')
 install_requires.append('pytest')
 install_requires.append('inflection')
 if sys.version_info < (3, 4):
     install_requires.append('enum34')
+if sys.version_info < (3, 2):
+    # concurrent.futures, used by the executors
+    install_requires.append('futures')
 
 
 setup(